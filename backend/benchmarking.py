@@ -0,0 +1,57 @@
+"""Small helpers shared by the benchmark and load-test management commands."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Latency percentiles (ms) and throughput for a list of per-call durations in seconds."""
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / count * 1000, 2) if count else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if count else 0.0,
+    }
+
+
+def run_concurrently(func, total, concurrency):
+    """
+    Call ``func(i)`` ``total`` times from ``concurrency`` threads.
+
+    Returns ``(latencies, elapsed, errors)``; a call that raises counts as an error.
+    """
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            func(i)
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [r for r in results if r is not None]
+    return latencies, elapsed, len(results) - len(latencies)
+
+
+def format_summary(name, summary):
+    return (
+        f"{name:<28} {summary['requests']:>6} req  {summary['rps']:>8} req/s  "
+        f"p50 {summary['p50_ms']:>8} ms  p95 {summary['p95_ms']:>8} ms  "
+        f"p99 {summary['p99_ms']:>8} ms  errors {summary['errors']}"
+    )
@@ -0,0 +1,355 @@
+"""
+Two-tier cache: a small per-process LRU in front of a shared cache.
+
+    CACHES = {
+        "default": {
+            "BACKEND": "backend.cache.TwoTierCache",
+            "LOCATION": "default",
+            "OPTIONS": {
+                "SHARED_ALIAS": "shared",
+                "LOCAL_PREFIXES": ["tb:"],
+                "LOCAL_MAX_ENTRIES": 2048,
+                "LOCAL_TIMEOUT": 5,
+            },
+        },
+        "shared": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://..."},
+    }
+
+Only keys starting with one of LOCAL_PREFIXES are kept locally; everything
+else (OTPs, verification flags, locks, circuit state) always goes to the
+shared tier. Local copies live for at most LOCAL_TIMEOUT seconds, and never
+past the key's expiry in the shared tier, which bounds how stale a process
+can be if it misses an invalidation. Writes and deletes through
+this backend drop the local copy in every process, using Redis pub/sub on
+INVALIDATION_CHANNEL when the shared tier is Redis.
+"""
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.redis import RedisCache
+
+logger = logging.getLogger(__name__)
+
+# One local tier per LOCATION, shared by every thread of the process, like LocMemCache.
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+_MISSING = object()
+
+
+class LocalTier:
+    """Thread-safe LRU of pickled values with per-entry expiry."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.origin = uuid.uuid4().hex
+        self._data = OrderedDict()  # key -> (expires_at, pickled value)
+        self._lock = threading.Lock()
+        self.subscriber_pid = None
+        self.stats = {
+            "local_hits": 0, "local_misses": 0, "shared_hits": 0, "shared_misses": 0,
+            "evictions": 0, "expirations": 0, "invalidations": 0,
+        }
+
+    def count(self, stat, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] <= time.monotonic():
+                del self._data[key]
+                self.stats["expirations"] += 1
+                return _MISSING
+            self._data.move_to_end(key)
+        return pickle.loads(entry[1])
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            self.delete([key])
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (now + ttl, pickled)
+            self._data.move_to_end(key)
+            if len(self._data) > self.max_entries:
+                # Expired entries go first, then the least recently used.
+                for k in [k for k, (expires_at, _) in self._data.items() if expires_at <= now]:
+                    del self._data[k]
+                    self.stats["expirations"] += 1
+                while len(self._data) > self.max_entries:
+                    self._data.popitem(last=False)
+                    self.stats["evictions"] += 1
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.shared_alias = options.get("SHARED_ALIAS", "shared")
+        self.local_prefixes = tuple(options.get("LOCAL_PREFIXES", ()))
+        self.local_timeout = options.get("LOCAL_TIMEOUT", 5)
+        self.channel = options.get("INVALIDATION_CHANNEL", f"cache-invalidation:{location or 'default'}")
+        with _local_tiers_lock:
+            self.local = _local_tiers.setdefault(
+                location or "default", LocalTier(options.get("LOCAL_MAX_ENTRIES", 2048)))
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def is_local(self, key):
+        return key.startswith(self.local_prefixes)
+
+    def local_key(self, key, version):
+        return self.make_and_validate_key(key, version=version)
+
+    def local_ttl(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.shared.default_timeout
+        if timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def shared_ttls(self, keys, version):
+        """
+        Seconds left before each of ``keys`` expires in the shared tier; None
+        when it does not expire or the backend cannot tell. One PTTL
+        pipeline on Redis.
+        """
+        shared = self.shared
+        made = {key: shared.make_and_validate_key(key, version=version) for key in keys}
+        client = self._redis(write=False)
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for made_key in made.values():
+                    pipe.pttl(made_key)
+                results = pipe.execute()
+            except Exception as e:
+                logger.warning("Shared cache TTL lookup failed: %s", e)
+                return {}
+            # PTTL: -1 no expiry, -2 already gone.
+            return {key: None if ms == -1 else max(ms, 0) / 1000 for key, ms in zip(made, results)}
+        expire_info = getattr(shared, "_expire_info", None)  # LocMemCache
+        if expire_info is not None:
+            now = time.time()
+            return {
+                key: None if expire_info.get(made_key) is None else max(expire_info[made_key] - now, 0)
+                for key, made_key in made.items()
+            }
+        return {}
+
+    def _store_from_shared(self, values, version):
+        """Keep local copies of values just read from the shared tier, expiring no later than there."""
+        ttls = self.shared_ttls(values, version)
+        for key, value in values.items():
+            remaining = ttls.get(key)
+            ttl = self.local_timeout if remaining is None else min(self.local_timeout, remaining)
+            self.local.set(self.local_key(key, version), value, ttl)
+
+    # Reads
+
+    def get(self, key, default=None, version=None):
+        if not self.is_local(key):
+            return self.shared.get(key, default, version=version)
+
+        self._ensure_subscribed()
+        local_key = self.local_key(key, version)
+        value = self.local.get(local_key)
+        if value is not _MISSING:
+            self.local.count("local_hits")
+            return value
+        self.local.count("local_misses")
+
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self.local.count("shared_misses")
+            return default
+        self.local.count("shared_hits")
+        self._store_from_shared({key: value}, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote = []
+        local_count = 0
+        for key in keys:
+            value = _MISSING
+            if self.is_local(key):
+                local_count += 1
+                value = self.local.get(self.local_key(key, version))
+            if value is _MISSING:
+                remote.append(key)
+            else:
+                found[key] = value
+        if local_count:
+            self._ensure_subscribed()
+            self.local.count("local_hits", len(found))
+            self.local.count("local_misses", local_count - len(found))
+
+        if remote:
+            fetched = self.shared.get_many(remote, version=version)
+            local = {key: value for key, value in fetched.items() if self.is_local(key)}
+            shared_hits = len(local)
+            if local:
+                self._store_from_shared(local, version)
+            if local_count:
+                self.local.count("shared_hits", shared_hits)
+                self.local.count("shared_misses", local_count - len(found) - shared_hits)
+            found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None):
+        if self.is_local(key) and self.local.get(self.local_key(key, version)) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    # Writes
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        if self.is_local(key):
+            self._store_and_invalidate({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        local = {key: value for key, value in data.items() if self.is_local(key) and key not in failed}
+        if local:
+            self._store_and_invalidate(local, timeout, version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added and self.is_local(key):
+            self._store_and_invalidate({key: value}, timeout, version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        if self.is_local(key):
+            self._invalidate([self.local_key(key, version)])
+        return value
+
+    def delete(self, key, version=None):
+        deleted = self.shared.delete(key, version=version)
+        if self.is_local(key):
+            self._invalidate([self.local_key(key, version)])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        self.shared.delete_many(keys, version=version)
+        local = [self.local_key(key, version) for key in keys if self.is_local(key)]
+        if local:
+            self._invalidate(local)
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+        self._publish(None)
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    def stats(self):
+        return {**self.local.stats, "local_entries": len(self.local)}
+
+    # Invalidation
+
+    def _store_and_invalidate(self, data, timeout, version):
+        ttl = self.local_ttl(timeout)
+        local_keys = []
+        for key, value in data.items():
+            local_key = self.local_key(key, version)
+            self.local.set(local_key, value, ttl)
+            local_keys.append(local_key)
+        self._publish(local_keys)
+
+    def _invalidate(self, local_keys):
+        self.local.delete(local_keys)
+        self._publish(local_keys)
+
+    def _redis(self, write):
+        shared = self.shared
+        if isinstance(shared, RedisCache):
+            return shared._cache.get_client(write=write)
+        return None
+
+    def _publish(self, local_keys):
+        """Tell other processes to drop ``local_keys`` (None means everything)."""
+        client = self._redis(write=True)
+        if client is None:
+            return
+        try:
+            client.publish(self.channel, json.dumps({"origin": self.local.origin, "keys": local_keys}))
+        except Exception as e:
+            # Other processes still drop their copy within LOCAL_TIMEOUT.
+            logger.warning("Cache invalidation publish failed: %s", e)
+
+    def on_invalidation(self, payload):
+        message = json.loads(payload)
+        if message["origin"] == self.local.origin:
+            return
+        self.local.count("invalidations")
+        if message["keys"] is None:
+            self.local.clear()
+        else:
+            self.local.delete(message["keys"])
+
+    def _ensure_subscribed(self):
+        # Checked per process: a forked worker does not inherit the parent's thread.
+        if self.local.subscriber_pid == os.getpid():
+            return
+        client = self._redis(write=False)
+        with _local_tiers_lock:
+            if self.local.subscriber_pid == os.getpid():
+                return
+            self.local.subscriber_pid = os.getpid()
+            if client is not None:
+                threading.Thread(
+                    target=self._subscribe, args=(client,), name="cache-invalidation", daemon=True,
+                ).start()
+
+    def _subscribe(self, client):
+        backoff = 0.5
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything published while we were disconnected was missed.
+                self.local.clear()
+                backoff = 0.5
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.on_invalidation(message["data"])
+            except Exception as e:
+                logger.warning("Cache invalidation subscriber error: %s", e, extra={"retry_in": backoff})
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
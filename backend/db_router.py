@@ -0,0 +1,150 @@
+"""
+Primary/replica routing.
+
+Reads go to a random replica from DATABASE_REPLICA_ALIASES whose replication
+lag is under REPLICA_MAX_LAG seconds, falling back to the primary
+("default") when none qualify. Writes always go to the primary.
+
+Reads stick to the primary (are "pinned") when:
+
+* the request is not a safe method (POST, PUT, PATCH, DELETE);
+* the current request has already written something;
+* the client wrote something in the last REPLICA_PIN_SECONDS, tracked with
+  a cookie set by ReplicaPinningMiddleware, so a profile read right after
+  registration or approval never sees a lagging replica;
+* the code runs inside ``with pin_to_primary():``, or in a view decorated
+  with ``@pin_to_primary()``. GET views that write (email verification,
+  approval links) use it, so they never write back a row they read from a
+  lagging replica.
+
+Session data is read from and written to the primary only; since
+SESSION_SAVE_EVERY_REQUEST is on, session writes do not pin. The same goes
+for the partitioned session table (users.sessions), listed in
+PRIMARY_ONLY_MODELS.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_ONLY_APPS = {"sessions"}
+PRIMARY_ONLY_MODELS = {"users.partitionedsession"}  # session storage outside the sessions app
+PIN_COOKIE = "db_pin"
+
+_pinned = ContextVar("db_pinned", default=False)
+_wrote = ContextVar("db_wrote", default=False)
+
+# alias -> (checked_at, lag seconds); per process, refreshed every REPLICA_LAG_CHECK_INTERVAL.
+_lag_cache = {}
+
+_LAG_SQL = {
+    "postgresql": (
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    ),
+}
+
+
+def replica_lag(alias):
+    """Replication lag of ``alias`` in seconds; infinity if it cannot be reached."""
+    now = time.monotonic()
+    checked = _lag_cache.get(alias)
+    if checked and now - checked[0] < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return checked[1]
+
+    connection = connections[alias]
+    sql = _LAG_SQL.get(connection.vendor)
+    try:
+        if sql is None:
+            lag = 0.0
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+                lag = float(cursor.fetchone()[0] or 0)
+    except Exception as e:
+        logger.warning("Replica lag check failed: %s", e, extra={"alias": alias})
+        lag = float("inf")
+    _lag_cache[alias] = (now, lag)
+    return lag
+
+
+def healthy_replicas():
+    return [
+        alias for alias in settings.DATABASE_REPLICA_ALIASES
+        if replica_lag(alias) <= settings.REPLICA_MAX_LAG
+    ]
+
+
+def primary_only(model):
+    return model._meta.app_label in PRIMARY_ONLY_APPS or model._meta.label_lower in PRIMARY_ONLY_MODELS
+
+
+def is_pinned():
+    return _pinned.get() or _wrote.get()
+
+
+@contextmanager
+def pin_to_primary():
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if primary_only(model) or is_pinned():
+            return DEFAULT_DB_ALIAS
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if not primary_only(model):
+            _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinningMiddleware:
+    """
+    Scopes the routing state to one request and keeps a client on the
+    primary for REPLICA_PIN_SECONDS after it writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = request.method not in ("GET", "HEAD", "OPTIONS") or PIN_COOKIE in request.COOKIES
+        pinned_token = _pinned.set(pinned)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get() and settings.DATABASE_REPLICA_ALIASES:
+                response.set_cookie(
+                    PIN_COOKIE, "1",
+                    max_age=settings.REPLICA_PIN_SECONDS,
+                    httponly=True,
+                    secure=settings.SESSION_COOKIE_SECURE,
+                    samesite=settings.SESSION_COOKIE_SAMESITE,
+                )
+            return response
+        finally:
+            _pinned.reset(pinned_token)
+            _wrote.reset(wrote_token)
@@ -0,0 +1,233 @@
+"""
+Liveness and readiness for load balancers: ``/healthz`` and ``/readyz``.
+
+A background thread in each worker probes Postgres, the cache, SMTP and
+ThingsBoard every HEALTH_PROBE_INTERVAL seconds and keeps the last result
+of each. Probe requests only read those results, so their cost does not
+grow with the probe rate, and they are answered by HealthCheckMiddleware
+before sessions, CSRF or host validation run.
+
+``/readyz`` returns 503 while a dependency in HEALTH_CRITICAL is down, or
+when the results are older than HEALTH_STALE_AFTER (a hung probe), so the
+load balancer drains the worker. The response only says whether each
+dependency is up and how long its probe took; why a probe failed goes to
+the log. Non-critical dependencies are reported but do not fail
+readiness: their callers already fail fast through the circuit breakers
+in services.resilience. Apps can also hold readiness back while the
+worker is still starting up with ``add_startup_gate()``.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponse
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Probes raise on failure and return None, or a reason the check was skipped.
+
+def probe_database():
+    connection = connections["default"]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    finally:
+        # Don't hold a pooled connection in the probe thread between rounds.
+        connection.close()
+
+
+def probe_cache():
+    cache = caches["default"]
+    key = f"health:{os.getpid()}"
+    value = str(time.time())
+    cache.set(key, value, timeout=60)
+    if cache.get(key) != value:
+        raise RuntimeError("cache did not return the value just written")
+
+
+def probe_smtp():
+    if not settings.EMAIL_HOST:
+        return "EMAIL_HOST not set"
+    # TCP reachability only: a full SMTP handshake per probe would count
+    # against the relay's connection limits.
+    socket.create_connection((settings.EMAIL_HOST, settings.EMAIL_PORT), timeout=settings.HEALTH_PROBE_TIMEOUT).close()
+
+
+def probe_thingsboard():
+    if not settings.TB_BASE_URL:
+        return "TB_BASE_URL not set"
+    import httpx  # imported on first probe, off the boot path
+
+    response = httpx.get(settings.TB_BASE_URL, timeout=settings.HEALTH_PROBE_TIMEOUT)
+    if response.status_code >= 500:
+        raise RuntimeError(f"HTTP {response.status_code}")
+
+
+PROBES = {
+    "database": probe_database,
+    "cache": probe_cache,
+    "smtp": probe_smtp,
+    "thingsboard": probe_thingsboard,
+}
+
+
+class HealthMonitor:
+    def __init__(self, probes, interval, critical, stale_after):
+        self.probes = probes
+        self.interval = interval
+        self.critical = set(critical)
+        self.stale_after = stale_after
+        self.results = {}
+        self.checked_at = None
+        self.thread_pid = None
+        self._lock = threading.Lock()
+
+    def run_once(self):
+        results = {}
+        for name, probe in self.probes.items():
+            start = time.perf_counter()
+            try:
+                skipped = probe()
+            except Exception as e:
+                result = {"ok": False, "error": str(e) or type(e).__name__}
+            else:
+                result = {"ok": True}
+                if skipped:
+                    result["skipped"] = skipped
+            result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            if not result["ok"] and self.results.get(name, {}).get("ok", True):
+                logger.warning("Health probe failed", extra={"dependency": name, "error": result["error"]})
+            results[name] = result
+        self.results, self.checked_at = results, time.monotonic()
+
+    def ensure_started(self):
+        # Checked per process: a forked worker does not inherit the parent's thread.
+        if self.thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self.thread_pid == os.getpid():
+                return
+            self.thread_pid = os.getpid()
+            threading.Thread(target=self._loop, name="health-probes", daemon=True).start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Health probe round failed")
+            time.sleep(self.interval)
+
+    def status(self):
+        """``(ready, body)`` from the last round of probes."""
+        if self.checked_at is None:
+            return False, {"status": "starting", "dependencies": {}}
+        age = time.monotonic() - self.checked_at
+        down = sorted(name for name in self.critical if not self.results.get(name, {}).get("ok"))
+        if age > self.stale_after:
+            status = "stale"
+        elif down:
+            status = "unavailable"
+        elif not all(result["ok"] for result in self.results.values()):
+            status = "degraded"
+        else:
+            status = "ok"
+        dependencies = {
+            name: {"ok": result["ok"], "latency_ms": result["latency_ms"]} for name, result in self.results.items()
+        }
+        body = {"status": status, "age": round(age, 1), "dependencies": dependencies}
+        return status in ("ok", "degraded"), body
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+# name -> callable returning (finished, detail); see add_startup_gate().
+_startup_gates = {}
+
+
+def add_startup_gate(name, check):
+    """
+    Report ``check()``'s detail under ``name`` in /readyz and keep the worker
+    "starting" (503) until it returns ``(True, detail)``. Checks run on every
+    readiness request, so they must be cheap.
+    """
+    _startup_gates[name] = check
+
+
+def _apply_startup_gates(ready, body):
+    for name, check in _startup_gates.items():
+        finished, body[name] = check()
+        if not finished and ready:
+            ready, body["status"] = False, "starting"
+    return ready, body
+
+
+def get_monitor():
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = HealthMonitor(
+                PROBES,
+                interval=settings.HEALTH_PROBE_INTERVAL,
+                critical=settings.HEALTH_CRITICAL,
+                stale_after=settings.HEALTH_STALE_AFTER,
+            )
+        return _monitor
+
+
+def _health_samples():
+    if _monitor is None:
+        return
+    for name, result in _monitor.results.items():
+        yield (name, "up"), int(result["ok"])
+        yield (name, "latency_ms"), result["latency_ms"]
+
+
+metrics.REGISTRY.gauge(
+    "dependency_health", "Last background health probe per dependency: up (1/0) and latency in ms.",
+    ("dependency", "field"), _health_samples)
+
+
+def _json(body, status=200):
+    response = HttpResponse(json.dumps(body), status=status, content_type="application/json")
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+class HealthCheckMiddleware:
+    """
+    Answers /healthz (the process is serving requests) and /readyz (its
+    dependencies are usable) ahead of the rest of the stack. Place it first
+    in MIDDLEWARE, above RequestLogMiddleware and MetricsMiddleware, so
+    probes are neither logged nor counted as traffic.
+
+    Probing starts with the first readiness check, which reports
+    "starting" (503) until the first round has finished.
+    """
+
+    LIVENESS_PATH = "/healthz"
+    READINESS_PATH = "/readyz"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        path = request.path_info.rstrip("/")
+        if path == self.LIVENESS_PATH:
+            return _json({"status": "ok"})
+        if path == self.READINESS_PATH:
+            monitor = get_monitor()
+            monitor.ensure_started()
+            ready, body = _apply_startup_gates(*monitor.status())
+            return _json(body, status=200 if ready else 503)
+        return self.get_response(request)
@@ -0,0 +1,163 @@
+"""
+Structured, non-blocking logging.
+
+Request threads only put records on an in-memory queue (QueueingHandler);
+a listener thread per process formats them as JSON lines and writes them
+to stdout. When the writer falls behind (a stalled log shipper), the queue
+fills up and further records are dropped and counted instead of blocking
+the request. Each record carries the id of the request that emitted it.
+
+Configured from settings.LOGGING:
+
+    "filters": {
+        "request": {"()": "backend.log.RequestContextFilter"},
+        "sampling": {"()": "backend.log.SamplingFilter", "rates": "DEBUG=0.01,INFO=0.5"},
+    },
+    "handlers": {
+        "queue": {"class": "backend.log.QueueingHandler", "filters": ["request", "sampling"]},
+    },
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+from . import metrics
+
+log_records_dropped = metrics.REGISTRY.counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full.")
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed in ``extra``.
+_RECORD_ATTRS = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "request_id"}
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the current request id. Runs on the emitting thread."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps records of a level with the configured probability, e.g.
+    ``{"DEBUG": 0.01, "INFO": 0.5}`` or ``"DEBUG=0.01,INFO=0.5"`` (from the
+    environment). Levels not listed are always kept.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        if isinstance(rates, str):
+            rates = parse_rates(rates)
+        self.rates = {logging.getLevelName(level.upper()): float(rate) for level, rate in (rates or {}).items()}
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        return rate is None or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class _Listener(logging.handlers.QueueListener):
+    def stop(self, timeout=5):
+        # The stock stop() raises on a full queue and then joins forever.
+        try:
+            self.queue.put(self._sentinel, timeout=timeout)
+        except queue.Full:
+            return  # writer stalled: abandon the backlog rather than hang shutdown
+        self._thread.join(timeout)
+        self._thread = None
+
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records without blocking; a QueueListener thread writes them.
+
+    The listener is started lazily in each process, so workers forked
+    after logging was configured get their own.
+    """
+
+    def __init__(self, maxsize=10000, stream=None):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.target.setFormatter(JsonFormatter())
+        self.listener = None
+        self.listener_pid = None
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Render the message and traceback now: args may be mutated (or
+        # unpicklable) by the time the listener formats the record.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.target.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc()
+
+    def _ensure_listener(self):
+        if self.listener_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self.listener_pid == os.getpid():
+                return
+            # The queue may hold records copied from the parent process.
+            self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self.listener = _Listener(self.queue, self.target, respect_handler_level=True)
+            self.listener.start()
+            self.listener_pid = os.getpid()
+            atexit.register(self.flush_and_stop)
+
+    def flush_and_stop(self):
+        """Writes what is queued and stops the listener (at exit, and in tests)."""
+        if self.listener is not None and self.listener_pid == os.getpid():
+            self.listener.stop()
+            self.listener, self.listener_pid = None, None
+
+    def close(self):
+        self.flush_and_stop()
+        super().close()
+
+
+def parse_rates(value):
+    """``"DEBUG=0.01,INFO=0.5"`` -> ``{"DEBUG": 0.01, "INFO": 0.5}``"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        level, _, rate = item.partition("=")
+        rates[level.strip().upper()] = float(rate)
+    return rates
@@ -0,0 +1,155 @@
+"""
+In-process metrics with Prometheus text-format export.
+
+Metrics are per worker process; Prometheus should scrape every worker (or sum
+by instance). Updates take one lock per metric and do no I/O, so recording on
+the request path stays cheap.
+"""
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(state)) for labels, state in self._values.items()]
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, labels, ("le", bound)), cumulative
+            yield f"{self.name}_bucket", _format_labels(self.labelnames, labels, ("le", "+Inf")), state[-1]
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), state[-2]
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), state[-1]
+
+
+class Gauge:
+    """Gauge whose samples are produced by ``collect()`` at scrape time."""
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+http_requests = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status"))
+http_request_duration = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("route", "method"))
+db_queries = REGISTRY.counter(
+    "db_queries_total", "Database queries by route and database alias.", ("route", "alias"))
+db_query_duration = REGISTRY.counter(
+    "db_query_duration_seconds_total", "Time spent in database queries by route and alias.", ("route", "alias"))
+db_queries_per_request = REGISTRY.histogram(
+    "db_queries_per_request", "Database queries issued per request.", ("route",),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50))
+outbound_requests = REGISTRY.counter(
+    "outbound_requests_total", "Calls to external dependencies by outcome.", ("dependency", "outcome"))
+outbound_duration = REGISTRY.histogram(
+    "outbound_request_duration_seconds", "Latency of calls to external dependencies.", ("dependency",))
+cache_lookups = REGISTRY.counter(
+    "cache_lookups_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+
+
+def record_outbound(dependency, seconds, ok):
+    outbound_requests.inc(dependency, "success" if ok else "error")
+    outbound_duration.observe(seconds, dependency)
+
+
+def record_cache_lookup(name, hit):
+    cache_lookups.inc(name, "hit" if hit else "miss")
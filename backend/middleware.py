@@ -1,5 +1,16 @@
+import logging
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.db import connections
 from django.utils import timezone
 
+from . import metrics
+from .log import request_id
+
+request_logger = logging.getLogger("backend.request")
+
 
 class AbsoluteSessionTimeoutMiddleware:
     """
@@ -27,3 +38,104 @@ class AbsoluteSessionTimeoutMiddleware:
         response = self.get_response(request)
         return response
 
+
+
+class SessionMetricsMiddleware:
+    """
+    Counts session lookups as cache hits or misses for whichever
+    SESSION_ENGINE is configured. The count is taken when something first
+    reads the session, so requests that never touch it are not counted,
+    and nothing here loads it. Place it right after SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        session = request.session
+        load = session.load
+
+        def counted_load():
+            # Only called with a session key; the database, cache and file engines drop it on a miss.
+            data = load()
+            metrics.record_cache_lookup("session", session.session_key is not None)
+            return data
+
+        session.load = counted_load
+        return self.get_response(request)
+
+
+class MetricsMiddleware:
+    """
+    Records per-route latency, status counts and database query count/time.
+
+    Place it right after RequestLogMiddleware, so the latency covers every
+    middleware below it. HealthCheckMiddleware stays above both: probes are
+    answered before they are logged or measured. Requests are labelled with
+    the resolved route only; nothing here loads the session.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = {"queries": {}, "time": {}}
+
+        def record_query(execute, sql, params, many, context):
+            alias = context["connection"].alias
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats["queries"][alias] = stats["queries"].get(alias, 0) + 1
+                stats["time"][alias] = stats["time"].get(alias, 0.0) + time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record_query))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match else "unmatched"
+        metrics.http_requests.inc(route, request.method, str(response.status_code))
+        metrics.http_request_duration.observe(elapsed, route, request.method)
+        for alias, count in stats["queries"].items():
+            metrics.db_queries.inc(route, alias, amount=count)
+            metrics.db_query_duration.inc(route, alias, amount=stats["time"][alias])
+        metrics.db_queries_per_request.observe(sum(stats["queries"].values()), route)
+        return response
+
+
+class RequestLogMiddleware:
+    """
+    Assigns each request an id (the incoming X-Request-ID, or a new one) that
+    every log record emitted while handling it carries, returns it in the
+    response, and logs one record per request with its status and duration.
+
+    Place it right after HealthCheckMiddleware, above everything else, so
+    the duration covers the whole stack apart from the health probes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rid = request.headers.get("X-Request-ID", "")[:64] or uuid.uuid4().hex
+        token = request_id.set(rid)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            duration_ms = round((time.perf_counter() - start) * 1000, 1)
+            level = logging.ERROR if response.status_code >= 500 else logging.INFO
+            request_logger.log(level, "%s %s %s", request.method, request.path, response.status_code, extra={
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": duration_ms,
+            })
+            response["X-Request-ID"] = rid
+            return response
+        finally:
+            request_id.reset(token)
@@ -0,0 +1,147 @@
+"""
+Range partitioning by month or day of time-ordered tables on PostgreSQL.
+
+A model opts in from the migration that creates it, right after its
+CreateModel:
+
+    operations = [
+        migrations.CreateModel(name="AuthAuditEvent", ...),
+        partition_by_range("users.AuthAuditEvent", "occurred_at", MONTH),
+    ]
+
+which rebuilds the (still empty) table as ``PARTITION BY RANGE (column)``
+with one partition per calendar month (``<table>_YYYYMM``) or day
+(``<table>_YYYYMMDD``), and a default partition that catches rows outside
+them, so an insert never fails because maintenance fell behind. Expired
+periods are dropped whole instead of deleted row by row.
+
+Other databases keep the plain table. The primary key becomes (pk,
+partition column), so the pk alone is no longer unique across partitions;
+models whose pk is not generated by the database (sessions) have to keep
+it unique themselves. Other unique constraints are not carried over:
+PostgreSQL only allows them on a partitioned table if they include the
+partition key.
+"""
+from datetime import date, datetime, timedelta, timezone
+
+from django.db import migrations
+
+MONTH = "month"
+DAY = "day"
+
+PRECREATE = {MONTH: 3, DAY: 3}
+_NAME_FORMAT = {MONTH: "%Y%m", DAY: "%Y%m%d"}
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def period_start(value, period):
+    return month_start(value) if period == MONTH else date(value.year, value.month, value.day)
+
+
+def add_periods(start, count, period):
+    return add_months(start, count) if period == MONTH else start + timedelta(days=count)
+
+
+def partition_name(table, start, period=MONTH):
+    return f"{table}_{start.strftime(_NAME_FORMAT[period])}"
+
+
+def _bound(start):
+    return datetime(start.year, start.month, start.day, tzinfo=timezone.utc).isoformat()
+
+
+def is_partitioned(connection, table):
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+        return cursor.fetchone() is not None
+
+
+def create_partitions(connection, table, start, count, period=MONTH):
+    """Create the partitions of ``count`` periods from ``start``; returns the names created."""
+    qn = connection.ops.quote_name
+    created = []
+    with connection.cursor() as cursor:
+        for offset in range(count):
+            lower = add_periods(period_start(start, period), offset, period)
+            name = partition_name(table, lower, period)
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            if cursor.fetchone()[0] is not None:
+                continue
+            cursor.execute(
+                f"CREATE TABLE {qn(name)} PARTITION OF {qn(table)} "
+                f"FOR VALUES FROM ('{_bound(lower)}') TO ('{_bound(add_periods(lower, 1, period))}')"
+            )
+            created.append(name)
+    return created
+
+
+def partitions(connection, table, period=MONTH):
+    """``{period start: partition name}`` of the partitions of ``table``, the default one excluded."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(%s)",
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    found = {}
+    for name in names:
+        suffix = name[len(table) + 1:]
+        if not name.startswith(f"{table}_") or not suffix.isdigit():
+            continue
+        try:
+            found[datetime.strptime(suffix, _NAME_FORMAT[period]).date()] = name
+        except ValueError:
+            continue
+    return found
+
+
+def drop_partitions(connection, table, before, period=MONTH):
+    """Drop the partitions of periods ending before ``before``; returns the names dropped."""
+    qn = connection.ops.quote_name
+    dropped = []
+    with connection.cursor() as cursor:
+        for start, name in sorted(partitions(connection, table, period).items()):
+            if add_periods(start, 1, period) <= before:
+                cursor.execute(f"DROP TABLE {qn(name)}")
+                dropped.append(name)
+    return dropped
+
+
+def partition_by_range(model_label, column, period=MONTH):
+    """Migration operation that rebuilds a freshly created, empty table as partitioned."""
+
+    def forwards(apps, schema_editor):
+        connection = schema_editor.connection
+        if connection.vendor != "postgresql":
+            return
+        model = apps.get_model(model_label)
+        table = model._meta.db_table
+        pk = model._meta.pk.column
+        qn = schema_editor.quote_name
+        old = f"{table}_unpartitioned"
+        schema_editor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(old)}")
+        schema_editor.execute(
+            f"CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE ({qn(column)})"
+        )
+        # The partition key must be part of every unique constraint, the primary key included.
+        schema_editor.execute(f"ALTER TABLE {qn(table)} ADD PRIMARY KEY ({qn(pk)}, {qn(column)})")
+        schema_editor.execute(f"DROP TABLE {qn(old)}")
+        schema_editor.execute(f"CREATE TABLE {qn(table + '_default')} PARTITION OF {qn(table)} DEFAULT")
+        # CreateModel deferred its indexes and foreign keys to the end of the
+        # migration, so they are created on the new table.
+        create_partitions(connection, table, datetime.now(timezone.utc), PRECREATE[period], period)
+
+    return migrations.RunPython(forwards, migrations.RunPython.noop, elidable=False)
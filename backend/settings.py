@@ -12,20 +12,72 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
-from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# Load environment variables from .env file at project root (backend/.env)
-load_dotenv(BASE_DIR / ".env")
+# Load environment variables from .env file at project root (backend/.env).
+# Deployed workers get their environment directly and skip importing dotenv.
+if (BASE_DIR / ".env").exists():
+    from dotenv import load_dotenv
+    load_dotenv(BASE_DIR / ".env")
 
 # ThingsBoard configuration
 TB_BASE_URL = os.getenv("TB_BASE_URL")
 TB_ADMIN_EMAIL = os.getenv("TB_ADMIN_EMAIL")
 TB_ADMIN_PASSWORD = os.getenv("TB_ADMIN_PASSWORD")
+TB_MAX_CONCURRENCY = int(os.getenv("TB_MAX_CONCURRENCY", "10"))  # requests in flight per process
+TB_MAX_CONNECTIONS = int(os.getenv("TB_MAX_CONNECTIONS", "20"))  # pooled keep-alive connections
+TB_TIMEOUT = float(os.getenv("TB_TIMEOUT", "10"))  # seconds
+TB_TOKEN_TTL = int(os.getenv("TB_TOKEN_TTL", "900"))  # seconds an admin JWT is shared between workers
+TB_CUSTOMERS_TTL = int(os.getenv("TB_CUSTOMERS_TTL", "5"))  # seconds a fetched customer list is shared
+TB_CUSTOMER_ID_TTL = int(os.getenv("TB_CUSTOMER_ID_TTL", "3600"))  # email -> TB customer id
+TB_DEVICES_TTL = int(os.getenv("TB_DEVICES_TTL", "30"))  # customer device lists
+TB_TELEMETRY_TTL = int(os.getenv("TB_TELEMETRY_TTL", "5"))  # latest telemetry per device
+
+# Circuit breaker + bulkhead per outbound dependency (see services/resilience.py)
+RESILIENCE = {
+    "thingsboard": {
+        "failure_threshold": int(os.getenv("TB_BREAKER_FAILURES", "5")),
+        "failure_window": 60,  # seconds in which failures are counted
+        "recovery_timeout": int(os.getenv("TB_BREAKER_RECOVERY", "30")),  # seconds open before probing
+        "max_concurrent": int(os.getenv("TB_BULKHEAD_SIZE", "8")),  # threads per process
+        "wait_timeout": 0.5,  # seconds to wait for a free slot
+    },
+    "smtp": {
+        "failure_threshold": int(os.getenv("SMTP_BREAKER_FAILURES", "5")),
+        "failure_window": 60,
+        "recovery_timeout": int(os.getenv("SMTP_BREAKER_RECOVERY", "30")),
+        "max_concurrent": int(os.getenv("SMTP_BULKHEAD_SIZE", "4")),
+        "wait_timeout": 0.5,
+    },
+}
+
+# Cache. With REDIS_URL set, Redis is the shared tier (OTPs, verification
+# flags, locks, circuit state) and ThingsBoard lookups also keep a short
+# per-process copy (see backend/cache.py). Without it, each process gets
+# its own in-memory cache.
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "backend.cache.TwoTierCache",
+            "LOCATION": "default",
+            "OPTIONS": {
+                "SHARED_ALIAS": "shared",
+                "LOCAL_PREFIXES": ["tb:"],
+                "LOCAL_MAX_ENTRIES": int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", "2048")),
+                "LOCAL_TIMEOUT": int(os.getenv("CACHE_LOCAL_TIMEOUT", "5")),  # seconds a local copy may be served
+            },
+        },
+        "shared": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        },
+    }
 
 #email verification
 
@@ -38,12 +90,9 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
 
-# Debug email settings (remove in production)
-print(f"Email settings loaded:")
-print(f"EMAIL_HOST: {EMAIL_HOST}")
-print(f"EMAIL_PORT: {EMAIL_PORT}")
-print(f"EMAIL_HOST_USER: {EMAIL_HOST_USER}")
-print(f"EMAIL_USE_TLS: {EMAIL_USE_TLS}")
+# Bearer token required to scrape /metrics/. Without one, only METRICS_ALLOWED_IPS may scrape.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",") if ip.strip()]
 
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:8000")
 BACKEND_URL = os.getenv('BACKEND_URL')
@@ -76,14 +125,20 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'corsheaders',
+    'channels',
     'users',
     'phonenumber_field',
 ]
 
 MIDDLEWARE = [
+    'backend.health.HealthCheckMiddleware',
+    'backend.middleware.RequestLogMiddleware',
+    'backend.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'backend.db_router.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'backend.middleware.SessionMetricsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -110,6 +165,20 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
+
+# Channel layer for WebSocket push (ws/account/). Redis lets the event
+# dispatcher reach connections held by every ASGI worker; the in-memory
+# layer only works within one process (development, tests).
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [REDIS_URL]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
 
 
 # Database
@@ -126,6 +195,47 @@ DATABASES = {
     }
 }
 
+# Connection reuse. DB_POOL_MODE is one of:
+#   psycopg   - in-process psycopg_pool per worker (default)
+#   pgbouncer - persistent connections to a transaction-pooling PgBouncer
+#   none      - a new connection per request
+DB_POOL_MODE = os.getenv('DB_POOL_MODE', 'psycopg')
+if DB_POOL_MODE == 'psycopg':
+    # Django checks each connection's health when it is taken from the pool.
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),  # seconds to wait for a free connection
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 300)),  # seconds before idle connections above min_size close
+            'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),  # seconds before a connection is recycled
+        },
+    }
+elif DB_POOL_MODE == 'pgbouncer':
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 60))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+    # Server-side cursors do not survive transaction pooling.
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# Read replicas: comma-separated "host" or "host:port" entries sharing the
+# primary's name and credentials. Safe reads are routed to them by
+# backend.db_router; leave unset to run everything on the primary.
+DATABASE_REPLICA_ALIASES = []
+for _index, _replica in enumerate(filter(None, os.getenv('DATABASE_REPLICAS', '').split(',')), start=1):
+    _host, _, _port = _replica.strip().partition(':')
+    DATABASES[f'replica_{_index}'] = {
+        **DATABASES['default'],
+        'HOST': _host,
+        'PORT': _port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICA_ALIASES.append(f'replica_{_index}')
+
+DATABASE_ROUTERS = ['backend.db_router.PrimaryReplicaRouter']
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 2))  # seconds; lagging replicas are skipped
+REPLICA_LAG_CHECK_INTERVAL = int(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 5))  # seconds between lag checks
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))  # reads stay on the primary after a write
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -168,6 +278,7 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'users.CustomUser' 
+AUTHENTICATION_BACKENDS = ['users.backends.EmailBackend']
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
@@ -185,6 +296,9 @@ SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'None'
 SESSION_COOKIE_SECURE = False if DEBUG else True
+# "users.sessions" keeps sessions in a table partitioned by day (PostgreSQL).
+# Either way, `manage.py cleanup_sessions` removes expired ones (users/sessions.py).
+SESSION_ENGINE = os.getenv("SESSION_ENGINE", "django.contrib.sessions.backends.db")
 
 # CSRF cookie settings for mobile clients (HTTPS required in prod)
 CSRF_COOKIE_SAMESITE = 'None'
@@ -196,8 +310,85 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:19006",
     "http://10.0.2.2:19006",
 ]
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
 CSRF_TRUSTED_ORIGINS = [
     "http://localhost:19006",
     "http://10.0.2.2:19006",
 ]
 
+# Idempotency-Key support for registration, invitation and approval POSTs
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))  # seconds a response is replayed
+IDEMPOTENCY_LOCK_TIMEOUT = 60  # seconds before an abandoned in-flight lock expires
+IDEMPOTENCY_WAIT = 10  # seconds a concurrent duplicate waits for the first response
+INVITATION_CACHE_TTL = int(os.getenv("INVITATION_CACHE_TTL", "60"))  # seconds a resolved invitation token is cached
+
+# User lifecycle event outbox, delivered by `manage.py dispatch_events` (see users/events.py)
+USER_EVENT_SINKS = []
+if os.getenv("USER_EVENT_WEBHOOK_URL"):
+    USER_EVENT_SINKS.append({
+        "class": "users.events.WebhookSink",
+        "url": os.getenv("USER_EVENT_WEBHOOK_URL"),
+        "secret": os.getenv("USER_EVENT_WEBHOOK_SECRET"),
+    })
+if os.getenv("USER_EVENT_FILE"):
+    USER_EVENT_SINKS.append({"class": "users.events.FileSink", "path": os.getenv("USER_EVENT_FILE")})
+if REDIS_URL:
+    USER_EVENT_SINKS.append({"class": "users.events.ChannelLayerSink"})
+# Work queued by imports and admin actions.
+if TB_BASE_URL:
+    USER_EVENT_SINKS.append({"class": "users.events.ThingsBoardSink"})
+USER_EVENT_SINKS.append({"class": "users.events.EmailSink"})
+USER_EVENT_BATCH_SIZE = int(os.getenv("USER_EVENT_BATCH_SIZE", "100"))
+USER_EVENT_MAX_ATTEMPTS = int(os.getenv("USER_EVENT_MAX_ATTEMPTS", "10"))
+USER_EVENT_RETRY_BASE = 5  # seconds before the first retry; doubles per attempt, capped at an hour
+USER_EVENT_LEASE = int(os.getenv("USER_EVENT_LEASE", "300"))  # seconds a claimed batch stays in flight; keep above the sinks' timeouts
+
+# Authentication audit trail (users/audit.py): buffered per worker and
+# written in batches. AUDIT_FLUSH_INTERVAL = 0 disables the flush thread.
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))  # events per multi-row INSERT
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "2"))  # seconds between flushes
+AUDIT_SPOOL_DIR = os.getenv("AUDIT_SPOOL_DIR", str(BASE_DIR / "audit-spool"))  # batches the database refused
+AUDIT_RETENTION_MONTHS = int(os.getenv("AUDIT_RETENTION_MONTHS", "13"))  # monthly partitions kept
+
+# /healthz and /readyz (backend/health.py). Dependencies listed in
+# HEALTH_CRITICAL fail readiness when down; the others are only reported.
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "5"))  # seconds between background probe rounds
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "2"))  # seconds per SMTP/ThingsBoard probe
+HEALTH_STALE_AFTER = float(os.getenv("HEALTH_STALE_AFTER", "30"))  # seconds before old results fail readiness
+HEALTH_CRITICAL = os.getenv("HEALTH_CRITICAL", "database,cache").split(",")
+
+# Per-worker cache warmup after a deploy (users/warmup.py), in server
+# processes only. By default each worker warms up on its first readiness
+# probe; WARMUP_ON_START=True starts it when the application loads, which
+# must stay off with gunicorn --preload (it would run in the master).
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "True") == "True"
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "False") == "True"
+WARMUP_BUDGET = float(os.getenv("WARMUP_BUDGET", "10"))  # seconds for all steps
+WARMUP_BLOCKS_READINESS = os.getenv("WARMUP_BLOCKS_READINESS", "True") == "True"  # /readyz waits for the warmup
+WARMUP_RECENT_HOURS = int(os.getenv("WARMUP_RECENT_HOURS", "24"))  # users who logged in this recently are warmed
+WARMUP_RECENT_USERS = int(os.getenv("WARMUP_RECENT_USERS", "500"))  # at most this many
+
+# Logging: JSON lines on stdout, written by a background thread per process
+# (see backend/log.py). LOG_SAMPLE_RATES keeps a fraction of records per
+# level, e.g. "DEBUG=0.01,INFO=0.25"; warnings and errors are always kept.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "filters": {
+        "request": {"()": "backend.log.RequestContextFilter"},
+        "sampling": {"()": "backend.log.SamplingFilter", "rates": os.getenv("LOG_SAMPLE_RATES", "")},
+    },
+    "handlers": {
+        "queue": {
+            "class": "backend.log.QueueingHandler",
+            "filters": ["request", "sampling"],
+            "maxsize": int(os.getenv("LOG_QUEUE_SIZE", "10000")),  # records buffered before dropping
+        },
+    },
+    "root": {"handlers": ["queue"], "level": LOG_LEVEL},
+    "loggers": {
+        # Django's own handlers print to the console in DEBUG; send everything through the queue.
+        "django": {"handlers": ["queue"], "level": LOG_LEVEL, "propagate": False},
+    },
+}
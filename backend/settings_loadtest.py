@@ -0,0 +1,35 @@
+"""
+Settings for the signup load test (``manage.py loadtest_signup``).
+
+Runs against local stand-ins: SQLite instead of Postgres (unless
+LOADTEST_USE_POSTGRES=1), the in-process fake SMTP sink and the fake
+ThingsBoard server started by the command.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+
+LOADTEST = True
+
+DEBUG = False  # DEBUG keeps every query in memory and logs OTPs
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+SESSION_COOKIE_SECURE = False
+CSRF_COOKIE_SECURE = False
+
+if os.getenv("LOADTEST_USE_POSTGRES") != "1":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "loadtest.sqlite3",
+            "OPTIONS": {"timeout": 30},
+        }
+    }
+    DATABASE_REPLICA_ALIASES = []
+
+# Host/port are filled in by the command once the fake SMTP server is listening.
+EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+EMAIL_HOST = "127.0.0.1"
+EMAIL_USE_TLS = False
+EMAIL_HOST_USER = ""
+EMAIL_HOST_PASSWORD = ""
+DEFAULT_FROM_EMAIL = "BeySmart Load Test <loadtest@example.com>"
@@ -0,0 +1,105 @@
+"""
+Worker cold-start profiling.
+
+``profile_boot()`` starts a fresh interpreter that boots the project the way
+a WSGI worker does and reports how long each phase took:
+
+    settings  import the settings module (and .env)
+    apps      django.setup(): app configs and models
+    handler   WSGIHandler(): middleware
+    urls      the URLconf, which imports every view module
+    request   the first request through the handler (optional)
+
+With ``importtime=True`` the child runs under ``python -X importtime`` and
+the per-module import times are parsed from its stderr.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BOOT_SCRIPT = r"""
+import json, sys, time
+start = time.perf_counter()
+phases = {}
+
+def mark(name):
+    global start
+    now = time.perf_counter()
+    phases[name] = round((now - start) * 1000, 1)
+    start = now
+
+from django.conf import settings
+settings.INSTALLED_APPS
+mark("settings")
+
+import django
+django.setup(set_prefix=False)
+mark("apps")
+
+from django.core.handlers.wsgi import WSGIHandler
+handler = WSGIHandler()
+mark("handler")
+
+from django.urls import get_resolver
+get_resolver().url_patterns
+mark("urls")
+
+path = sys.argv[1]
+status = None
+if path:
+    from wsgiref.util import setup_testing_defaults
+    environ = {"PATH_INFO": path, "REQUEST_METHOD": "GET", "SERVER_NAME": "localhost"}
+    setup_testing_defaults(environ)
+    result = []
+    handler(environ, lambda s, headers: result.append(s)).close()
+    status = result[0]
+    mark("request")
+
+with open(sys.argv[2], "w") as f:
+    json.dump({"phases": phases, "status": status}, f)
+"""
+
+
+def parse_importtime(stderr):
+    """``-X importtime`` output as ``(module, self_us, cumulative_us, depth)`` tuples."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def profile_boot(request_path=None, importtime=False, settings_module=None):
+    """
+    Boot the project in a new process. Returns ``{"total_ms", "phases",
+    "status", "imports"}``; ``total_ms`` includes interpreter start-up.
+    """
+    env = dict(os.environ)
+    if settings_module:
+        env["DJANGO_SETTINGS_MODULE"] = settings_module
+    env.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+    # The warmup runs beside the boot, not in it; its thread would only add noise.
+    env.setdefault("WARMUP_ENABLED", "False")
+    # The child must find the project the way manage.py does.
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [project_root, env.get("PYTHONPATH")]))
+
+    # The report goes to a file: the child's stdout carries its log records.
+    with tempfile.NamedTemporaryFile("r", suffix=".json") as output:
+        command = [sys.executable, *(["-X", "importtime"] if importtime else []),
+                   "-c", BOOT_SCRIPT, request_path or "", output.name]
+        start = time.perf_counter()
+        completed = subprocess.run(command, env=env, capture_output=True, text=True, timeout=120)
+        total_ms = round((time.perf_counter() - start) * 1000, 1)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Boot failed:\n{completed.stderr[-4000:]}")
+        report = json.load(output)
+    report["total_ms"] = total_ms
+    report["imports"] = parse_importtime(completed.stderr) if importtime else []
+    return report
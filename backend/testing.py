@@ -0,0 +1,79 @@
+"""
+Query-count and latency budgets for endpoint tests.
+
+    class LoginTests(EndpointBudgetMixin, TestCase):
+        def test_login(self):
+            with self.assertWithinBudget("login", queries=4, ms=250):
+                self.client.post(...)
+
+On failure the message lists every SQL statement that ran and an N+1 report
+of statements that repeated with only their parameters changed.
+
+Query counts are always enforced. Wall-clock budgets depend on the machine,
+so they are only enforced with TEST_TIME_BUDGETS=1 (on a quiet, dedicated
+runner); otherwise the elapsed time is reported but not asserted.
+"""
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SAVEPOINT = re.compile(r'"s\d+_x\d+"')
+_IN_LIST = re.compile(r"\bIN \((?:\s*(?:%s|\?),?)+\s*\)", re.IGNORECASE)
+
+TIME_BUDGETS = os.getenv("TEST_TIME_BUDGETS") == "1"
+
+
+def normalize_sql(sql):
+    """Replace literals so statements that differ only by parameters compare equal."""
+    sql = _STRING.sub("?", sql)
+    sql = _SAVEPOINT.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    return _IN_LIST.sub("IN (...)", sql)
+
+
+def repeated_queries(queries, threshold=2):
+    """Normalized statements that ran at least ``threshold`` times: likely N+1 patterns."""
+    counts = Counter(
+        normalize_sql(q["sql"]) for q in queries
+        if not q["sql"].startswith(("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT"))
+    )
+    return [(sql, n) for sql, n in counts.most_common() if n >= threshold]
+
+
+def budget_report(name, queries, elapsed_ms, max_queries, max_ms):
+    lines = [
+        f"Endpoint budget exceeded for {name!r}: "
+        f"{len(queries)} queries (budget {max_queries}), {elapsed_ms:.1f} ms (budget {max_ms} ms)",
+        "",
+        "Queries:",
+    ]
+    lines += [f"  {i}. [{q['time']}s] {q['sql']}" for i, q in enumerate(queries, 1)]
+    repeated = repeated_queries(queries)
+    lines += ["", "N+1 report:"]
+    if repeated:
+        lines += [f"  {n}x {sql}" for sql, n in repeated]
+    else:
+        lines.append("  no repeated statements")
+    return "\n".join(lines)
+
+
+class EndpointBudgetMixin:
+    """TestCase mixin adding assertWithinBudget()."""
+
+    @contextmanager
+    def assertWithinBudget(self, name, queries, ms, using=DEFAULT_DB_ALIAS):
+        context = CaptureQueriesContext(connections[using])
+        start = time.perf_counter()
+        with context:
+            yield context
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        if len(context.captured_queries) > queries or (TIME_BUDGETS and elapsed_ms > ms):
+            self.fail(budget_report(name, context.captured_queries, elapsed_ms, queries, ms))
@@ -18,9 +18,12 @@ from django.contrib import admin
 from django.urls import path
 from django.urls import include
 from users.views import verify_email
+from backend.views import DependencyStatusView, metrics_view
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/auth/", include("users.urls")),
     path("verify-email/<uidb64>/<token>/", verify_email, name="verify_email"),
+    path("ops/dependencies/", DependencyStatusView.as_view(), name="dependency_status"),
+    path("metrics/", metrics_view, name="metrics"),
 
 ]
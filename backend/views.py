@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from services.resilience import dependency_states
+from services.singleflight import singleflight_stats
+
+from . import metrics
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def _dependency_samples():
+    for name, state in dependency_states().items():
+        yield (name, "circuit_state"), CIRCUIT_STATES[state["circuit"]["state"]]
+        yield (name, "bulkhead_in_use"), state["bulkhead"]["in_use"]
+        yield (name, "bulkhead_rejected"), state["bulkhead"]["rejected"]
+
+
+def _singleflight_samples():
+    for name, counters in singleflight_stats().items():
+        for counter, value in counters.items():
+            yield (name, counter), value
+
+
+def _db_pool_samples():
+    for alias in connections:
+        connection = connections[alias]
+        if not connection.settings_dict.get("OPTIONS", {}).get("pool"):
+            continue
+        # connection.pool would create (and later open) a pool for an alias
+        # this worker has not used yet; only report pools that exist.
+        pool = getattr(connection, "_connection_pools", {}).get(alias)
+        if pool is None:
+            continue
+        stats = pool.get_stats()
+        for stat, value in stats.items():
+            yield (alias, stat), value
+        in_use = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+        yield (alias, "utilization"), in_use / stats["pool_max"] if stats.get("pool_max") else 0
+
+
+def _cache_tier_samples():
+    for alias in caches:
+        cache = caches[alias]
+        if hasattr(cache, "stats"):
+            for stat, value in cache.stats().items():
+                yield (alias, stat), value
+
+
+metrics.REGISTRY.gauge(
+    "dependency_state", "Circuit state (0 closed, 1 half-open, 2 open) and bulkhead usage per dependency.",
+    ("dependency", "field"), _dependency_samples)
+metrics.REGISTRY.gauge(
+    "singleflight_calls", "Single-flight calls, executions, coalesced waits and shared-cache hits.",
+    ("flight", "counter"), _singleflight_samples)
+metrics.REGISTRY.gauge(
+    "db_pool", "psycopg_pool size, availability, waiting clients and cumulative wait time (ms) per database alias.",
+    ("alias", "stat"), _db_pool_samples)
+metrics.REGISTRY.gauge(
+    "cache_tier", "Two-tier cache hits and misses per tier, evictions, invalidations and local entries.",
+    ("cache", "stat"), _cache_tier_samples)
+
+
+class DependencyStatusView(APIView):
+    """Circuit breaker, bulkhead and single-flight state for outbound dependencies."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            "dependencies": dependency_states(),
+            "singleflight": singleflight_stats(),
+        })
+
+
+def metrics_view(request):
+    """
+    Prometheus text-format export of this worker's metrics. Scrapers send
+    METRICS_TOKEN as a bearer token; when it is not set, only clients in
+    METRICS_ALLOWED_IPS are served.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        if request.headers.get("Authorization") != f"Bearer {token}":
+            return HttpResponse("Unauthorized", status=401, content_type="text/plain")
+    elif request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponse("Forbidden", status=403, content_type="text/plain")
+    return HttpResponse(metrics.REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
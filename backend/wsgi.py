@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Only server processes warm up (users/warmup.py).
+from users.warmup import on_server_start  # noqa: E402
+
+on_server_start()
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.mail import send_mail
+
+from backend.metrics import record_outbound
+
+from .resilience import get_dependency
+
+
+def send_email(subject, message, recipient_list, from_email=None):
+    """
+    Send an email through the SMTP circuit breaker and bulkhead.
+
+    Raises CircuitOpenError / BulkheadFullError instead of waiting on a relay
+    that is already known to be failing or saturated.
+    """
+    with get_dependency("smtp").guard():
+        start = time.perf_counter()
+        try:
+            sent = send_mail(
+                subject,
+                message,
+                from_email or settings.DEFAULT_FROM_EMAIL,
+                recipient_list,
+                fail_silently=False,
+            )
+        except Exception:
+            record_outbound("smtp", time.perf_counter() - start, ok=False)
+            raise
+        record_outbound("smtp", time.perf_counter() - start, ok=True)
+        return sent
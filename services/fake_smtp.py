@@ -0,0 +1,92 @@
+"""
+Minimal SMTP sink that accepts every message and keeps it in memory.
+
+Enough of RFC 5321 for Django's SMTP backend without TLS or auth. Start it
+in-process with ``FakeSMTPServer().start()`` and point EMAIL_HOST/EMAIL_PORT at it.
+"""
+import socketserver
+import threading
+
+
+class FakeSMTPServer:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.messages = []
+        self.lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        handler = type("Handler", (_Handler,), {"sink": self})
+        self._server = _Server((self.host, self.port), handler)
+        threading.Thread(target=self._server.serve_forever, name="fake-smtp", daemon=True).start()
+        return self._server.server_address[1]
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    sink = None
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 fake-smtp ready")
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+
+            if verb == "EHLO":
+                self.reply("250-fake-smtp")
+                self.reply("250 8BITMIME")
+            elif verb == "HELO":
+                self.reply("250 fake-smtp")
+            elif verb == "MAIL":
+                sender, recipients = command.split(":", 1)[1].strip(), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip())
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                for raw in iter(self.rfile.readline, b""):
+                    if raw in (b".\r\n", b".\n"):
+                        break
+                    data.append(raw[1:] if raw.startswith(b"..") else raw)
+                with self.sink.lock:
+                    self.sink.messages.append({
+                        "from": sender,
+                        "to": recipients,
+                        "data": b"".join(data).decode("utf-8", "replace"),
+                    })
+                self.reply("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
@@ -0,0 +1,238 @@
+"""
+Minimal in-memory stand-in for the ThingsBoard REST API.
+
+Only the endpoints this backend calls are implemented. Run it standalone with
+``python -m services.fake_thingsboard --port 8081`` and point TB_BASE_URL at it,
+or start it in-process with ``FakeThingsBoard().start()``.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FAKE_TOKEN = "fake-thingsboard-token"
+
+
+class FakeThingsBoard:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.customers = {}
+        self.users = {}
+        self.devices = {}
+        self.telemetry = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self._server.server_port}"
+
+    def start(self):
+        handler = type("Handler", (_Handler,), {"fake": self})
+        self._server = _Server((self.host, self.port), handler)
+        threading.Thread(target=self._server.serve_forever, name="fake-thingsboard", daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Seeding helpers
+
+    def add_customer(self, email, title=None):
+        customer_id = str(uuid.uuid4())
+        with self.lock:
+            self.customers[customer_id] = {
+                "id": {"id": customer_id, "entityType": "CUSTOMER"},
+                "title": title or email,
+                "email": email,
+                "createdTime": int(time.time() * 1000),
+            }
+        return self.customers[customer_id]
+
+    def add_user(self, email, customer_id, first_name="", last_name=""):
+        user_id = str(uuid.uuid4())
+        with self.lock:
+            self.users[user_id] = {
+                "id": {"id": user_id, "entityType": "USER"},
+                "email": email,
+                "authority": "CUSTOMER_USER",
+                "firstName": first_name,
+                "lastName": last_name,
+                "customerId": {"id": customer_id, "entityType": "CUSTOMER"},
+                "createdTime": int(time.time() * 1000),
+            }
+        return self.users[user_id]
+
+    def add_device(self, customer_id, name, device_type="default", telemetry=None):
+        device_id = str(uuid.uuid4())
+        with self.lock:
+            self.devices[device_id] = {
+                "id": {"id": device_id, "entityType": "DEVICE"},
+                "name": name,
+                "type": device_type,
+                "label": name,
+                "customerId": {"id": customer_id, "entityType": "CUSTOMER"},
+                "createdTime": int(time.time() * 1000),
+            }
+            self.telemetry[device_id] = dict(telemetry or {})
+        return self.devices[device_id]
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default of 5 drops connections under benchmark load
+
+
+def _page(items, query):
+    page_size = int(query.get("pageSize", ["100"])[0])
+    page = int(query.get("page", ["0"])[0])
+    start = page * page_size
+    return {
+        "data": items[start:start + page_size],
+        "totalPages": (len(items) + page_size - 1) // page_size,
+        "totalElements": len(items),
+        "hasNext": start + page_size < len(items),
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _prepare(self):
+        with self.fake.lock:
+            self.fake.requests += 1
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        url = urlparse(self.path)
+        return url.path.rstrip("/").split("/"), parse_qs(url.query)
+
+    def _authorized(self):
+        if self.headers.get("X-Authorization") != f"Bearer {FAKE_TOKEN}":
+            self._reply(401, {"message": "Authentication failed", "status": 401})
+            return False
+        return True
+
+    def do_POST(self):
+        parts, query = self._prepare()
+        body = self._body()
+        fake = self.fake
+
+        if parts == ["", "api", "auth", "login"]:
+            return self._reply(200, {"token": FAKE_TOKEN, "refreshToken": FAKE_TOKEN})
+        if not self._authorized():
+            return
+
+        if parts == ["", "api", "customer"]:
+            with fake.lock:
+                duplicate = any(c["title"] == body.get("title") for c in fake.customers.values())
+            if duplicate:
+                return self._reply(400, {"message": "Customer with such title already exists!", "status": 400})
+            customer = fake.add_customer(body.get("email"), title=body.get("title"))
+            return self._reply(200, customer)
+
+        if parts == ["", "api", "user"]:
+            customer_id = (body.get("customerId") or {}).get("id")
+            with fake.lock:
+                duplicate = any(u["email"] == body.get("email") for u in fake.users.values())
+                known_customer = customer_id in fake.customers
+            if duplicate:
+                return self._reply(400, {"message": "User with email already exists!", "status": 400})
+            if not known_customer:
+                return self._reply(404, {"message": "Customer not found", "status": 404})
+            user = fake.add_user(body.get("email"), customer_id, body.get("firstName", ""), body.get("lastName", ""))
+            return self._reply(200, user)
+
+        self._reply(404, {"message": "Not found", "status": 404})
+
+    def do_GET(self):
+        parts, query = self._prepare()
+        if not self._authorized():
+            return
+        fake = self.fake
+
+        if parts == ["", "api", "customers"]:
+            with fake.lock:
+                items = sorted(fake.customers.values(), key=lambda c: c["createdTime"])
+            search = query.get("textSearch", [""])[0].lower()
+            if search:
+                items = [c for c in items if c["title"].lower().startswith(search)]
+            return self._reply(200, _page(items, query))
+
+        if len(parts) == 5 and parts[:3] == ["", "api", "customer"] and parts[4] == "users":
+            with fake.lock:
+                items = sorted(
+                    (u for u in fake.users.values() if u["customerId"]["id"] == parts[3]),
+                    key=lambda u: u["createdTime"],
+                )
+            return self._reply(200, _page(items, query))
+
+        if len(parts) == 5 and parts[:3] == ["", "api", "customer"] and parts[4] == "devices":
+            with fake.lock:
+                items = sorted(
+                    (d for d in fake.devices.values() if d["customerId"]["id"] == parts[3]),
+                    key=lambda d: d["createdTime"],
+                )
+            return self._reply(200, _page(items, query))
+
+        if len(parts) == 8 and parts[1:5] == ["api", "plugins", "telemetry", "DEVICE"] and parts[6:] == ["values", "timeseries"]:
+            with fake.lock:
+                values = fake.telemetry.get(parts[5])
+            if values is None:
+                return self._reply(404, {"message": "Device not found", "status": 404})
+            keys = [k for k in query.get("keys", [""])[0].split(",") if k] or list(values)
+            now = int(time.time() * 1000)
+            return self._reply(200, {
+                k: [{"ts": now, "value": str(values[k])}] for k in keys if k in values
+            })
+
+        self._reply(404, {"message": "Not found", "status": 404})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake ThingsBoard server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to sleep per request.")
+    args = parser.parse_args()
+
+    fake = FakeThingsBoard(args.host, args.port, args.latency)
+    print(f"Fake ThingsBoard listening on {fake.start()}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Circuit breakers and bulkheads for outbound dependencies (ThingsBoard, SMTP).
+
+Breaker state lives in the default cache, so every worker sees the same
+open/closed decision when that cache is shared (REDIS_URL); with the
+in-memory fallback each process keeps its own. Bulkheads are per-process
+semaphores that cap how many threads may be waiting on one dependency at a
+time.
+
+Only errors that say the dependency itself is in trouble (transport errors,
+timeouts, server-side failures) count against its breaker. A call that
+fails because of its input, such as a recipient address the relay rejects,
+is the caller's problem and leaves the circuit alone.
+"""
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+
+class BulkheadFullError(Exception):
+    """Raised when a dependency already has its maximum number of calls in flight."""
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` failures within ``failure_window`` seconds.
+    While open every call fails fast; after ``recovery_timeout`` seconds it goes
+    half-open and lets a single probe call through (across all workers). A
+    successful probe closes the circuit, a failed one re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=5, failure_window=60, recovery_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.recovery_timeout = recovery_timeout
+        self._failures_key = f"circuit:{name}:failures"
+        self._opened_key = f"circuit:{name}:opened_at"
+        self._probe_key = f"circuit:{name}:probe"
+
+    def state(self, opened_at=None):
+        if opened_at is None:
+            opened_at = cache.get(self._opened_key)
+        if opened_at is None:
+            return CLOSED
+        if time.time() - opened_at >= self.recovery_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def before_call(self):
+        """
+        Fail fast unless a call may go through. Returns the state the call
+        started under, to hand back to record_success() or record_failure().
+        """
+        opened_at = cache.get(self._opened_key)
+        state = self.state(opened_at)
+        if state == OPEN:
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        if state == HALF_OPEN and not cache.add(self._probe_key, True, timeout=self.recovery_timeout):
+            raise CircuitOpenError(f"{self.name} circuit is half-open and already probing")
+        return opened_at
+
+    # Outcomes of calls that started before the circuit last changed state are
+    # ignored: a slow call that succeeds after the circuit opened must not
+    # close it without a half-open probe, and one that fails must not keep
+    # re-opening it.
+
+    def record_success(self, started_under=None):
+        opened_at = cache.get(self._opened_key)
+        if opened_at is not None and opened_at == started_under:
+            # The half-open probe succeeded.
+            cache.delete_many([self._opened_key, self._failures_key, self._probe_key])
+
+    def record_failure(self, started_under=None):
+        opened_at = cache.get(self._opened_key)
+        if opened_at != started_under:
+            return
+        if opened_at is not None:
+            # The half-open probe failed.
+            self._open()
+            return
+        cache.add(self._failures_key, 0, timeout=self.failure_window)
+        try:
+            failures = cache.incr(self._failures_key)
+        except ValueError:
+            # Window expired between add() and incr().
+            cache.set(self._failures_key, 1, timeout=self.failure_window)
+            failures = 1
+        if failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        cache.set(self._opened_key, time.time(), timeout=None)
+        cache.delete_many([self._failures_key, self._probe_key])
+
+    def snapshot(self):
+        opened_at = cache.get(self._opened_key)
+        return {
+            "state": self.state(opened_at),
+            "failures": cache.get(self._failures_key, 0),
+            "opened_at": opened_at,
+        }
+
+
+class Bulkhead:
+    """Caps concurrent calls to a dependency within this process."""
+
+    def __init__(self, name, max_concurrent=10, wait_timeout=0.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.wait_timeout = wait_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self):
+        if not self._semaphore.acquire(timeout=self.wait_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise BulkheadFullError(f"{self.name} has {self.max_concurrent} calls in flight")
+        with self._lock:
+            self.in_use += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._semaphore.release()
+
+    def snapshot(self):
+        return {"in_use": self.in_use, "max_concurrent": self.max_concurrent, "rejected": self.rejected}
+
+
+def is_transport_failure(exc):
+    """Connection errors and timeouts (socket.timeout and TimeoutError are OSErrors)."""
+    return isinstance(exc, OSError)
+
+
+def is_smtp_failure(exc):
+    """
+    Whether an SMTP error means the relay is in trouble. Refused recipients
+    and other permanent (5xx) replies reject one message, not the relay;
+    failed logins and transient (4xx) replies affect every message.
+    """
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(exc, (smtplib.SMTPConnectError, smtplib.SMTPAuthenticationError)):
+        return True
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    return is_transport_failure(exc)
+
+
+FAILURE_CLASSIFIERS = {"smtp": is_smtp_failure}
+
+
+class Dependency:
+    def __init__(self, name, breaker, bulkhead, is_failure=is_transport_failure):
+        self.name = name
+        self.breaker = breaker
+        self.bulkhead = bulkhead
+        self.is_failure = is_failure
+
+    @contextmanager
+    def guard(self):
+        """
+        Run the block inside the bulkhead, recording the outcome on the
+        breaker. Exceptions that ``is_failure`` does not count pass through
+        as neither success nor failure.
+        """
+        with self.bulkhead.slot():
+            started_under = self.breaker.before_call()
+            try:
+                yield
+            except Exception as e:
+                if self.is_failure(e):
+                    self.breaker.record_failure(started_under)
+                raise
+            self.breaker.record_success(started_under)
+
+    def call(self, func, *args, **kwargs):
+        with self.guard():
+            return func(*args, **kwargs)
+
+    def snapshot(self):
+        return {"circuit": self.breaker.snapshot(), "bulkhead": self.bulkhead.snapshot()}
+
+
+_dependencies = {}
+_dependencies_lock = threading.Lock()
+
+
+def get_dependency(name):
+    """Return the process-wide Dependency configured under settings.RESILIENCE[name]."""
+    with _dependencies_lock:
+        if name not in _dependencies:
+            config = settings.RESILIENCE.get(name, {})
+            _dependencies[name] = Dependency(
+                name,
+                CircuitBreaker(
+                    name,
+                    failure_threshold=config.get("failure_threshold", 5),
+                    failure_window=config.get("failure_window", 60),
+                    recovery_timeout=config.get("recovery_timeout", 30),
+                ),
+                Bulkhead(
+                    name,
+                    max_concurrent=config.get("max_concurrent", 10),
+                    wait_timeout=config.get("wait_timeout", 0.0),
+                ),
+                is_failure=FAILURE_CLASSIFIERS.get(name, is_transport_failure),
+            )
+        return _dependencies[name]
+
+
+def dependency_states():
+    return {name: get_dependency(name).snapshot() for name in settings.RESILIENCE}
@@ -0,0 +1,115 @@
+"""
+Single-flight request coalescing.
+
+While a call for a given key is running, other threads in the process that ask
+for the same key wait for its result instead of issuing their own call. With
+``shared=True`` the leader also takes a lock in the shared cache and publishes
+its result there for ``result_ttl`` seconds, so other workers coalesce too.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name, lock_timeout=10.0, poll_interval=0.05):
+        self.name = name
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "executed": 0, "coalesced": 0, "shared_hits": 0}
+        _instances.append(self)
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _cache_key(self, key, kind):
+        return f"singleflight:{self.name}:{key}:{kind}"
+
+    def do(self, key, fn, shared=False, result_ttl=5):
+        """Return ``fn()``, sharing one execution among concurrent callers of ``key``."""
+        with self._lock:
+            self.counters["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._count("coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if shared:
+                call.result = self._run_shared(key, fn, result_ttl)
+            else:
+                self._count("executed")
+                call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_shared(self, key, fn, result_ttl):
+        result_key = self._cache_key(key, "result")
+        lock_key = self._cache_key(key, "lock")
+
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            cached = cache.get(result_key)
+            if cached is not None:
+                self._count("shared_hits")
+                return cached[0]
+            if cache.add(lock_key, True, timeout=self.lock_timeout):
+                break
+            if time.monotonic() >= deadline:
+                # The lock holder is stuck or died; stop waiting and call through.
+                lock_key = None
+                break
+            time.sleep(self.poll_interval)
+
+        try:
+            self._count("executed")
+            result = fn()
+            cache.set(result_key, (result,), timeout=result_ttl)
+            return result
+        finally:
+            if lock_key:
+                cache.delete(lock_key)
+
+    def forget(self, key, value=None):
+        """Drop a shared result, optionally only if it still equals ``value``."""
+        result_key = self._cache_key(key, "result")
+        if value is not None:
+            cached = cache.get(result_key)
+            if cached is None or cached[0] != value:
+                return
+        cache.delete(result_key)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, in_flight=len(self._calls))
+
+
+_instances = []
+
+
+def singleflight_stats():
+    return {flight.name: flight.stats() for flight in _instances}
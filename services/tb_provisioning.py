@@ -0,0 +1,34 @@
+import asyncio
+
+
+async def provision_tb_entities(client, jobs):
+    """
+    Create ThingsBoard entities for ``jobs`` concurrently.
+
+    Each job is a dict with ``email``, ``first_name``, ``last_name`` and an
+    optional ``customer_id`` (a ThingsBoard customer id). Jobs with a
+    customer_id become CUSTOMER_USERs under it, the rest become customers.
+    Concurrency is bounded by the client's semaphore.
+
+    Returns ``(job, entity, error)`` tuples in input order; exactly one of
+    entity and error is set.
+    """
+    async def provision(job):
+        try:
+            if job.get("customer_id"):
+                entity = await client.create_customer_user(
+                    job["email"], job["customer_id"],
+                    first_name=job.get("first_name") or "",
+                    last_name=job.get("last_name") or "",
+                )
+            else:
+                entity = await client.create_customer(
+                    job["email"],
+                    first_name=job.get("first_name") or "",
+                    last_name=job.get("last_name") or "",
+                )
+            return job, entity, None
+        except Exception as e:
+            return job, None, str(e)
+
+    return await asyncio.gather(*(provision(job) for job in jobs))
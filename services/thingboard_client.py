@@ -0,0 +1,195 @@
+import asyncio
+import time
+
+from django.conf import settings
+
+from backend.metrics import record_outbound
+
+from .resilience import get_dependency
+
+
+class AsyncThingsBoardClient:
+    """
+    Async ThingsBoard REST client.
+
+    One httpx.AsyncClient (and so one connection pool) is shared by every call
+    made through an instance, and a semaphore caps how many requests are in
+    flight at once. The admin JWT is cached and refreshed once on a 401.
+    Transport errors and 5xx responses count against the shared ThingsBoard
+    circuit breaker; while it is open requests fail fast with CircuitOpenError.
+    """
+
+    def __init__(self, base_url=None, username=None, password=None,
+                 max_concurrency=None, max_connections=None, timeout=None, transport=None):
+        self.base_url = (base_url or settings.TB_BASE_URL or "").rstrip("/")
+        self.username = username or settings.TB_ADMIN_EMAIL
+        self.password = password or settings.TB_ADMIN_PASSWORD
+        self.max_concurrency = max_concurrency or settings.TB_MAX_CONCURRENCY
+        self.max_connections = max_connections or settings.TB_MAX_CONNECTIONS
+        self.timeout = timeout or settings.TB_TIMEOUT
+        self.transport = transport  # an httpx transport to use instead of the network (tests)
+
+        self._http = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._token = None
+        self._token_lock = asyncio.Lock()
+        self._breaker = get_dependency("thingsboard").breaker
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _client(self):
+        if self._http is None:
+            import httpx  # deferred: most workers boot without calling ThingsBoard
+
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                transport=self.transport,
+            )
+        return self._http
+
+    async def _send(self, method, path, token=None, **kwargs):
+        headers = {"X-Authorization": f"Bearer {token}"} if token else {}
+        import httpx
+
+        started_under = self._breaker.before_call()
+        try:
+            async with self._semaphore:
+                start = time.perf_counter()
+                res = await self._client().request(method, path, headers=headers, **kwargs)
+        except httpx.TransportError:
+            record_outbound("thingsboard", time.perf_counter() - start, ok=False)
+            self._breaker.record_failure(started_under)
+            raise
+        ok = res.status_code < 500
+        record_outbound("thingsboard", time.perf_counter() - start, ok=ok)
+        if ok:
+            self._breaker.record_success(started_under)
+        else:
+            self._breaker.record_failure(started_under)
+        return res
+
+    # Auth
+
+    async def login(self, stale_token=None):
+        """
+        Return a valid admin JWT, logging in if there is none yet.
+
+        Pass the token that was just rejected as ``stale_token`` to force a
+        refresh; concurrent callers that saw the same stale token share one login.
+        """
+        if self._token and self._token != stale_token:
+            return self._token
+        async with self._token_lock:
+            if self._token and self._token != stale_token:
+                return self._token
+            self._token = await self.fetch_token(stale_token)
+            return self._token
+
+    async def fetch_token(self, stale_token=None):
+        """Log in as the ThingsBoard admin and return a fresh JWT."""
+        res = await self._send("POST", "/api/auth/login", json={
+            "username": self.username,
+            "password": self.password,
+        })
+        res.raise_for_status()
+        return res.json()["token"]
+
+    async def request(self, method, path, **kwargs):
+        """Send an authenticated request and return the decoded JSON body."""
+        token = await self.login()
+        res = await self._send(method, path, token=token, **kwargs)
+        if res.status_code == 401:
+            token = await self.login(stale_token=token)
+            res = await self._send(method, path, token=token, **kwargs)
+        res.raise_for_status()
+        return res.json() if res.content else None
+
+    async def paginate(self, path, page_size=100, params=None):
+        """Yield items from a paginated ThingsBoard endpoint one page at a time."""
+        page = 0
+        while True:
+            query = {"pageSize": page_size, "page": page, **(params or {})}
+            body = await self.request("GET", path, params=query)
+            for item in body.get("data", []):
+                yield item
+            if not body.get("hasNext"):
+                return
+            page += 1
+
+    # Customers
+
+    async def create_customer(self, email, first_name="", last_name=""):
+        return await self.request("POST", "/api/customer", json={
+            "title": f"{first_name} {last_name}" if (first_name or last_name) else email,
+            "email": email,
+            "additionalInfo": {
+                "description": "Created from Django backend",
+                "firstName": first_name or "",
+                "lastName": last_name or "",
+            },
+        })
+
+    def iter_customers(self, page_size=100, text_search=None):
+        params = {"textSearch": text_search} if text_search else None
+        return self.paginate("/api/customers", page_size=page_size, params=params)
+
+    async def list_customers(self, page_size=100):
+        return [c async for c in self.iter_customers(page_size=page_size)]
+
+    async def find_customer_by_email(self, email, page_size=100):
+        """ThingsBoard has no email filter, so scan pages until a match is found."""
+        async for customer in self.iter_customers(page_size=page_size):
+            if customer.get("email") == email:
+                return customer
+        return None
+
+    # Customer users
+
+    async def create_customer_user(self, email, customer_id, first_name="", last_name=""):
+        return await self.request("POST", "/api/user", params={"sendActivationMail": "false"}, json={
+            "email": email,
+            "authority": "CUSTOMER_USER",
+            "firstName": first_name or "",
+            "lastName": last_name or "",
+            "customerId": {"id": customer_id, "entityType": "CUSTOMER"},
+            "additionalInfo": {
+                "description": "Created from Django backend"
+            },
+        })
+
+    def iter_customer_users(self, customer_id, page_size=100):
+        return self.paginate(f"/api/customer/{customer_id}/users", page_size=page_size)
+
+    # Devices and telemetry
+
+    def iter_customer_devices(self, customer_id, page_size=100):
+        return self.paginate(f"/api/customer/{customer_id}/devices", page_size=page_size)
+
+    async def list_customer_devices(self, customer_id, page_size=100):
+        return [d async for d in self.iter_customer_devices(customer_id, page_size=page_size)]
+
+    async def get_latest_telemetry(self, device_id, keys=None):
+        """Latest timeseries values of ``keys`` (all keys if empty) for one device, in one call."""
+        params = {"keys": ",".join(keys)} if keys else None
+        return await self.request(
+            "GET", f"/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries", params=params
+        )
+
+    async def get_latest_telemetry_many(self, device_ids, keys=None):
+        """Latest telemetry for several devices fetched concurrently, keyed by device id."""
+        results = await asyncio.gather(*(self.get_latest_telemetry(d, keys) for d in device_ids))
+        return dict(zip(device_ids, results))
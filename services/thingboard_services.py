@@ -1,76 +1,155 @@
-import requests 
+import asyncio
+import threading
+
 from django.conf import settings
+from django.core.cache import cache
+
+from .resilience import get_dependency
+from .singleflight import SingleFlight
+from .thingboard_client import AsyncThingsBoardClient
+
+# The shared async client lives on one background event loop so every sync
+# caller in the process reuses its connection pool and concurrency limit.
+_loop = None
+_client = None
+_lock = threading.Lock()
+
+# Identical reads (admin login, the full customer list) are coalesced across
+# threads, and across workers through the shared cache.
+_flight = SingleFlight("thingsboard")
+
+
+class _SharedTokenClient(AsyncThingsBoardClient):
+    """Process-wide client that gets its admin JWT through get_tb_token()."""
+
+    async def fetch_token(self, stale_token=None):
+        return await asyncio.get_running_loop().run_in_executor(None, get_tb_token, stale_token)
+
+
+def get_client():
+    """Return the process-wide AsyncThingsBoardClient and the loop it runs on."""
+    global _loop, _client
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="thingsboard-client", daemon=True).start()
+            _client = _SharedTokenClient()
+    return _client, _loop
+
+
+def run_sync(make_coro):
+    """
+    Run ``make_coro(client)`` on the shared client's loop and wait for the result.
+
+    Waiting threads are capped by the ThingsBoard bulkhead so a slow ThingsBoard
+    cannot tie up every worker thread; the circuit breaker lives in the client.
+    """
+    client, loop = get_client()
+    with get_dependency("thingsboard").bulkhead.slot():
+        return asyncio.run_coroutine_threadsafe(make_coro(client), loop).result()
+
+
+def get_tb_token(stale_token=None):
+    """
+    Login as ThingsBoard admin and return JWT token.
+
+    The token is shared by all workers for TB_TOKEN_TTL seconds and concurrent
+    logins are coalesced. Pass a token ThingsBoard just rejected as
+    ``stale_token`` to force a new login.
+    """
+    if stale_token:
+        _flight.forget("token", stale_token)
+    client, loop = get_client()
+    login = AsyncThingsBoardClient.fetch_token
+    return _flight.do(
+        "token",
+        lambda: asyncio.run_coroutine_threadsafe(login(client), loop).result(),
+        shared=True,
+        result_ttl=settings.TB_TOKEN_TTL,
+    )
 
-def get_tb_token():
-    """Login as ThingsBoard admin and return JWT token."""
-    url = f"{settings.TB_BASE_URL}/api/auth/login"
-    payload = {
-        "username": settings.TB_ADMIN_EMAIL,
-        "password": settings.TB_ADMIN_PASSWORD
-    }
-    res = requests.post(url, json=payload)
-    res.raise_for_status()
-    return res.json()["token"]
 
 def create_tb_user(email, first_name, last_name, user_type=None, parent_customer_id=None):
     """
     Create a ThingsBoard user.
-    
+
     - By default → creates a CUSTOMER (new customer tenant in TB).
-    - If called with user_type='CUSTOMER_USER' and parent_customer_id → 
+    - If called with user_type='CUSTOMER_USER' and parent_customer_id →
       creates a CUSTOMER_USER under that customer.
     """
-    token = get_tb_token()
-    headers = {"X-Authorization": f"Bearer {token}"}
-
     if user_type == "CUSTOMER_USER" and parent_customer_id:
-        # Create a customer user under an existing customer
-        url = f"{settings.TB_BASE_URL}/api/user?sendActivationMail=false"
-        payload = {
-            "email": email,
-            "authority": "CUSTOMER_USER",
-            "firstName": first_name or "",
-            "lastName": last_name or "",
-            "customerId": {"id": parent_customer_id, "entityType": "CUSTOMER"},
-            "additionalInfo": {
-                "description": "Created from Django backend"
-            }
-        }
-    else:
-        # Default → create a new customer
-        url = f"{settings.TB_BASE_URL}/api/customer"
-        payload = {
-            "title": f"{first_name} {last_name}" if (first_name or last_name) else email,
-            "email": email,
-            "additionalInfo": {
-                "description": "Created from Django backend",
-                "firstName": first_name or "",
-                "lastName": last_name or ""
-            }
-        }
-
-    res = requests.post(url, json=payload, headers=headers)
-    res.raise_for_status()
-    return res.json()
+        return run_sync(lambda client: client.create_customer_user(
+            email, parent_customer_id, first_name=first_name, last_name=last_name
+        ))
+    return run_sync(lambda client: client.create_customer(
+        email, first_name=first_name, last_name=last_name
+    ))
+
+
+def list_tb_customers():
+    """Return every ThingsBoard customer, following pagination. Concurrent callers share one fetch."""
+    return _flight.do(
+        "customers",
+        lambda: run_sync(lambda client: client.list_customers()),
+        shared=True,
+        result_ttl=settings.TB_CUSTOMERS_TTL,
+    )
+
 
 def get_customer_by_email(email):
-    """Get customer information by email (ThingsBoard has no direct email filter, so this may need refinement)."""
-    token = get_tb_token()
-    url = f"{settings.TB_BASE_URL}/api/customers?pageSize=100&page=0"
-    headers = {"X-Authorization": f"Bearer {token}"}
-
-    res = requests.get(url, headers=headers)
-    res.raise_for_status()
-    
-    customers = res.json().get("data", [])
-    for c in customers:
+    """Get customer information by email (ThingsBoard has no direct email filter, so the list is scanned)."""
+    for c in list_tb_customers():
         if c.get("email") == email:
             return c
     return None
 
+
 def get_customer_id_by_email(email):
-    """Get customer ID by email for customer users."""
-    customer = get_customer_by_email(email)
-    if customer:
-        return customer.get("id", {}).get("id")
-    return None
+    """Get customer ID by email for customer users (cached for TB_CUSTOMER_ID_TTL seconds)."""
+    cache_key = f"tb:customer-id:{email}"
+    customer_id = cache.get(cache_key)
+    if customer_id is None:
+        customer = get_customer_by_email(email)
+        if not customer:
+            return None
+        customer_id = customer.get("id", {}).get("id")
+        cache.set(cache_key, customer_id, timeout=settings.TB_CUSTOMER_ID_TTL)
+    return customer_id
+
+
+def get_customer_devices(customer_id):
+    """Devices assigned to a ThingsBoard customer, read through a short-TTL shared cache."""
+    cache_key = f"tb:devices:{customer_id}"
+    devices = cache.get(cache_key)
+    if devices is None:
+        devices = _flight.do(
+            f"devices:{customer_id}",
+            lambda: run_sync(lambda client: client.list_customer_devices(customer_id)),
+        )
+        cache.set(cache_key, devices, timeout=settings.TB_DEVICES_TTL)
+    return devices
+
+
+def get_devices_telemetry(device_ids, keys=None):
+    """
+    Latest telemetry for ``device_ids``, keyed by device id.
+
+    Each device's values are cached for TB_TELEMETRY_TTL seconds. Misses are
+    fetched concurrently in one round trip to the client loop, and identical
+    concurrent misses share that fetch.
+    """
+    keys = sorted(set(keys or []))
+    signature = ",".join(keys) or "*"
+    cache_keys = {device_id: f"tb:telemetry:{device_id}:{signature}" for device_id in device_ids}
+    cached = cache.get_many(list(cache_keys.values()))
+
+    telemetry = {d: cached[k] for d, k in cache_keys.items() if k in cached}
+    missing = [d for d in device_ids if d not in telemetry]
+    if missing:
+        fetched = _flight.do(
+            f"telemetry:{signature}:{','.join(sorted(missing))}",
+            lambda: run_sync(lambda client: client.get_latest_telemetry_many(missing, keys)),
+        )
+        cache.set_many({cache_keys[d]: values for d, values in fetched.items()}, timeout=settings.TB_TELEMETRY_TTL)
+        telemetry.update(fetched)
+    return telemetry
@@ -1,6 +1,77 @@
-from django.contrib import admin
+import logging
+from datetime import timedelta
+
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, CustomerInvitation
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import audit, stats
+from .events import (
+    USER_APPROVAL_EMAIL_REQUESTED, USER_APPROVED, USER_DEACTIVATED, USER_INVITATION_EMAIL_REQUESTED,
+    USER_VERIFICATION_REQUESTED, record_events,
+)
+from .identifiers import normalize_identifier, parse_phone
+from .models import AuthAuditEvent, CustomUser, CustomerInvitation, CustomerMembershipStats, UserEvent
+from .sessions import delete_user_sessions, session_model
+
+logger = logging.getLogger(__name__)
+
+# Bulk actions work through large selections ("select all N") in chunks of
+# this many rows: one UPDATE and one outbox INSERT each. Emails are queued in
+# the outbox and sent by ``manage.py dispatch_events`` (EmailSink).
+ACTION_CHUNK_SIZE = 500
+
+
+def _chunks(queryset, fields):
+    """Yield lists of model instances (only ``fields`` loaded), in primary key order."""
+    last_pk = None
+    queryset = queryset.only(*fields).order_by("pk")
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(page[:ACTION_CHUNK_SIZE])
+        if not rows:
+            return
+        yield rows
+        last_pk = rows[-1].pk
+
+
+def _lock_unchanged(users, **unchanged):
+    """
+    Lock the rows of ``users`` that still match ``unchanged`` and return
+    those users. Call inside a transaction: an admin racing another one on
+    the same rows then waits, and acts only on the rows it changes itself.
+    """
+    pks = set(
+        CustomUser.objects.select_for_update()
+        .filter(pk__in=[u.pk for u in users], **unchanged)
+        .values_list("pk", flat=True)
+    )
+    return [u for u in users if u.pk in pks]
+
+
+class BulkActionReport:
+    """Counts for one admin action, reported back to the admin as a single message."""
+
+    def __init__(self, selected):
+        self.selected = selected
+        self.updated = 0
+        self.queued = 0
+        self.sessions_ended = 0
+        self.chunks = 0
+
+    def message_user(self, modeladmin, request, verb, noun):
+        text = f"{verb} {self.updated} of {self.selected} selected {noun} in {self.chunks} batch(es)"
+        if self.queued:
+            text += f"; {self.queued} email(s) queued"
+        if self.sessions_ended:
+            text += f"; {self.sessions_ended} session(s) ended"
+        skipped = self.selected - self.updated
+        if skipped:
+            text += f"; {skipped} skipped (already done or not eligible)"
+        modeladmin.message_user(request, text + ".", messages.SUCCESS)
+
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
@@ -8,6 +79,7 @@ class CustomUserAdmin(UserAdmin):
     list_filter = ('user_type', 'is_approved', 'email_verified', 'is_active', 'gender', 'date_joined')
     search_fields = ('username', 'email', 'first_name', 'last_name', 'phone_number')
     ordering = ('-date_joined',)
+    actions = ('approve_users', 'deactivate_users', 'resend_verification')
     
     fieldsets = (
         (None, {'fields': ('username', 'password')}),
@@ -26,6 +98,61 @@ class CustomUserAdmin(UserAdmin):
         }),
     )
 
+    @admin.action(description="Approve selected users and email them", permissions=("change",))
+    def approve_users(self, request, queryset):
+        report = BulkActionReport(queryset.count())
+        fields = ("email", "user_type", "parent_customer_id")
+        now = timezone.now()
+        for users in _chunks(queryset.filter(is_approved=False), fields):
+            with transaction.atomic():
+                users = _lock_unchanged(users, is_approved=False)
+                report.updated += CustomUser.objects.filter(pk__in=[u.pk for u in users]).update(
+                    is_approved=True, approved_by=request.user, approved_at=now,
+                )
+                for user in users:
+                    user.is_approved = True
+                record_events(USER_APPROVED, users, approved_by=request.user.pk, source="admin")
+                report.queued += len(record_events(USER_APPROVAL_EMAIL_REQUESTED, users, approved_by=request.user.pk))
+                stats.Changes().members_approved(users).apply()
+            for user in users:
+                audit.record(AuthAuditEvent.APPROVAL, request, user=user, identifier=user.email,
+                             approved_by=request.user.pk, source="admin")
+            report.chunks += 1
+        report.message_user(self, request, "Approved", "users")
+
+    @admin.action(description="Deactivate selected users", permissions=("change",))
+    def deactivate_users(self, request, queryset):
+        report = BulkActionReport(queryset.count())
+        fields = ("email", "user_type", "parent_customer_id", "is_approved")
+        deactivated = []
+        for users in _chunks(queryset.filter(is_active=True).exclude(pk=request.user.pk), fields):
+            with transaction.atomic():
+                users = _lock_unchanged(users, is_active=True)
+                report.updated += CustomUser.objects.filter(pk__in=[u.pk for u in users]).update(is_active=False)
+                record_events(USER_DEACTIVATED, users, deactivated_by=request.user.pk, source="admin")
+            deactivated.extend(u.pk for u in users)
+            report.chunks += 1
+        if deactivated:
+            try:
+                model = session_model()
+            except ValueError:
+                # Cache or cookie sessions cannot be listed; the auth backend
+                # still refuses inactive users on their next request.
+                logger.warning("Sessions of deactivated users not deleted", extra={"users": len(deactivated)})
+            else:
+                report.sessions_ended = delete_user_sessions(model, deactivated)
+        report.message_user(self, request, "Deactivated", "users")
+
+    @admin.action(description="Resend verification email to selected users", permissions=("change",))
+    def resend_verification(self, request, queryset):
+        report = BulkActionReport(queryset.count())
+        fields = ("email", "user_type", "parent_customer_id", "is_approved")
+        for users in _chunks(queryset.filter(email_verified=False).exclude(email=""), fields):
+            report.updated += len(users)
+            report.queued += len(record_events(USER_VERIFICATION_REQUESTED, users, source="admin"))
+            report.chunks += 1
+        report.message_user(self, request, "Resent verification to", "users")
+
 @admin.register(CustomerInvitation)
 class CustomerInvitationAdmin(admin.ModelAdmin):
     list_display = ('email', 'customer', 'is_used', 'created_at', 'expires_at')
@@ -33,9 +160,97 @@ class CustomerInvitationAdmin(admin.ModelAdmin):
     search_fields = ('email', 'customer__username', 'customer__email')
     readonly_fields = ('token', 'created_at')
     ordering = ('-created_at',)
+    list_select_related = ('customer',)
+    actions = ('resend_invitations', 'expire_invitations')
     
     fieldsets = (
         ('Invitation Details', {'fields': ('email', 'customer')}),
         ('Token & Status', {'fields': ('token', 'is_used', 'expires_at')}),
         ('Timestamps', {'fields': ('created_at',)}),
     )
+
+    @admin.action(description="Extend by 7 days and resend selected invitations", permissions=("change",))
+    def resend_invitations(self, request, queryset):
+        report = BulkActionReport(queryset.count())
+        now = timezone.now()
+        expires_at = now + timedelta(days=7)
+        pending = queryset.filter(is_used=False).select_related(None)
+        fields = ("token", "expires_at", "customer")
+        for invitations in _chunks(pending, fields):
+            with transaction.atomic():
+                report.updated += CustomerInvitation.objects.filter(
+                    pk__in=[i.pk for i in invitations]).update(expires_at=expires_at)
+                # Expired invitations become open again.
+                reopened = [i.customer_id for i in invitations if i.expires_at <= now]
+                stats.Changes().invitations(reopened, 1).apply()
+                report.queued += len(UserEvent.objects.bulk_create([
+                    UserEvent(event_type=USER_INVITATION_EMAIL_REQUESTED, user_id=i.customer_id,
+                              payload={"invitation_id": i.pk})
+                    for i in invitations
+                ]))
+            cache.delete_many([f"invitation:{i.token}" for i in invitations])
+            report.chunks += 1
+        report.message_user(self, request, "Resent", "invitations")
+
+    @admin.action(description="Expire selected invitations", permissions=("change",))
+    def expire_invitations(self, request, queryset):
+        report = BulkActionReport(queryset.count())
+        now = timezone.now()
+        pending = queryset.filter(is_used=False, expires_at__gt=now).select_related(None)
+        for invitations in _chunks(pending, ("token", "customer")):
+            with transaction.atomic():
+                report.updated += CustomerInvitation.objects.filter(
+                    pk__in=[i.pk for i in invitations]).update(expires_at=now)
+                stats.Changes().invitations([i.customer_id for i in invitations], -1).apply()
+            # resolve_invitation() caches tokens; drop them so links stop working now.
+            cache.delete_many([f"invitation:{i.token}" for i in invitations])
+            report.chunks += 1
+        report.message_user(self, request, "Expired", "invitations")
+
+
+@admin.register(UserEvent)
+class UserEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event_type', 'user_id', 'status', 'attempts', 'created_at', 'delivered_at')
+    list_filter = ('status', 'event_type')
+    search_fields = ('=user_id',)
+    readonly_fields = ('event_type', 'user_id', 'payload', 'created_at', 'delivered_at', 'last_error')
+    ordering = ('-id',)
+
+
+@admin.register(CustomerMembershipStats)
+class CustomerMembershipStatsAdmin(admin.ModelAdmin):
+    list_display = ('customer', 'approved_members', 'pending_members', 'open_invitations', 'updated_at', 'recomputed_at')
+    list_select_related = ('customer',)
+    search_fields = ('customer__email',)
+    readonly_fields = ('customer', 'approved_members', 'pending_members', 'open_invitations', 'updated_at', 'recomputed_at')
+
+
+@admin.register(AuthAuditEvent)
+class AuthAuditEventAdmin(admin.ModelAdmin):
+    """Read-only. Filters and search map onto the table's indexes; always narrow by date."""
+
+    list_display = ('occurred_at', 'action', 'success', 'user_id', 'identifier', 'ip_address', 'request_id')
+    list_filter = (('occurred_at', admin.DateFieldListFilter), 'action', 'success')
+    search_fields = ('identifier',)
+    search_help_text = "Exact email, phone number or user id."
+    list_per_page = 100
+    # The exact total would count every matching row across partitions.
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # Exact matches only: icontains would scan every partition.
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit() and parse_phone(term) is None:
+            return queryset.filter(user_id=int(term)), False
+        return queryset.filter(identifier=normalize_identifier(term)), False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
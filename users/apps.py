@@ -1,6 +1,24 @@
+import logging
+
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
 
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from django.conf import settings
+
+        logger.debug("Email settings loaded", extra={
+            "email_host": settings.EMAIL_HOST,
+            "email_port": settings.EMAIL_PORT,
+            "email_host_user": settings.EMAIL_HOST_USER,
+            "email_use_tls": settings.EMAIL_USE_TLS,
+        })
+
+        from . import warmup
+
+        warmup.on_app_ready()
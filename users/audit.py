@@ -0,0 +1,197 @@
+"""
+Authentication audit trail (AuthAuditEvent) without a write per request.
+
+Views call ``record()``, which only appends the event to a buffer in the
+worker's memory. A background thread per process writes the buffer with
+one multi-row INSERT when it holds AUDIT_BATCH_SIZE events or every
+AUDIT_FLUSH_INTERVAL seconds, whichever comes first:
+
+    audit.record(AuthAuditEvent.LOGIN, request, user=user, identifier=email)
+
+When the insert fails (database down, failover), the batch is appended to
+a JSON lines file in AUDIT_SPOOL_DIR and fsynced; the worker writes its
+spool back after its next successful insert, and ``manage.py
+replay_audit_spool`` recovers the files of workers that died. Events still
+in memory are written at interpreter exit, so a clean worker restart loses
+nothing; a killed worker loses at most one flush interval of events.
+
+With AUDIT_FLUSH_INTERVAL = 0 no thread is started and the buffer is only
+written when it is full or on ``get_buffer().flush()`` (tests, commands).
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.utils.dateparse import parse_datetime
+
+from backend import metrics
+from backend.log import request_id
+
+from .models import AuthAuditEvent
+
+logger = logging.getLogger(__name__)
+
+audit_events = metrics.REGISTRY.counter(
+    "auth_audit_events_total", "Audit events leaving the buffer: written, spooled to disk or replayed.", ("outcome",))
+
+_FIELDS = ("occurred_at", "action", "success", "user_id", "identifier", "ip_address", "request_id", "detail")
+
+
+def _serialize(event):
+    return json.dumps({name: getattr(event, name) for name in _FIELDS}, cls=DjangoJSONEncoder)
+
+
+def _deserialize(line):
+    data = json.loads(line)
+    data["occurred_at"] = parse_datetime(data["occurred_at"])
+    return AuthAuditEvent(**data)
+
+
+def write_events(events):
+    # One transaction, so a failed batch is spooled whole rather than half written.
+    with transaction.atomic():
+        AuthAuditEvent.objects.bulk_create(events, batch_size=settings.AUDIT_BATCH_SIZE)
+
+
+class AuditBuffer:
+    def __init__(self):
+        self.events = []
+        self.spooled = False
+        self.thread_pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def add(self, event):
+        if settings.AUDIT_FLUSH_INTERVAL > 0:
+            self._ensure_started()
+        with self._lock:
+            self.events.append(event)
+            full = len(self.events) >= settings.AUDIT_BATCH_SIZE
+        if full:
+            if self.thread_pid == os.getpid():
+                self._wakeup.set()
+            else:
+                self.flush()
+
+    def flush(self):
+        """Write the buffered events; returns how many left the buffer."""
+        with self._lock:
+            events, self.events = self.events, []
+        if not events:
+            return 0
+        try:
+            write_events(events)
+        except Exception:
+            logger.exception("Audit insert failed; spooling to disk", extra={"events": len(events)})
+            self.spool(events)
+            return len(events)
+        audit_events.inc("written", amount=len(events))
+        if self.spooled:
+            self.spooled = False
+            try:
+                replay_spool(self.spool_path())
+            except Exception:
+                logger.exception("Audit spool replay failed", extra={"path": self.spool_path()})
+        return len(events)
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+
+    def spool_path(self):
+        return os.path.join(settings.AUDIT_SPOOL_DIR, f"audit-{os.getpid()}.jsonl")
+
+    def spool(self, events):
+        os.makedirs(settings.AUDIT_SPOOL_DIR, exist_ok=True)
+        with open(self.spool_path(), "a", encoding="utf-8") as f:
+            f.write("".join(_serialize(event) + "\n" for event in events))
+            f.flush()
+            os.fsync(f.fileno())
+        self.spooled = True
+        audit_events.inc("spooled", amount=len(events))
+
+    def _ensure_started(self):
+        # Checked per process: a forked worker does not inherit the parent's thread.
+        if self.thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self.thread_pid == os.getpid():
+                return
+            # Events copied from the parent process are the parent's to write.
+            self.events = []
+            self.spooled = False
+            self.thread_pid = os.getpid()
+            threading.Thread(target=self._loop, name="audit-flush", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(settings.AUDIT_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Audit flush failed")
+            finally:
+                # Don't hold a pooled connection in the flush thread between rounds.
+                connections["default"].close()
+
+
+_buffer = AuditBuffer()
+
+
+def get_buffer():
+    return _buffer
+
+
+def _buffered_samples():
+    yield (), len(_buffer.events)
+
+
+metrics.REGISTRY.gauge("auth_audit_buffered", "Audit events waiting in this worker's buffer.", (), _buffered_samples)
+
+
+def record(action, request=None, *, user=None, identifier="", success=True, **detail):
+    """Buffer an audit event. ``detail`` holds action-specific fields, e.g. ``reason`` or ``purpose``."""
+    ip_address = request.META.get("REMOTE_ADDR") if request is not None else None
+    _buffer.add(AuthAuditEvent(
+        action=action,
+        success=success,
+        user_id=getattr(user, "pk", None),
+        identifier=identifier or "",
+        ip_address=ip_address or None,
+        request_id=request_id.get() or "",
+        detail=detail,
+    ))
+
+
+def replay_spool(path):
+    """
+    Write the events of one spool file and delete it. The file is renamed
+    first, so a worker still spooling starts a new one and two replays never
+    write the same file. Returns the number of events written.
+    """
+    claimed = path if path.endswith(".replaying") else f"{path}.{uuid.uuid4().hex}.replaying"
+    if claimed != path:
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return 0
+    with open(claimed, encoding="utf-8") as f:
+        events = [_deserialize(line) for line in f if line.strip()]
+    write_events(events)
+    os.remove(claimed)
+    audit_events.inc("replayed", amount=len(events))
+    logger.info("Audit spool replayed", extra={"path": path, "events": len(events)})
+    return len(events)
+
+
+def spool_files():
+    return sorted(glob.glob(os.path.join(settings.AUDIT_SPOOL_DIR, "audit-*.jsonl*")))
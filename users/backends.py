@@ -0,0 +1,23 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .identifiers import normalize_email
+from .models import CustomUser
+
+
+class EmailBackend(ModelBackend):
+    """
+    ModelBackend that also accepts an email address in any letter case.
+
+    Emails are looked up through the LOWER("email") index, so older accounts
+    whose username kept the casing they registered with still match. Anything
+    else (admin usernames, unknown emails) falls through to ModelBackend.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username and password and "@" in username:
+            user = CustomUser.objects.filter(email__lower=normalize_email(username)).first()
+            if user is not None:
+                if user.check_password(password) and self.user_can_authenticate(user):
+                    return user
+                return None
+        return super().authenticate(request, username=username, password=password, **kwargs)
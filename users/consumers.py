@@ -0,0 +1,106 @@
+"""
+WebSocket push of account status changes: ``ws/account/``.
+
+Clients authenticate either with their session cookie (browsers) or with a
+short-lived signed ticket from ``GET /api/auth/ws-ticket/`` passed as
+``?ticket=...`` (mobile apps, which cannot always send cookies on the
+upgrade request). On connect the client receives its current status, then
+every approval, verification and invitation event for its account as it
+is delivered from the outbox by the ChannelLayerSink.
+"""
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+from django.core import signing
+
+from .models import CustomUser
+
+TICKET_SALT = "users.ws-ticket"
+TICKET_MAX_AGE = 60  # seconds a ticket can be used to open a connection
+
+# Close codes in the 4000 range are application defined.
+CLOSE_UNAUTHENTICATED = 4401
+CLOSE_FORBIDDEN_ORIGIN = 4403
+
+
+def make_ticket(user):
+    return signing.dumps({"user": user.pk}, salt=TICKET_SALT)
+
+
+def user_group(user_id):
+    return f"user-{user_id}"
+
+
+def customer_group(customer_id):
+    return f"customer-{customer_id}"
+
+
+def status_message(user):
+    return {
+        "type": "account.status",
+        "user_id": user.pk,
+        "user_type": user.user_type,
+        "is_approved": user.is_approved,
+        "email_verified": user.email_verified,
+        "is_active": user.is_active,
+    }
+
+
+@database_sync_to_async
+def _user_for_ticket(ticket):
+    try:
+        data = signing.loads(ticket, salt=TICKET_SALT, max_age=TICKET_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return CustomUser.objects.filter(pk=data["user"], is_active=True).first()
+
+
+@database_sync_to_async
+def _refresh(user):
+    # scope["user"] is a lazy object; load the current row once.
+    return CustomUser.objects.get(pk=user.pk)
+
+
+class AccountStatusConsumer(AsyncJsonWebsocketConsumer):
+    async def connect(self):
+        user, close_code = await self.authenticate()
+        if user is None:
+            await self.close(code=close_code)
+            return
+
+        # Channels discards self.groups on disconnect.
+        self.groups = [user_group(user.pk)]
+        if user.user_type == "CUSTOMER":
+            # Customers also hear about users joining through their invitations.
+            self.groups.append(customer_group(user.pk))
+        for group in self.groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+
+        await self.accept()
+        await self.send_json(status_message(user))
+
+    async def authenticate(self):
+        """Returns ``(user, None)``, or ``(None, close code)`` to reject the connection."""
+        ticket = parse_qs(self.scope.get("query_string", b"").decode()).get("ticket")
+        if ticket:
+            user = await _user_for_ticket(ticket[0])
+            return (user, None) if user else (None, CLOSE_UNAUTHENTICATED)
+
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            return None, CLOSE_UNAUTHENTICATED
+        # Cookies are sent cross-site too: only trusted origins may use the session.
+        origin = dict(self.scope.get("headers", [])).get(b"origin", b"").decode()
+        if origin not in settings.CORS_ALLOWED_ORIGINS and origin not in settings.CSRF_TRUSTED_ORIGINS:
+            return None, CLOSE_FORBIDDEN_ORIGIN
+        return await _refresh(user), None
+
+    async def receive_json(self, content, **kwargs):
+        # Keep-alive for clients behind proxies that drop idle connections.
+        if content.get("type") == "ping":
+            await self.send_json({"type": "pong"})
+
+    async def account_event(self, message):
+        await self.send_json(message["event"])
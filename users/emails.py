@@ -0,0 +1,68 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMessage, get_connection
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from backend.metrics import record_outbound
+from services.resilience import get_dependency
+
+VERIFICATION_SUBJECT = "Verify your email - BeySmart App"
+
+
+def verification_link(user):
+    uidb64 = urlsafe_base64_encode(force_bytes(user.pk))
+    token = default_token_generator.make_token(user)
+    return f"{settings.FRONTEND_URL}/verify-email/{uidb64}/{token}/"
+
+
+def verification_body(user):
+    return (
+        "Welcome to BeySmart! Please click the following link to verify your email address:"
+        f"\n\n{verification_link(user)}\n\nThis link will expire in 24 hours."
+        "\n\nIf you didn't create this account, please ignore this email."
+    )
+
+
+def verification_message(user):
+    return EmailMessage(VERIFICATION_SUBJECT, verification_body(user), settings.DEFAULT_FROM_EMAIL, [user.email])
+
+
+def approval_message(user, approver):
+    name = f"{approver.first_name} {approver.last_name}".strip() or approver.username
+    return EmailMessage(
+        "Your account has been approved",
+        f"Your account has been approved by {name}. Click here to activate: {verification_link(user)}",
+        settings.DEFAULT_FROM_EMAIL, [user.email],
+    )
+
+
+def invitation_message(invitation, customer):
+    link = f"{settings.FRONTEND_URL}/register?invitation={invitation.token}"
+    return EmailMessage(
+        "You're invited to join our platform",
+        f"You've been invited by {customer.first_name} {customer.last_name} to join their customer account. "
+        f"Click here to register: {link}",
+        settings.DEFAULT_FROM_EMAIL, [invitation.email],
+    )
+
+
+def send_bulk(messages, batch_size=100):
+    """
+    Send EmailMessages reusing one SMTP connection per batch, through the SMTP
+    circuit breaker and bulkhead. Returns the number of messages sent.
+    """
+    sent = 0
+    for start in range(0, len(messages), batch_size):
+        batch = messages[start:start + batch_size]
+        with get_dependency("smtp").guard():
+            began = time.perf_counter()
+            try:
+                sent += get_connection().send_messages(batch) or 0
+            except Exception:
+                record_outbound("smtp", time.perf_counter() - began, ok=False)
+                raise
+            record_outbound("smtp", time.perf_counter() - began, ok=True)
+    return sent
@@ -0,0 +1,376 @@
+"""
+User lifecycle events: a transactional outbox and its dispatcher.
+
+Views call ``record_event()`` inside the transaction that changes the user,
+so an event exists if and only if the change was committed. The
+``dispatch_events`` command then delivers pending events, oldest first, in
+batches to every sink in USER_EVENT_SINKS:
+
+    USER_EVENT_SINKS = [
+        {"class": "users.events.WebhookSink", "url": "https://crm.example.com/hooks/users", "secret": "..."},
+        {"class": "users.events.FileSink", "path": "/var/log/beysmart/user-events.jsonl"},
+    ]
+
+The outbox also queues bulk work for the dispatcher: imports and admin
+actions record USER_TB_PROVISIONING_REQUESTED events and one of the email
+events (verification, approval, invitation), which ThingsBoardSink and
+EmailSink carry out. Each sink only receives the event types in its
+``event_types``; the lifecycle sinks never see these work events.
+
+Delivery is at least once. The sinks that accepted an event are recorded
+on it (``delivered_to``), and a rejected event is retried (with
+exponential backoff) for the remaining sinks only; a sink can still see an
+event twice if it fails after accepting part of a batch, so consumers
+should deduplicate on the event id. Events of one user reach each sink in
+order: while an event is in flight, being claimed by another dispatcher or
+waiting for a retry, later events of the same user are held back. Once an
+event has failed for good (USER_EVENT_MAX_ATTEMPTS), ordering for that user
+ends there: later events are delivered without it.
+"""
+import hashlib
+import hmac
+import json
+import queue
+import time
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, Min, OuterRef, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from backend import metrics
+
+from .models import UserEvent
+
+USER_REGISTERED = "user.registered"
+USER_APPROVED = "user.approved"
+USER_EMAIL_VERIFIED = "user.email_verified"
+USER_PASSWORD_RESET = "user.password_reset"
+USER_DEACTIVATED = "user.deactivated"
+LIFECYCLE_EVENTS = frozenset({
+    USER_REGISTERED, USER_APPROVED, USER_EMAIL_VERIFIED, USER_PASSWORD_RESET, USER_DEACTIVATED,
+})
+
+# Work queued for the dispatcher rather than done inside the request or command.
+USER_VERIFICATION_REQUESTED = "user.verification_requested"
+USER_TB_PROVISIONING_REQUESTED = "user.tb_provisioning_requested"
+USER_APPROVAL_EMAIL_REQUESTED = "user.approval_email_requested"  # payload: approved_by
+# user_id is the inviting customer; payload: invitation_id.
+USER_INVITATION_EMAIL_REQUESTED = "user.invitation_email_requested"
+
+events_dispatched = metrics.REGISTRY.counter(
+    "user_events_dispatched_total", "User events handled by the dispatcher, by sink and outcome.", ("sink", "outcome"))
+event_batch_duration = metrics.REGISTRY.histogram(
+    "user_event_batch_duration_seconds", "Time for a sink to accept one batch of user events.", ("sink",))
+event_delivery_lag = metrics.REGISTRY.histogram(
+    "user_event_delivery_lag_seconds", "Time from recording a user event to delivering it.", (),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900))
+
+
+def _user_fields(user):
+    return {
+        "email": user.email,
+        "user_type": user.user_type,
+        "parent_customer_id": user.parent_customer_id,
+        "is_approved": user.is_approved,
+    }
+
+
+def record_event(event_type, user, **payload):
+    """Add an event to the outbox. Call it inside the transaction that made the change."""
+    return UserEvent.objects.create(
+        event_type=event_type, user_id=user.pk, payload={**_user_fields(user), **payload},
+    )
+
+
+def record_events(event_type, users, **payload):
+    """Bulk version of record_event() for the same event about many users."""
+    return UserEvent.objects.bulk_create([
+        UserEvent(event_type=event_type, user_id=user.pk, payload={**_user_fields(user), **payload})
+        for user in users
+    ])
+
+
+def serialize(event):
+    return {
+        "id": event.id,
+        "type": event.event_type,
+        "user_id": event.user_id,
+        "created_at": event.created_at,
+        "data": event.payload,
+    }
+
+
+# Sinks. Each receives a list of serialized events and raises to reject the batch.
+
+class EventSink:
+    name = "sink"
+    event_types = LIFECYCLE_EVENTS
+
+    def send(self, events):
+        raise NotImplementedError
+
+
+class WebhookSink(EventSink):
+    """POSTs each batch as JSON, signed with HMAC-SHA256 of the body when a secret is set."""
+
+    name = "webhook"
+
+    def __init__(self, url, secret=None, timeout=10):
+        import httpx  # only the dispatcher needs it, not every web worker
+
+        self.url = url
+        self.secret = secret
+        self.client = httpx.Client(timeout=timeout)
+
+    def send(self, events):
+        body = json.dumps({"events": events}, cls=DjangoJSONEncoder).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.secret:
+            signature = hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-Signature-SHA256"] = signature
+        response = self.client.post(self.url, content=body, headers=headers)
+        response.raise_for_status()
+
+
+class FileSink(EventSink):
+    """Appends one JSON line per event, for log shippers and local debugging."""
+
+    name = "file"
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, events):
+        lines = "".join(json.dumps(event, cls=DjangoJSONEncoder) + "\n" for event in events)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+
+
+class QueueSink(EventSink):
+    """Puts events on an in-process queue, for consumers running in the dispatcher process."""
+
+    name = "queue"
+    queue = queue.Queue()
+
+    def __init__(self, maxsize=0):
+        if maxsize:
+            self.queue = queue.Queue(maxsize=maxsize)
+
+    def send(self, events):
+        for event in events:
+            self.queue.put(event, timeout=5)
+
+
+class ChannelLayerSink(EventSink):
+    """
+    Pushes events to the user's open WebSockets (users.consumers), and
+    registrations of customer users to their customer's sockets as well.
+    """
+
+    name = "channels"
+
+    def __init__(self, alias="default"):
+        from channels.layers import get_channel_layer
+
+        self.layer = get_channel_layer(alias)
+
+    def send(self, events):
+        async_to_sync(self._send)(events)
+
+    async def _send(self, events):
+        from .consumers import customer_group, user_group
+
+        for event in events:
+            message = {"type": "account.event", "event": json.loads(json.dumps(event, cls=DjangoJSONEncoder))}
+            await self.layer.group_send(user_group(event["user_id"]), message)
+            parent = event["data"].get("parent_customer_id")
+            if event["type"] == USER_REGISTERED and parent:
+                await self.layer.group_send(customer_group(parent), message)
+
+
+class EmailSink(EventSink):
+    """
+    Sends the emails queued by bulk operations, one SMTP session per batch.
+    Emails that no longer apply (user verified since, invitation used) are
+    dropped.
+    """
+
+    name = "email"
+    event_types = frozenset({
+        USER_VERIFICATION_REQUESTED, USER_APPROVAL_EMAIL_REQUESTED, USER_INVITATION_EMAIL_REQUESTED,
+    })
+
+    def send(self, events):
+        from .emails import approval_message, invitation_message, send_bulk, verification_message
+        from .models import CustomerInvitation, CustomUser
+
+        verify = {e["user_id"] for e in events if e["type"] == USER_VERIFICATION_REQUESTED}
+        approved_by = {e["user_id"]: e["data"]["approved_by"] for e in events
+                       if e["type"] == USER_APPROVAL_EMAIL_REQUESTED}
+        invitation_ids = {e["data"]["invitation_id"] for e in events if e["type"] == USER_INVITATION_EMAIL_REQUESTED}
+
+        messages = []
+        # The verification token is derived from the password hash and last login.
+        token_fields = ("email", "password", "last_login")
+        if verify:
+            users = CustomUser.objects.filter(pk__in=verify, email_verified=False).exclude(email="")
+            messages += [verification_message(user) for user in users.only(*token_fields)]
+        if approved_by:
+            approvers = CustomUser.objects.only("username", "first_name", "last_name").in_bulk(
+                set(approved_by.values()))
+            users = CustomUser.objects.filter(pk__in=approved_by, is_approved=True).only(*token_fields)
+            messages += [
+                approval_message(user, approvers.get(approved_by[user.pk]) or CustomUser(username="an administrator"))
+                for user in users
+            ]
+        if invitation_ids:
+            invitations = CustomerInvitation.objects.filter(pk__in=invitation_ids, is_used=False).select_related("customer")
+            messages += [invitation_message(invitation, invitation.customer) for invitation in invitations]
+        send_bulk(messages)
+
+
+class ThingsBoardSink(EventSink):
+    """
+    Creates the ThingsBoard accounts queued by bulk operations. Rejects the
+    batch only when nothing could be created (ThingsBoard down); single
+    failures are logged and left to reconcile_thingsboard, since retrying
+    the batch would try to create the others twice.
+    """
+
+    name = "thingsboard"
+    event_types = frozenset({USER_TB_PROVISIONING_REQUESTED})
+
+    def send(self, events):
+        from .provisioning import provision_users
+
+        created, failed = provision_users({event["user_id"] for event in events})
+        if failed and not created:
+            raise RuntimeError(f"no ThingsBoard account could be created ({failed} failed)")
+
+
+def get_sinks():
+    sinks = []
+    for config in settings.USER_EVENT_SINKS:
+        options = dict(config)
+        sinks.append(import_string(options.pop("class"))(**options))
+    return sinks
+
+
+# Dispatcher
+
+def _backoff(attempts):
+    return timedelta(seconds=min(settings.USER_EVENT_RETRY_BASE * 2 ** (attempts - 1), 3600))
+
+
+def _deliverable(batch_size, now):
+    """
+    Pending events due now, except those queued behind an earlier pending
+    event of the same user that is not part of the batch: in flight,
+    waiting to retry or locked by another dispatcher claiming it right now.
+    """
+    due = Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+    held_back = UserEvent.objects.filter(
+        status=UserEvent.PENDING, next_attempt_at__gt=now,
+        user_id=OuterRef("user_id"), id__lt=OuterRef("id"),
+    )
+    events = list(
+        UserEvent.objects.select_for_update(skip_locked=True)
+        .filter(due, status=UserEvent.PENDING)
+        .exclude(Exists(held_back))
+        .order_by("id")[:batch_size]
+    )
+    if not events:
+        return events
+    # skip_locked hides the rows another dispatcher is claiming, so the
+    # query above cannot see them; they still hold back later events.
+    first_outside = dict(
+        UserEvent.objects.filter(status=UserEvent.PENDING, user_id__in={event.user_id for event in events})
+        .exclude(id__in=[event.id for event in events])
+        .values("user_id").annotate(first=Min("id")).values_list("user_id", "first")
+    )
+    return [event for event in events if event.id < first_outside.get(event.user_id, event.id + 1)]
+
+
+def claim_batch(batch_size, now):
+    """
+    Lease a batch of deliverable events for USER_EVENT_LEASE seconds and
+    commit, so no row lock is held while the sinks are called. Leased events
+    are not due for other dispatchers; if this one dies, they become due
+    again when the lease runs out.
+    """
+    with transaction.atomic():
+        events = _deliverable(batch_size, now)
+        if events:
+            UserEvent.objects.filter(id__in=[event.id for event in events]).update(
+                next_attempt_at=now + timedelta(seconds=settings.USER_EVENT_LEASE),
+            )
+    return events
+
+
+def dispatch_batch(sinks, batch_size=None):
+    """
+    Deliver one batch of pending events to every sink that has not accepted
+    them yet. A sink that rejects its part of the batch only fails the
+    events it was given; they are retried later for that sink alone.
+
+    Returns ``(delivered, failed)`` event counts. The batch is claimed in
+    one short transaction, delivered outside of it and its outcome recorded
+    in another, so several dispatchers can share the load.
+    """
+    batch_size = batch_size or settings.USER_EVENT_BATCH_SIZE
+    now = timezone.now()
+    events = claim_batch(batch_size, now)
+    if not events:
+        return 0, 0
+    payload = {event.id: serialize(event) for event in events}
+
+    errors = {}  # event id -> error of the first sink that rejected it
+    for sink in sinks:
+        pending = [
+            event for event in events
+            if event.event_type in sink.event_types and sink.name not in event.delivered_to
+        ]
+        if not pending:
+            continue
+        start = time.perf_counter()
+        try:
+            sink.send([payload[event.id] for event in pending])
+        except Exception as e:
+            events_dispatched.inc(sink.name, "error", amount=len(pending))
+            for event in pending:
+                errors.setdefault(event.id, f"{sink.name}: {e}")
+            continue
+        finally:
+            event_batch_duration.observe(time.perf_counter() - start, sink.name)
+        events_dispatched.inc(sink.name, "delivered", amount=len(pending))
+        for event in pending:
+            event.delivered_to.append(sink.name)
+
+    finished_at = timezone.now()
+    for event in events:
+        error = errors.get(event.id)
+        if error is None:
+            event.status = UserEvent.DELIVERED
+            event.delivered_at = finished_at
+            event.next_attempt_at = None
+            event.last_error = ""
+            event_delivery_lag.observe((now - event.created_at).total_seconds())
+            continue
+        event.attempts += 1
+        event.last_error = error[:2000]
+        if event.attempts >= settings.USER_EVENT_MAX_ATTEMPTS:
+            event.status = UserEvent.FAILED
+            event.next_attempt_at = None
+        else:
+            event.next_attempt_at = finished_at + _backoff(event.attempts)
+    with transaction.atomic():
+        UserEvent.objects.bulk_update(events, [
+            "status", "delivered_to", "delivered_at", "attempts", "last_error", "next_attempt_at",
+        ])
+    return len(events) - len(errors), len(errors)
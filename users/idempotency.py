@@ -0,0 +1,121 @@
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+from .identifiers import normalize_identifier
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+def _replay(stored, fingerprint):
+    if stored["fingerprint"] != fingerprint:
+        return JsonResponse(
+            {"error": f"This {IDEMPOTENCY_HEADER} was already used with a different request body."},
+            status=422,
+        )
+    response = HttpResponse(stored["content"], status=stored["status"], content_type=stored["content_type"])
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _wait_for(cache_key, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        stored = cache.get(cache_key)
+        if stored is not None:
+            return stored
+    return None
+
+
+def _scope(request, body):
+    """
+    Whose keys a request shares: the user's, or for anonymous requests the
+    email or phone number in the body, so two clients that pick the same key
+    never see each other's responses. None when neither is known.
+    """
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    try:
+        data = json.loads(body) if request.content_type == "application/json" else request.POST
+    except ValueError:
+        return None
+    if not hasattr(data, "get"):
+        return None
+    identifier = normalize_identifier(data.get("email") or data.get("phone_number"))
+    return f"anonymous:{identifier}" if identifier else None
+
+
+def _storable(response):
+    # Errors a retry may get past (a missing precondition, a failed check) are not replayed.
+    return (200 <= response.status_code < 300 or response.status_code == 409) and not response.streaming
+
+
+def idempotent(view):
+    """
+    Make POSTs to ``view`` safe to retry with an ``Idempotency-Key`` header.
+
+    The first successful (2xx) or conflicting (409) response for a key, per
+    user (or, for anonymous requests, per email or phone number in the body)
+    and path, is stored in the shared cache for IDEMPOTENCY_TTL seconds and
+    replayed for retries with the same body. A duplicate that arrives while
+    the first is still running waits up to IDEMPOTENCY_WAIT seconds for its
+    result. Other responses are not stored, so a client that fixes what was
+    wrong and retries with the same key runs the request again. Requests
+    without the header, or anonymous ones without an identifier, are
+    unaffected.
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if request.method != "POST" or not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({"error": f"{IDEMPOTENCY_HEADER} is too long."}, status=400)
+
+        # Read the raw body before anything parses request.POST: once a
+        # multipart body has been parsed from the stream, request.body raises.
+        body = request.body
+        scope = _scope(request, body)
+        if scope is None:
+            return view(request, *args, **kwargs)
+        digest = hashlib.sha256(f"{scope}:{request.path}:{key}".encode()).hexdigest()
+        cache_key = f"idempotency:{digest}"
+        lock_key = f"{cache_key}:lock"
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        stored = cache.get(cache_key)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        if not cache.add(lock_key, True, timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            stored = _wait_for(cache_key, settings.IDEMPOTENCY_WAIT)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+            return JsonResponse(
+                {"error": f"A request with this {IDEMPOTENCY_HEADER} is still being processed."},
+                status=409,
+            )
+
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, "render") and not response.is_rendered:
+                response.render()
+            if _storable(response):
+                cache.set(cache_key, {
+                    "fingerprint": fingerprint,
+                    "status": response.status_code,
+                    "content": response.content,
+                    "content_type": response.get("Content-Type"),
+                }, timeout=settings.IDEMPOTENCY_TTL)
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    return wrapped
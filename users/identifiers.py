@@ -0,0 +1,55 @@
+"""
+Canonical forms of the emails and phone numbers users identify with.
+
+Every lookup, OTP key and verification flag goes through these helpers, so
+"01001234567", "+20 100 123 4567" and "+201001234567" all refer to the same
+user and cache entries, as do "Owner@Example.com" and "owner@example.com".
+"""
+from functools import lru_cache
+
+import phonenumbers
+
+DEFAULT_REGION = "EG"  # matches CustomUser.phone_number
+
+
+def normalize_email(email):
+    return email.strip().lower() if email else email
+
+
+@lru_cache(maxsize=4096)
+def parse_phone(raw, region=DEFAULT_REGION):
+    """E.164 form of ``raw``, or None if it is not a valid phone number. Memoized."""
+    try:
+        parsed = phonenumbers.parse(raw, region)
+    except phonenumbers.NumberParseException:
+        return None
+    if not phonenumbers.is_valid_number(parsed):
+        return None
+    return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
+
+
+def normalize_phone(raw):
+    """E.164 form of ``raw``; unparseable input is only stripped, so it matches nothing."""
+    if not raw:
+        return raw
+    raw = str(raw).strip()
+    return parse_phone(raw) or raw
+
+
+def is_email(identifier):
+    return "@" in identifier
+
+
+def normalize_identifier(identifier):
+    """Normalize an identifier that may be either an email or a phone number."""
+    if not identifier:
+        return identifier
+    return normalize_email(identifier) if is_email(identifier) else normalize_phone(identifier)
+
+
+def user_lookup(identifier):
+    """Queryset filter kwargs matching the user for ``identifier``."""
+    if is_email(identifier):
+        # Served by the LOWER("email") index.
+        return {"email__lower": normalize_email(identifier)}
+    return {"phone_number": normalize_phone(identifier)}
@@ -0,0 +1,39 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from backend.partitioning import MONTH, add_months, create_partitions, drop_partitions, is_partitioned, month_start
+from users.models import AuthAuditEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the audit log's upcoming monthly partitions and drop those older than "
+        "AUDIT_RETENTION_MONTHS. Run daily; without PostgreSQL partitioning, old rows are deleted instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int, default=3,
+                            help="Months to create partitions for, the current one included.")
+        parser.add_argument("--retain-months", type=int, default=settings.AUDIT_RETENTION_MONTHS,
+                            help="Months kept, the current one included.")
+
+    def handle(self, *args, **options):
+        table = AuthAuditEvent._meta.db_table
+        this_month = month_start(timezone.now())
+        cutoff = add_months(this_month, 1 - options["retain_months"])
+
+        if not is_partitioned(connection, table):
+            deleted, _ = AuthAuditEvent.objects.filter(
+                occurred_at__lt=datetime(cutoff.year, cutoff.month, 1, tzinfo=dt_timezone.utc)).delete()
+            self.stdout.write(f"{table} is not partitioned; deleted {deleted} events before {cutoff}")
+            return
+
+        created = create_partitions(connection, table, this_month, options["months_ahead"], MONTH)
+        dropped = drop_partitions(connection, table, cutoff, MONTH)
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(created)} partition(s) {', '.join(created)}; "
+            f"dropped {len(dropped)} before {cutoff:%Y-%m} {', '.join(dropped)}".rstrip()))
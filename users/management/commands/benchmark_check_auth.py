@@ -0,0 +1,92 @@
+import json
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client, RequestFactory
+
+from backend.benchmarking import format_summary, run_concurrently, summarize
+from users.models import CustomUser
+
+BENCH_EMAIL = "benchmark-check-auth@example.com"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark GET /api/auth/check-auth/ with a new Postgres connection per request versus "
+        "the psycopg connection pool. Requests go through the full WSGI handler, so connections "
+        "are closed or returned to the pool after each one as they are in production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument("--pool-size", type=int, default=settings.DATABASES[DEFAULT_DB_ALIAS]
+                            .get("OPTIONS", {}).get("pool", {}).get("max_size", 10))
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if connection.vendor != "postgresql":
+            raise CommandError("benchmark_check_auth needs the PostgreSQL database.")
+
+        db_settings = connections.settings[DEFAULT_DB_ALIAS]
+        original = {"OPTIONS": dict(db_settings.get("OPTIONS", {})), "CONN_MAX_AGE": db_settings["CONN_MAX_AGE"]}
+        pool_options = original["OPTIONS"].get("pool") or {}
+        modes = {
+            "connection per request": {"OPTIONS": {**original["OPTIONS"], "pool": None}, "CONN_MAX_AGE": 0},
+            "psycopg pool": {
+                "OPTIONS": {**original["OPTIONS"], "pool": {
+                    **pool_options, "min_size": options["pool_size"], "max_size": options["pool_size"],
+                }},
+                "CONN_MAX_AGE": 0,
+            },
+        }
+
+        user, _ = CustomUser.objects.get_or_create(
+            email=BENCH_EMAIL,
+            defaults={"username": BENCH_EMAIL, "phone_number": "+201000000999", "is_approved": True},
+        )
+        client = Client()
+        client.force_login(user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, "testserver"]
+        handler = WSGIHandler()
+        factory = RequestFactory()
+
+        def check_auth(i):
+            environ = factory.get("/api/auth/check-auth/", secure=True, HTTP_COOKIE=cookie).environ
+            status = []
+            response = handler(environ, lambda s, headers: status.append(s))
+            # Closing fires request_finished, which closes or returns the connection.
+            response.close()
+            if not status[0].startswith("200"):
+                raise RuntimeError(status[0])
+
+        results = {}
+        try:
+            for name, overrides in modes.items():
+                self.reconfigure(db_settings, overrides)
+                check_auth(0)  # warm up imports, URL resolver and the pool
+                latencies, elapsed, errors = run_concurrently(check_auth, options["requests"], options["concurrency"])
+                results[name] = summarize(latencies, elapsed, errors)
+                if overrides["OPTIONS"]["pool"]:
+                    results[name]["pool"] = connections[DEFAULT_DB_ALIAS].pool.get_stats()
+                self.stdout.write(format_summary(name, results[name]))
+        finally:
+            self.reconfigure(db_settings, original)
+            CustomUser.objects.filter(email=BENCH_EMAIL).delete()
+
+        before, after = results["connection per request"], results["psycopg pool"]
+        if before["p50_ms"]:
+            self.stdout.write(
+                f"p50 {before['p50_ms']} ms -> {after['p50_ms']} ms "
+                f"({(1 - after['p50_ms'] / before['p50_ms']) * 100:.0f}% faster)"
+            )
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def reconfigure(self, db_settings, overrides):
+        connections.close_all()
+        connections[DEFAULT_DB_ALIAS].close_pool()
+        db_settings.update(overrides)
@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from backend.benchmarking import format_summary, run_concurrently, summarize
+from services.fake_thingsboard import FakeThingsBoard
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the device telemetry proxy against a local fake ThingsBoard: "
+        "an uncached pass-through versus the cached, coalescing endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--devices", type=int, default=10)
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--latency", type=float, default=0.02,
+                            help="Simulated ThingsBoard latency per request, in seconds.")
+        parser.add_argument("--keys", default="temperature,humidity,power")
+
+    def handle(self, *args, **options):
+        keys = options["keys"].split(",")
+        fake = FakeThingsBoard(latency=options["latency"])
+        settings.TB_BASE_URL = fake.start()
+
+        # The shared client is created lazily, so it picks up the fake TB_BASE_URL set above.
+        from services.thingboard_services import get_client
+        from users.views import DeviceTelemetryView
+
+        customer = fake.add_customer("bench-customer@example.com")
+        customer_id = customer["id"]["id"]
+        for i in range(options["devices"]):
+            fake.add_device(customer_id, f"device-{i}", telemetry={k: i for k in keys})
+
+        user = CustomUser(email="bench-customer@example.com", user_type="CUSTOMER", is_approved=True)
+        factory = APIRequestFactory()
+        view = DeviceTelemetryView.as_view()
+        cache.clear()
+
+        client, loop = get_client()
+
+        def fetch(coro):
+            return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+        def uncached(i):
+            devices = fetch(client.list_customer_devices(customer_id))
+            fetch(client.get_latest_telemetry_many([d["id"]["id"] for d in devices], keys))
+
+        def cached(i):
+            request = factory.get("/api/auth/devices/telemetry/", {"keys": options["keys"]})
+            force_authenticate(request, user=user)
+            response = view(request)
+            if response.status_code != 200:
+                raise RuntimeError(response.data)
+
+        results = {}
+        try:
+            for name, func in (("uncached pass-through", uncached), ("cached proxy endpoint", cached)):
+                before = fake.requests
+                latencies, elapsed, errors = run_concurrently(func, options["requests"], options["concurrency"])
+                results[name] = summarize(latencies, elapsed, errors)
+                results[name]["upstream_requests"] = fake.requests - before
+                self.stdout.write(format_summary(name, results[name]) + f"  upstream {results[name]['upstream_requests']}")
+        finally:
+            fake.stop()
+
+        self.stdout.write(json.dumps(results, indent=2))
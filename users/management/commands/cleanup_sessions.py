@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from users.sessions import delete_expired, is_partitioned_model, maintain_partitions, session_model, table_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired sessions in small batches with a pause between them (instead of clearsessions' "
+        "single DELETE), dropping expired daily partitions of a partitioned session table. Runs one sweep, "
+        "or continuously with --interval, and reports rows/s and table bloat."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Sessions deleted per transaction.")
+        parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between batches.")
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Seconds between sweeps; 0 runs one sweep and exits.")
+        parser.add_argument("--days-ahead", type=int, default=2,
+                            help="Daily partitions to keep created ahead (partitioned table only).")
+
+    def handle(self, *args, **options):
+        try:
+            model = session_model()
+        except ValueError as e:
+            raise CommandError(str(e))
+        partitioned = is_partitioned_model(model)
+        self.stdout.write(
+            f"Cleaning {model._meta.db_table}" + (" (partitioned by day)" if partitioned else ""))
+        try:
+            while True:
+                try:
+                    self.sweep(model, partitioned, options)
+                except Exception as e:
+                    if not options["interval"]:
+                        raise
+                    # Database trouble: keep running and try again next sweep.
+                    self.stderr.write(f"Session cleanup failed: {e}")
+                if not options["interval"]:
+                    break
+                time.sleep(options["interval"])
+                close_old_connections()
+        except KeyboardInterrupt:
+            pass
+
+    def sweep(self, model, partitioned, options):
+        start = time.monotonic()
+        dropped = []
+        cutoff = timezone.now()
+        if partitioned:
+            created, dropped, cutoff = maintain_partitions(model, options["days_ahead"])
+            if created:
+                self.stdout.write(f"Created partitions {', '.join(created)}")
+        deleted = delete_expired(model, cutoff, options["batch_size"], options["pause"])
+        elapsed = time.monotonic() - start
+
+        line = f"Deleted {deleted} expired sessions in {elapsed:.1f}s ({deleted / max(elapsed, 1e-3):.0f} rows/s)"
+        if dropped:
+            line += f"; dropped partitions {', '.join(dropped)}"
+        stats = table_stats(model)
+        line += f"; {stats['live_rows']} live rows"
+        if "dead_rows" in stats:
+            total = stats["live_rows"] + stats["dead_rows"]
+            line += (
+                f", {stats['dead_rows']} dead ({stats['dead_rows'] / total if total else 0:.0%}), "
+                f"{stats['size_bytes'] / 1024 / 1024:.1f} MiB, last autovacuum {stats['last_autovacuum'] or 'never'}"
+            )
+        self.stdout.write(line)
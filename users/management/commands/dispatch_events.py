@@ -0,0 +1,82 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from backend import metrics
+from users.events import dispatch_batch, get_sinks
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = metrics.REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver pending user lifecycle events from the outbox to the sinks in USER_EVENT_SINKS, "
+        "in batches, until interrupted (or once with --once)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.USER_EVENT_BATCH_SIZE)
+        parser.add_argument("--interval", type=float, default=1.0,
+                            help="Seconds to wait when there is nothing to deliver.")
+        parser.add_argument("--once", action="store_true", help="Drain what is due now and exit.")
+        parser.add_argument("--metrics-port", type=int,
+                            help="Serve Prometheus metrics for this process on this port.")
+        parser.add_argument("--report-every", type=float, default=60,
+                            help="Seconds between throughput lines.")
+
+    def handle(self, *args, **options):
+        sinks = get_sinks()
+        if not sinks:
+            raise CommandError("USER_EVENT_SINKS is empty; configure at least one sink.")
+        self.stdout.write(f"Dispatching user events to: {', '.join(sink.name for sink in sinks)}")
+
+        if options["metrics_port"]:
+            server = ThreadingHTTPServer(("0.0.0.0", options["metrics_port"]), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, name="dispatch-metrics", daemon=True).start()
+
+        delivered_total = failed_total = 0
+        window_start = time.monotonic()
+        window_delivered = 0
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    delivered, failed = dispatch_batch(sinks, options["batch_size"])
+                except Exception as e:
+                    # Database trouble: keep the dispatcher alive and try again.
+                    self.stderr.write(f"Dispatch failed: {e}")
+                    delivered, failed = 0, 0
+                    time.sleep(options["interval"])
+                delivered_total += delivered
+                failed_total += failed
+                window_delivered += delivered
+                if failed:
+                    self.stderr.write(f"{failed} events failed and will be retried")
+
+                elapsed = time.monotonic() - window_start
+                if elapsed >= options["report_every"]:
+                    self.stdout.write(f"{window_delivered / elapsed:.1f} events/s delivered")
+                    window_start, window_delivered = time.monotonic(), 0
+
+                if not delivered and not failed:
+                    if options["once"]:
+                        break
+                    time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Delivered {delivered_total} events, {failed_total} failures"))
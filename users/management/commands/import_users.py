@@ -0,0 +1,217 @@
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from users import stats
+from users.events import USER_REGISTERED, USER_TB_PROVISIONING_REQUESTED, USER_VERIFICATION_REQUESTED, record_events
+from users.identifiers import normalize_email, parse_phone
+from users.models import CustomUser
+
+USER_TYPES = {"CUSTOMER", "CUSTOMER_USER"}
+
+
+def _init_worker():
+    # Spawned workers (Windows, macOS) start without Django configured.
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def _hash_password(raw):
+    return make_password(raw)
+
+
+def _rejected(row, error):
+    # Rejects files get shared for fixing up; never copy plaintext passwords into them.
+    return {**{k: v for k, v in row.items() if k != "password"}, "error": error}
+
+
+class Command(BaseCommand):
+    help = (
+        "Import users from a CSV file (email, phone_number, password, first_name, last_name, "
+        "user_type, parent_customer_id). Passwords are hashed across a process pool and rows "
+        "are inserted with bulk_create in batches; existing emails/phones are skipped. ThingsBoard "
+        "provisioning and verification emails are queued for dispatch_events."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_path")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="Processes used for password hashing.")
+        parser.add_argument("--region", default="EG", help="Default region for phone numbers without a country code.")
+        parser.add_argument("--rejects", default="import_rejects.csv",
+                            help="Where to write rows that failed validation or already exist.")
+        parser.add_argument("--dry-run", action="store_true", help="Validate only, insert nothing.")
+        parser.add_argument("--provision-tb", action="store_true",
+                            help="Queue ThingsBoard entities for the imported users.")
+        parser.add_argument("--send-verification", action="store_true",
+                            help="Queue verification emails to the imported users.")
+
+    def handle(self, *args, **options):
+        self.region = options["region"]
+        self.seen_emails = set()
+        self.seen_phones = set()
+        imported_ids = []
+        rejected = 0
+        total = 0
+
+        try:
+            source = open(options["csv_path"], newline="", encoding="utf-8-sig")
+        except OSError as e:
+            raise CommandError(f"Cannot open {options['csv_path']}: {e}")
+
+        with source, open(options["rejects"], "w", newline="", encoding="utf-8") as rejects_file, \
+                ProcessPoolExecutor(max_workers=options["workers"], initializer=_init_worker) as pool:
+            reader = csv.DictReader(source)
+            fieldnames = [name for name in reader.fieldnames or [] if name != "password"]
+            rejects = csv.DictWriter(rejects_file, fieldnames=[*fieldnames, "error"], extrasaction="ignore")
+            rejects.writeheader()
+
+            batch = []
+            for line_number, row in enumerate(reader, start=2):
+                total += 1
+                try:
+                    batch.append(self.clean_row(row))
+                except ValidationError as e:
+                    rejected += 1
+                    rejects.writerow(_rejected(row, f"line {line_number}: {'; '.join(e.messages)}"))
+                if len(batch) >= options["batch_size"]:
+                    ids, skipped = self.import_batch(batch, pool, rejects, options)
+                    imported_ids += ids
+                    rejected += skipped
+                    batch = []
+            if batch:
+                ids, skipped = self.import_batch(batch, pool, rejects, options)
+                imported_ids += ids
+                rejected += skipped
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {total} rows: {len(imported_ids)} imported, {rejected} rejected (see {options['rejects']})"
+        ))
+        queued = [name for name in ("provision_tb", "send_verification") if options[name]]
+        if imported_ids and queued and not options["dry_run"]:
+            self.stdout.write(f"Queued {' and '.join(queued)} for {len(imported_ids)} users; run dispatch_events")
+
+    def clean_row(self, row):
+        errors = []
+        email = normalize_email(row.get("email") or "")
+        try:
+            validate_email(email)
+        except ValidationError:
+            errors.append("invalid email")
+
+        phone = parse_phone((row.get("phone_number") or "").strip(), self.region)
+        if phone is None:
+            errors.append("invalid phone number")
+
+        user_type = (row.get("user_type") or "CUSTOMER").strip().upper()
+        parent = (row.get("parent_customer_id") or "").strip()
+        if user_type not in USER_TYPES:
+            errors.append(f"unknown user_type {user_type}")
+        elif user_type == "CUSTOMER_USER" and not parent:
+            errors.append("parent_customer_id is required for CUSTOMER_USER")
+
+        if email in self.seen_emails:
+            errors.append("duplicate email in file")
+        if phone and phone in self.seen_phones:
+            errors.append("duplicate phone number in file")
+        if errors:
+            raise ValidationError(errors)
+
+        self.seen_emails.add(email)
+        self.seen_phones.add(phone)
+        return {
+            "email": email,
+            "phone_number": phone,
+            "password": row.get("password") or None,
+            "first_name": (row.get("first_name") or "").strip() or None,
+            "last_name": (row.get("last_name") or "").strip() or None,
+            "user_type": user_type,
+            "parent_customer_id": parent or None,
+            "source": row,
+        }
+
+    def import_batch(self, batch, pool, rejects, options):
+        """Insert one batch; returns (inserted ids, number of rows skipped as existing)."""
+        emails = [r["email"] for r in batch]
+        phones = [r["phone_number"] for r in batch]
+        taken_emails = {
+            normalize_email(e) for e in
+            CustomUser.objects.filter(email__lower__in=emails).values_list("email", flat=True)
+        }
+        taken_phones = {str(p) for p in CustomUser.objects.filter(phone_number__in=phones).values_list("phone_number", flat=True)}
+
+        fresh = []
+        for r in batch:
+            if r["email"] in taken_emails or r["phone_number"] in taken_phones:
+                rejects.writerow(_rejected(r["source"], "account already exists"))
+            else:
+                fresh.append(r)
+        skipped = len(batch) - len(fresh)
+        if options["dry_run"] or not fresh:
+            return [], skipped
+
+        to_hash = [r["password"] for r in fresh if r["password"]]
+        chunksize = max(1, len(to_hash) // (options["workers"] * 4))
+        hashes = iter(pool.map(_hash_password, to_hash, chunksize=chunksize))
+
+        users = [
+            CustomUser(
+                username=r["email"],
+                email=r["email"],
+                phone_number=r["phone_number"],
+                password=next(hashes) if r["password"] else make_password(None),
+                first_name=r["first_name"],
+                last_name=r["last_name"],
+                user_type=r["user_type"],
+                parent_customer_id=r["parent_customer_id"],
+                is_active=True,
+                is_approved=r["user_type"] == "CUSTOMER",
+            )
+            for r in fresh
+        ]
+        with transaction.atomic():
+            inserted = self.insert(list(zip(fresh, users)), rejects, options["batch_size"])
+            record_events(USER_REGISTERED, inserted, invited=False, source="import")
+            if options["provision_tb"]:
+                record_events(USER_TB_PROVISIONING_REQUESTED, inserted, source="import")
+            if options["send_verification"]:
+                record_events(USER_VERIFICATION_REQUESTED, inserted, source="import")
+            stats.Changes().members_added(inserted).apply()
+        ids = [user.pk for user in inserted]
+        skipped += len(users) - len(inserted)
+        self.stdout.write(f"Inserted {len(ids)} users ({skipped} already existed)")
+        return ids, skipped
+
+    def insert(self, pairs, rejects, batch_size):
+        """
+        Insert ``(row, user)`` pairs and return the users actually inserted,
+        with their primary keys. Rows that raced in since the existence check
+        conflict: the batch is then inserted row by row, each in a savepoint,
+        and the conflicting rows go to the rejects file.
+        """
+        users = [user for _, user in pairs]
+        try:
+            with transaction.atomic():
+                return CustomUser.objects.bulk_create(users, batch_size=batch_size)
+        except IntegrityError:
+            pass
+        inserted = []
+        for row, user in pairs:
+            user.pk = None
+            try:
+                with transaction.atomic():
+                    CustomUser.objects.bulk_create([user])
+            except IntegrityError:
+                rejects.writerow(_rejected(row["source"], "account already exists"))
+                continue
+            inserted.append(user)
+        return inserted
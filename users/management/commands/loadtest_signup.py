@@ -0,0 +1,202 @@
+import asyncio
+import json
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+
+from backend.benchmarking import format_summary, summarize
+from services.fake_smtp import FakeSMTPServer
+from services.fake_thingsboard import FakeThingsBoard
+from users.identifiers import normalize_email
+
+STEPS = ("register", "verify_otp", "complete_registration", "verify_email", "login")
+VERIFY_LINK = re.compile(r"/verify-email/([^/\s]+)/([^/\s]+)/")
+
+
+class StepFailed(Exception):
+    pass
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the signup funnel (register -> verify-otp -> complete-registeration -> "
+        "verify-email -> login) against an in-process server backed by local stand-ins "
+        "for Postgres, SMTP and ThingsBoard. Run with --settings=backend.settings_loadtest."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100, help="Virtual users to sign up.")
+        parser.add_argument("--concurrency", type=int, default=10, help="Funnels running at once.")
+        parser.add_argument("--tb-latency", type=float, default=0.05,
+                            help="Simulated ThingsBoard latency per request, in seconds.")
+        parser.add_argument("--output", help="Write the results as JSON to this path.")
+        parser.add_argument("--save-baseline", metavar="PATH", help="Save the results as the new baseline.")
+        parser.add_argument("--baseline", metavar="PATH", help="Compare the results against a saved baseline.")
+        parser.add_argument("--tolerance", type=float, default=20.0,
+                            help="Allowed p95/throughput regression against the baseline, in percent.")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, "LOADTEST", False):
+            raise CommandError("Refusing to run outside the load-test settings; pass --settings=backend.settings_loadtest.")
+
+        call_command("migrate", interactive=False, verbosity=0)
+
+        fake_tb = FakeThingsBoard(latency=options["tb_latency"])
+        settings.TB_BASE_URL = fake_tb.start()
+        smtp = FakeSMTPServer()
+        settings.EMAIL_PORT = smtp.start()
+
+        server = ThreadedWSGIServer(("127.0.0.1", 0), _QuietHandler, allow_reuse_address=True)
+        server.request_queue_size = 128
+        server.set_app(get_wsgi_application())
+        threading.Thread(target=server.serve_forever, name="loadtest-server", daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        self.smtp = smtp
+        self.run_id = uuid.uuid4().hex[:6]
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.failures = []
+
+        self.stdout.write(
+            f"Signing up {options['users']} users, {options['concurrency']} at a time, against {base_url}"
+        )
+        try:
+            elapsed = asyncio.run(self.run(base_url, options["users"], options["concurrency"]))
+        finally:
+            server.shutdown()
+            server.server_close()
+            smtp.stop()
+            fake_tb.stop()
+
+        results = {
+            "users": options["users"],
+            "concurrency": options["concurrency"],
+            "elapsed_seconds": round(elapsed, 2),
+            "completed_funnels": len(self.latencies["login"]),
+            "steps": {
+                step: summarize(self.latencies[step], elapsed, self.errors[step]) for step in STEPS
+            },
+        }
+        for step in STEPS:
+            self.stdout.write(format_summary(step, results["steps"][step]))
+        self.stdout.write(
+            f"{results['completed_funnels']}/{options['users']} funnels completed in {results['elapsed_seconds']}s"
+        )
+        for failure in self.failures[:10]:
+            self.stdout.write(self.style.WARNING(failure))
+
+        for path in (options["output"], options["save_baseline"]):
+            if path:
+                with open(path, "w", encoding="utf-8") as fh:
+                    json.dump(results, fh, indent=2)
+                self.stdout.write(f"Results written to {path}")
+
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["tolerance"])
+
+    async def run(self, base_url, users, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+        async def funnel(i):
+            async with semaphore:
+                # One client per virtual user so each keeps its own session cookie.
+                async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+                    try:
+                        await self.signup(client, i)
+                    except StepFailed as e:
+                        self.failures.append(str(e))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(funnel(i) for i in range(users)))
+        return time.perf_counter() - start
+
+    async def signup(self, client, i):
+        email = f"lt-{self.run_id}-{i}@example.com"
+        phone = f"+2010{int(self.run_id, 16) % 100:02d}{i:06d}"
+        password = f"Lt-{self.run_id}-pass-{i}!"
+
+        await self.step("register", client.post("/api/auth/register/", json={
+            "email": email, "phone_number": phone,
+        }))
+
+        otp = cache.get(f"otp_{normalize_email(email)}")
+        if not otp:
+            raise StepFailed(f"{email}: no OTP in cache")
+        await self.step("verify_otp", client.post("/api/auth/verify-otp/", json={
+            "email": email, "otp": otp["otp"],
+        }))
+
+        await self.step("complete_registration", client.post("/api/auth/complete-registeration/", json={
+            "email": email, "phone_number": phone, "password": password,
+            "confirm_password": password, "user_type": "CUSTOMER",
+        }))
+
+        link = self.verification_link(email)
+        if not link:
+            raise StepFailed(f"{email}: no verification email received")
+        await self.step("verify_email", client.get(link))
+
+        await self.step("login", client.post("/api/auth/login/", json={
+            "email": email, "password": password,
+        }))
+
+    async def step(self, name, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            self.errors[name] += 1
+            raise StepFailed(f"{name}: {e!r}")
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            self.errors[name] += 1
+            raise StepFailed(f"{name}: HTTP {response.status_code} {response.text[:200]}")
+        self.latencies[name].append(elapsed)
+        return response
+
+    def verification_link(self, email):
+        with self.smtp.lock:
+            messages = list(self.smtp.messages)
+        for message in reversed(messages):
+            if any(email in rcpt for rcpt in message["to"]):
+                match = VERIFY_LINK.search(message["data"])
+                if match:
+                    return match.group(0)
+        return None
+
+    def compare(self, results, path, tolerance):
+        with open(path, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+
+        regressions = []
+        self.stdout.write(f"Compared with baseline {path}:")
+        for step in STEPS:
+            old, new = baseline["steps"].get(step), results["steps"][step]
+            if not old or not old["p95_ms"] or not old["rps"]:
+                continue
+            p95_change = (new["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            rps_change = (new["rps"] - old["rps"]) / old["rps"] * 100
+            self.stdout.write(f"  {step:<24} p95 {p95_change:+6.1f}%   req/s {rps_change:+6.1f}%")
+            if p95_change > tolerance or rps_change < -tolerance:
+                regressions.append(step)
+
+        if regressions:
+            raise CommandError(f"Regression beyond {tolerance}% in: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS(f"Within {tolerance}% of baseline"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from users.stats import recompute, recompute_all
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount every customer's membership stats from CustomUser and CustomerInvitation, "
+        "correcting drift in the incrementally maintained counters. Run nightly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Customers counted and written per transaction.")
+        parser.add_argument("--customer", type=int, action="append", default=[],
+                            help="Only recompute this customer id (repeatable).")
+
+    def handle(self, *args, **options):
+        if options["customer"]:
+            customers, corrected = len(options["customer"]), recompute(options["customer"])
+        else:
+            customers, corrected = recompute_all(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed {customers} customers; {corrected} had drifted or were missing"))
@@ -0,0 +1,215 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from services.fake_thingsboard import FakeThingsBoard
+from services.tb_provisioning import provision_tb_entities
+from services.thingboard_client import AsyncThingsBoardClient
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare CustomUser rows with ThingsBoard customers and customer users, "
+        "create whatever is missing in ThingsBoard and write a JSON diff report."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500,
+                            help="CustomUser rows loaded per chunk.")
+        parser.add_argument("--page-size", type=int, default=100,
+                            help="ThingsBoard page size when streaming customers and users.")
+        parser.add_argument("--parallelism", type=int, default=settings.TB_MAX_CONCURRENCY,
+                            help="Maximum concurrent ThingsBoard requests.")
+        parser.add_argument("--report", default="tb_reconcile_report.json",
+                            help="Where to write the diff report.")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only report differences, do not create anything.")
+        parser.add_argument("--base-url", default=None,
+                            help="ThingsBoard URL (defaults to TB_BASE_URL).")
+        parser.add_argument("--fake-tb", action="store_true",
+                            help="Run against an empty in-process fake ThingsBoard server.")
+
+    def handle(self, *args, **options):
+        fake = None
+        base_url = options["base_url"]
+        if options["fake_tb"]:
+            fake = FakeThingsBoard()
+            base_url = fake.start()
+            self.stdout.write(f"Using fake ThingsBoard at {base_url}")
+
+        loop = asyncio.new_event_loop()
+        client = AsyncThingsBoardClient(base_url=base_url, max_concurrency=options["parallelism"])
+        try:
+            report = self.reconcile(loop, client, options)
+        finally:
+            loop.run_until_complete(client.aclose())
+            loop.close()
+            if fake is not None:
+                fake.stop()
+
+        with open(options["report"], "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+
+        summary = report["summary"]
+        self.stdout.write(json.dumps(summary, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['report']}"))
+
+    def reconcile(self, loop, client, options):
+        started_at = timezone.now()
+        chunk_size, dry_run = options["chunk_size"], options["dry_run"]
+        # Django pks (as stored in parent_customer_id) of the customers found in
+        # ThingsBoard. This is all that is kept of the ThingsBoard side: it is
+        # read a page of customers at a time and matched against the database.
+        found = set()
+        missing_customers = []
+        missing_users = []
+        unresolved = []
+        only_tb_customers = []
+        only_tb_users = []
+        tb_customer_count = tb_user_count = 0
+
+        for page in self.customer_pages(loop, client, options["page_size"]):
+            tb_ids = {c["email"].lower(): c["id"]["id"] for c in page if c.get("email")}
+            known = {
+                email.lower(): str(pk)
+                for pk, email in CustomUser.objects.exclude(user_type="CUSTOMER_USER")
+                .filter(email__lower__in=list(tb_ids)).values_list("pk", "email")
+            }
+            only_tb_customers.extend(set(tb_ids) - set(known))
+            found.update(known.values())
+
+            tb_users = loop.run_until_complete(
+                self.fetch_user_emails(client, [c["id"]["id"] for c in page], options["page_size"])
+            )
+            page_emails = set().union(*tb_users.values())
+            known_users = {
+                email.lower() for email in CustomUser.objects.filter(user_type="CUSTOMER_USER")
+                .filter(email__lower__in=list(page_emails)).values_list("email", flat=True)
+            }
+            only_tb_users.extend(page_emails - known_users)
+            tb_customer_count += len(page)
+            tb_user_count += len(page_emails)
+
+            parents = {pk: tb_ids[email] for email, pk in known.items()}
+            missing_users.extend(self.sync_members(loop, client, parents, tb_users, chunk_size, dry_run))
+        self.stdout.write(f"ThingsBoard: {tb_customer_count} customers, {tb_user_count} customer users")
+
+        # Customers missing from ThingsBoard, then the members of those just created.
+        resolved = set(found)
+        customers = CustomUser.objects.exclude(user_type="CUSTOMER_USER")
+        for rows in self.chunks(customers, chunk_size):
+            entries = self.provision(loop, client, [r for r in rows if str(r["pk"]) not in found], dry_run)
+            missing_customers.extend(entries)
+            parents = {str(e["user_id"]): e.get("tb_id") for e in entries if e["status"] != "failed"}
+            resolved.update(parents)
+            if parents:
+                missing_users.extend(self.sync_members(loop, client, parents, {}, chunk_size, dry_run))
+
+        customer_users = CustomUser.objects.filter(user_type="CUSTOMER_USER")
+        for rows in self.chunks(customer_users, chunk_size):
+            unresolved.extend(
+                {"user_id": row["pk"], "email": row["email"], "parent_customer_id": row["parent_customer_id"] or ""}
+                for row in rows if (row["parent_customer_id"] or "") not in resolved
+            )
+
+        def count(entries, status):
+            return sum(1 for e in entries if e["status"] == status)
+
+        return {
+            "started_at": started_at.isoformat(),
+            "finished_at": timezone.now().isoformat(),
+            "dry_run": dry_run,
+            "summary": {
+                "missing_customers": len(missing_customers),
+                "missing_customer_users": len(missing_users),
+                "created": count(missing_customers + missing_users, "created"),
+                "failed": count(missing_customers + missing_users, "failed"),
+                "unresolved_parents": len(unresolved),
+                "only_in_thingsboard_customers": len(only_tb_customers),
+                "only_in_thingsboard_users": len(only_tb_users),
+            },
+            "missing_customers": missing_customers,
+            "missing_customer_users": missing_users,
+            "unresolved_parents": unresolved,
+            "only_in_thingsboard": {
+                "customers": sorted(only_tb_customers),
+                "users": sorted(only_tb_users),
+            },
+        }
+
+    def customer_pages(self, loop, client, page_size):
+        """Yield ThingsBoard customers one page at a time."""
+        page = 0
+        while True:
+            body = loop.run_until_complete(
+                client.request("GET", "/api/customers", params={"pageSize": page_size, "page": page})
+            )
+            yield body.get("data", [])
+            if not body.get("hasNext"):
+                return
+            page += 1
+
+    async def fetch_user_emails(self, client, customer_ids, page_size):
+        """Customer user emails of each TB customer in ``customer_ids``, keyed by customer id."""
+        async def emails(customer_id):
+            return {
+                user["email"].lower()
+                async for user in client.iter_customer_users(customer_id, page_size=page_size)
+                if user.get("email")
+            }
+
+        # Concurrency is bounded by the client's semaphore (--parallelism).
+        results = await asyncio.gather(*(emails(cid) for cid in customer_ids))
+        return dict(zip(customer_ids, results))
+
+    def sync_members(self, loop, client, parents, tb_users, chunk_size, dry_run):
+        """
+        Create the customer users of ``parents`` (Django pk -> TB customer id)
+        whose email is not among their TB customer's users in ``tb_users``.
+        """
+        entries = []
+        members = CustomUser.objects.filter(user_type="CUSTOMER_USER", parent_customer_id__in=list(parents))
+        for rows in self.chunks(members, chunk_size):
+            jobs = [
+                {**row, "customer_id": parents[row["parent_customer_id"]]}
+                for row in rows
+                if row["email"].lower() not in tb_users.get(parents[row["parent_customer_id"]], ())
+            ]
+            entries.extend(self.provision(loop, client, jobs, dry_run))
+        return entries
+
+    def chunks(self, queryset, chunk_size):
+        """Yield CustomUser value dicts in pk order, chunk_size rows at a time."""
+        queryset = queryset.values("pk", "email", "first_name", "last_name", "parent_customer_id")
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).order_by("pk")[:chunk_size])
+            if not rows:
+                return
+            yield rows
+            last_pk = rows[-1]["pk"]
+
+    def provision(self, loop, client, jobs, dry_run):
+        if not jobs:
+            return []
+        if dry_run:
+            return [self.entry(job, "skipped") for job in jobs]
+
+        entries = []
+        for job, entity, error in loop.run_until_complete(provision_tb_entities(client, jobs)):
+            if error:
+                entries.append(self.entry(job, "failed", error=error))
+            else:
+                entries.append(self.entry(job, "created", tb_id=entity["id"]["id"]))
+        self.stdout.write(f"Provisioned {len(entries)} ThingsBoard entities")
+        return entries
+
+    def entry(self, job, status, **extra):
+        entry = {"user_id": job["pk"], "email": job["email"], "status": status, **extra}
+        if job.get("customer_id"):
+            entry["customer_id"] = job["customer_id"]
+        return entry
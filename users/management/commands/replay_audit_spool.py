@@ -0,0 +1,35 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.audit import replay_spool, spool_files
+
+
+class Command(BaseCommand):
+    help = (
+        "Write audit events that workers spooled to AUDIT_SPOOL_DIR while the database refused them. "
+        "Run from cron, and after a worker was killed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-age", type=float, default=60,
+                            help="Skip files changed in the last N seconds (a live worker may be replaying them).")
+
+    def handle(self, *args, **options):
+        replayed = files = failed = 0
+        for path in spool_files():
+            try:
+                if time.time() - os.path.getmtime(path) < options["min_age"]:
+                    continue
+                replayed += replay_spool(path)
+            except FileNotFoundError:
+                continue  # claimed by a worker meanwhile
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"{path}: {e}")
+                continue
+            files += 1
+        self.stdout.write(self.style.SUCCESS(f"Replayed {replayed} audit events from {files} spool file(s)"))
+        if failed:
+            raise CommandError(f"{failed} spool file(s) could not be replayed; they are kept for the next run.")
@@ -0,0 +1,53 @@
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.startup import profile_boot
+
+PHASES = ("settings", "apps", "handler", "urls", "request")
+
+
+class Command(BaseCommand):
+    help = (
+        "Boot the project in fresh processes as a worker would and report the time per phase "
+        "(settings, app registry, middleware, URLconf, first request) and the slowest imports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/api/auth/check-auth/",
+                            help="Path of the first request.")
+        parser.add_argument("--no-request", action="store_true",
+                            help="Stop once the URLconf is loaded (no database access).")
+        parser.add_argument("--runs", type=int, default=3,
+                            help="Boots to measure; phases are reported as medians.")
+        parser.add_argument("--top", type=int, default=25, help="Slowest imports to list.")
+        parser.add_argument("--prefix", action="append", default=[],
+                            help="Only list imports of modules starting with this prefix (repeatable).")
+        parser.add_argument("--budget", type=float,
+                            help="Fail if the median boot (ms, including the interpreter) exceeds this.")
+
+    def handle(self, *args, **options):
+        path = None if options["no_request"] else options["path"]
+        # Import timing slows the boot down, so it gets a run of its own.
+        runs = [profile_boot(path) for _ in range(options["runs"])]
+        profiled = profile_boot(path, importtime=True)
+
+        self.stdout.write("Boot phases (median ms):")
+        for phase in PHASES:
+            values = [run["phases"][phase] for run in runs if phase in run["phases"]]
+            if values:
+                self.stdout.write(f"  {phase:<10} {statistics.median(values):>8.1f}")
+        total = statistics.median(run["total_ms"] for run in runs)
+        self.stdout.write(f"  {'total':<10} {total:>8.1f}  (process start to ready)")
+        if path:
+            self.stdout.write(f"  first request {path}: {runs[-1]['status']}")
+
+        imports = profiled["imports"]
+        if options["prefix"]:
+            imports = [i for i in imports if i[0].startswith(tuple(options["prefix"]))]
+        self.stdout.write("\nSlowest imports (cumulative ms, self ms):")
+        for name, self_us, cumulative_us, depth in sorted(imports, key=lambda i: -i[2])[:options["top"]]:
+            self.stdout.write(f"  {cumulative_us / 1000:>8.1f} {self_us / 1000:>8.1f}  {'  ' * depth}{name}")
+
+        if options["budget"] and total > options["budget"]:
+            raise CommandError(f"Boot took {total:.0f} ms, over the {options['budget']:.0f} ms budget.")
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.warmup import STEPS, Warmup, fill_shared_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the worker warmup steps in the foreground and report each one. With --fill-shared, also fetch "
+        "the ThingsBoard customer ids and device lists of recently active users into the shared cache; run "
+        "it once per deploy, before traffic shifts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--budget", type=float, default=settings.WARMUP_BUDGET,
+                            help="Seconds for all steps; later steps are skipped once it is spent.")
+        parser.add_argument("--fill-shared", action="store_true",
+                            help="Fetch missing ThingsBoard data into the shared cache.")
+
+    def handle(self, *args, **options):
+        steps = dict(STEPS)
+        if options["fill_shared"]:
+            # Before recent_users, so that step finds the fetched entries.
+            steps = {name: step for name, step in steps.items() if name != "recent_users"}
+            steps["fill_shared"] = fill_shared_cache
+            steps["recent_users"] = STEPS["recent_users"]
+        warmup = Warmup(steps, options["budget"])
+        for name, result in warmup.run().items():
+            result = dict(result)
+            ok, ms = result.pop("ok"), result.pop("ms", None)
+            detail = ", ".join(f"{key}={value}" for key, value in result.items())
+            timing = f"{ms:>8.1f} ms" if ms is not None else " " * 11
+            line = f"  {name:<14} {timing}  {detail}"
+            self.stdout.write(line if ok else self.style.WARNING(line))
+        self.stdout.write(self.style.SUCCESS(f"Warmup {warmup.state} in {warmup.elapsed_ms:.0f} ms"))
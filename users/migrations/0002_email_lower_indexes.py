@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:17
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerinvitation',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='users_invitation_email_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='users_customuser_email_lower'),
+        ),
+    ]
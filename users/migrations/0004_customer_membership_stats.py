@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:31
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0003_userevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerMembershipStats',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='membership_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('approved_members', models.IntegerField(default=0)),
+                ('pending_members', models.IntegerField(default=0)),
+                ('open_invitations', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('recomputed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['parent_customer_id'], name='users_customuser_parent'),
+        ),
+    ]
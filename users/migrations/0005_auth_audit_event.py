@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:37
+
+import django.utils.timezone
+from django.db import migrations, models
+
+from backend.partitioning import MONTH, partition_by_range
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_customer_membership_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthAuditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('action', models.CharField(choices=[('login', 'Login'), ('otp.generated', 'OTP generated'), ('otp.verified', 'OTP verified'), ('password_reset', 'Password reset'), ('approval', 'Approval')], max_length=20)),
+                ('success', models.BooleanField(default=True)),
+                ('user_id', models.BigIntegerField(blank=True, null=True)),
+                ('identifier', models.CharField(blank=True, max_length=254)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('request_id', models.CharField(blank=True, max_length=64)),
+                ('detail', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'ordering': ['-occurred_at', '-id'],
+                'indexes': [models.Index(fields=['occurred_at', 'id'], name='users_audit_occurred'), models.Index(fields=['action', 'occurred_at'], name='users_audit_action'), models.Index(fields=['user_id', 'occurred_at'], name='users_audit_user'), models.Index(fields=['identifier', 'occurred_at'], name='users_audit_identifier')],
+            },
+        ),
+        # PostgreSQL only: monthly partitions on occurred_at.
+        partition_by_range('users.AuthAuditEvent', 'occurred_at', MONTH),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:39
+
+from django.db import migrations, models
+
+from backend.partitioning import DAY, partition_by_range
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_auth_audit_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartitionedSession',
+            fields=[
+                ('session_key', models.CharField(max_length=40, primary_key=True, serialize=False, verbose_name='session key')),
+                ('session_data', models.TextField(verbose_name='session data')),
+                ('expire_date', models.DateTimeField(db_index=True, verbose_name='expire date')),
+            ],
+            options={
+                'verbose_name': 'session',
+                'verbose_name_plural': 'sessions',
+                'db_table': 'users_session',
+                'abstract': False,
+            },
+        ),
+        # PostgreSQL only: daily partitions on expire_date.
+        partition_by_range('users.PartitionedSession', 'expire_date', DAY),
+    ]
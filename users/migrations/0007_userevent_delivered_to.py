@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_partitioned_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userevent',
+            name='delivered_to',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -1,11 +1,16 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.sessions.base_session import AbstractBaseSession
 from django.db import models
+from django.db.models.functions import Lower
 from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 import uuid
 import random
 from django.utils import timezone
 
+# Allows email__lower lookups, which use the LOWER("email") indexes below.
+models.EmailField.register_lookup(Lower)
+
 # Create your models here.
 class CustomUser(AbstractUser):
     first_name = models.CharField(max_length=150, blank=True, null=True)
@@ -52,6 +57,13 @@ class CustomUser(AbstractUser):
         related_name='approved_users'
     )
     approved_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(Lower("email"), name="users_customuser_email_lower"),
+            # Membership counts per customer (users.stats.recompute).
+            models.Index(fields=["parent_customer_id"], name="users_customuser_parent"),
+        ]
     
     def __str__(self):
         return self.username
@@ -63,7 +75,133 @@ class CustomerInvitation(models.Model):
     is_used = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(Lower("email"), name="users_invitation_email_lower"),
+        ]
     
     def __str__(self):
         return f"Invitation for {self.email} from {self.customer.username}"
-        
\ No newline at end of file
+        
+
+class UserEvent(models.Model):
+    """
+    Outbox of user lifecycle events, written in the same transaction as the
+    change it describes and delivered to downstream sinks by
+    ``manage.py dispatch_events``.
+    """
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    FAILED = "failed"  # gave up after USER_EVENT_MAX_ATTEMPTS
+
+    event_type = models.CharField(max_length=50)
+    # Plain id rather than a foreign key, so events outlive deleted users.
+    user_id = models.BigIntegerField()
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=10, default=PENDING, choices=[
+        (PENDING, 'Pending'),
+        (DELIVERED, 'Delivered'),
+        (FAILED, 'Failed'),
+    ])
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    # Names of the sinks that accepted the event; retries skip them.
+    delivered_to = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            # The dispatcher only ever scans pending events, oldest first.
+            models.Index(fields=["id"], condition=models.Q(status="pending"), name="users_event_pending"),
+            models.Index(fields=["user_id", "id"], name="users_event_user"),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} user={self.user_id} ({self.status})"
+
+
+class CustomerMembershipStats(models.Model):
+    """
+    Member and invitation counts per customer, kept current by users.stats
+    in the transactions that change them and recomputed nightly by
+    ``manage.py recompute_membership_stats`` to correct drift (expired
+    invitations, deleted users).
+    """
+    customer = models.OneToOneField(
+        CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='membership_stats')
+    approved_members = models.IntegerField(default=0)
+    pending_members = models.IntegerField(default=0)
+    open_invitations = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    recomputed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Membership stats for customer {self.customer_id}"
+
+
+class AuthAuditEvent(models.Model):
+    """
+    Audit trail of authentication events, written in batches by users.audit.
+
+    On PostgreSQL the table is partitioned by month on ``occurred_at`` (see
+    backend.partitioning); ``manage.py audit_partitions`` creates upcoming
+    partitions and drops those past AUDIT_RETENTION_MONTHS.
+    """
+    LOGIN = "login"
+    OTP_GENERATED = "otp.generated"
+    OTP_VERIFIED = "otp.verified"
+    PASSWORD_RESET = "password_reset"
+    APPROVAL = "approval"
+
+    occurred_at = models.DateTimeField(default=timezone.now)
+    action = models.CharField(max_length=20, choices=[
+        (LOGIN, 'Login'),
+        (OTP_GENERATED, 'OTP generated'),
+        (OTP_VERIFIED, 'OTP verified'),
+        (PASSWORD_RESET, 'Password reset'),
+        (APPROVAL, 'Approval'),
+    ])
+    success = models.BooleanField(default=True)
+    # Plain id rather than a foreign key, like UserEvent: the trail outlives deleted users.
+    user_id = models.BigIntegerField(null=True, blank=True)
+    identifier = models.CharField(max_length=254, blank=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    request_id = models.CharField(max_length=64, blank=True)
+    detail = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ["-occurred_at", "-id"]
+        indexes = [
+            # Every admin filter is combined with the time range, which also prunes partitions.
+            models.Index(fields=["occurred_at", "id"], name="users_audit_occurred"),
+            models.Index(fields=["action", "occurred_at"], name="users_audit_action"),
+            models.Index(fields=["user_id", "occurred_at"], name="users_audit_user"),
+            models.Index(fields=["identifier", "occurred_at"], name="users_audit_identifier"),
+        ]
+
+    def __str__(self):
+        outcome = "ok" if self.success else "failed"
+        return f"{self.action} {outcome} {self.identifier or self.user_id}"
+
+
+class PartitionedSession(AbstractBaseSession):
+    """
+    Session storage for SESSION_ENGINE = "users.sessions". On PostgreSQL the
+    table is partitioned by day on ``expire_date``, so ``manage.py
+    cleanup_sessions`` drops days that have fully expired instead of
+    deleting their rows. The primary key then includes ``expire_date``;
+    users.sessions.SessionStore keeps session keys unique across partitions.
+    """
+
+    class Meta(AbstractBaseSession.Meta):
+        db_table = "users_session"
+
+    @classmethod
+    def get_session_store_class(cls):
+        from .sessions import SessionStore
+
+        return SessionStore
@@ -0,0 +1,68 @@
+"""
+ThingsBoard accounts for users that exist in Django.
+
+Registration provisions one user inline; bulk work (imports, admin
+actions) records USER_TB_PROVISIONING_REQUESTED events instead, which
+ThingsBoardSink hands to ``provision_users()`` from ``manage.py
+dispatch_events``. Users that still fail are left to ``manage.py
+reconcile_thingsboard``.
+
+The ThingsBoard services are imported on first use, off the web workers'
+boot path.
+"""
+import logging
+
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+
+def get_parent_tb_customer_id(parent_customer_id):
+    """ThingsBoard customer id of the customer with Django pk ``parent_customer_id``, or None."""
+    from services.thingboard_services import get_customer_id_by_email
+
+    parent_id = str(parent_customer_id or "")
+    if not parent_id.isdigit():
+        return None
+    owner_email = CustomUser.objects.filter(pk=parent_id).values_list("email", flat=True).first()
+    return get_customer_id_by_email(owner_email) if owner_email else None
+
+
+def provision_users(user_ids):
+    """
+    Create the ThingsBoard customers and customer users of ``user_ids``
+    concurrently on the shared client, customers first so members imported
+    with them find their parent. Returns ``(created, failed)`` counts.
+    """
+    from services.tb_provisioning import provision_tb_entities
+    from services.thingboard_services import run_sync
+
+    rows = CustomUser.objects.filter(pk__in=user_ids).values(
+        "pk", "email", "first_name", "last_name", "user_type", "parent_customer_id")
+    created = failed = 0
+    parent_tb_ids = {}
+    for user_type in ("CUSTOMER", "CUSTOMER_USER"):
+        jobs = []
+        for row in rows:
+            if row["user_type"] != user_type:
+                continue
+            if user_type == "CUSTOMER_USER":
+                parent = row["parent_customer_id"]
+                if parent not in parent_tb_ids:
+                    parent_tb_ids[parent] = get_parent_tb_customer_id(parent)
+                row["customer_id"] = parent_tb_ids[parent]
+                if not row["customer_id"]:
+                    logger.warning("Parent customer not found in ThingsBoard",
+                                   extra={"user_id": row["pk"], "parent_customer_id": parent})
+                    failed += 1
+                    continue
+            jobs.append(row)
+        if not jobs:
+            continue
+        for job, entity, error in run_sync(lambda client: provision_tb_entities(client, jobs)):
+            if error:
+                failed += 1
+                logger.warning("ThingsBoard provisioning failed", extra={"user_id": job["pk"], "error": error})
+            else:
+                created += 1
+    return created, failed
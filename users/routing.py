@@ -0,0 +1,7 @@
+from django.urls import re_path
+
+from .consumers import AccountStatusConsumer
+
+websocket_urlpatterns = [
+    re_path(r"^ws/account/$", AccountStatusConsumer.as_asgi()),
+]
@@ -31,12 +31,15 @@ class CompleteRegistrationSerializer(serializers.Serializer):
         required=False
     )
     parent_customer_id = serializers.CharField(required=False, allow_blank=True)
+    # Token from the invitation link; implies CUSTOMER_USER under the inviting customer.
+    invitation_token = serializers.CharField(required=False, allow_blank=True, max_length=100)
 
     def validate(self, attrs):
         if attrs["password"] != attrs["confirm_password"]:
             raise serializers.ValidationError({"confirm_password": "Passwords do not match."})
 
-        if attrs.get('user_type') == 'CUSTOMER_USER' and not attrs.get('parent_customer_id'):
+        if (attrs.get('user_type') == 'CUSTOMER_USER' and not attrs.get('parent_customer_id')
+                and not attrs.get('invitation_token')):
             raise serializers.ValidationError({
                 "parent_customer_id": "Parent customer ID is required when user_type is CUSTOMER_USER."
             })
@@ -0,0 +1,173 @@
+"""
+Expired session cleanup, and a session engine with a partitioned table.
+
+SESSION_SAVE_EVERY_REQUEST with a two-minute SESSION_COOKIE_AGE turns the
+session table over every few minutes, and the stock ``clearsessions``
+removes the dead rows with one DELETE that holds its locks and its
+snapshot until the last row is gone. ``delete_expired()`` instead walks
+expired rows in (expire_date, session_key) order and deletes them in small
+batches, each its own transaction, with a pause in between so autovacuum
+and the web workers keep up. ``manage.py cleanup_sessions`` runs it on a
+schedule or continuously and reports throughput and bloat.
+
+With SESSION_ENGINE = "users.sessions", sessions are stored in
+PartitionedSession, partitioned by day on expire_date on PostgreSQL. Days
+that have fully expired are dropped whole, and batched deletes are left
+with the rows that landed in the default partition.
+"""
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from backend import metrics
+from backend.partitioning import DAY, create_partitions, drop_partitions, is_partitioned, period_start
+
+logger = logging.getLogger(__name__)
+
+sessions_deleted = metrics.REGISTRY.counter(
+    "sessions_deleted_total", "Expired sessions removed, by batched delete or dropped partition.", ("method",))
+
+
+class SessionStore(DBStore):
+    @classmethod
+    def get_model_class(cls):
+        from .models import PartitionedSession
+
+        return PartitionedSession
+
+    def save(self, must_create=False):
+        if not must_create or self.session_key is None:
+            return super().save(must_create)
+        # On PostgreSQL the primary key is (session_key, expire_date), so it
+        # no longer rejects a key that lives in another day's partition.
+        # Creating a session locks the key and checks every partition first.
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        with transaction.atomic(using=using):
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_xact_lock(hashtextextended(%s, 0))", [self.session_key])
+            if self.model.objects.using(using).filter(session_key=self.session_key).exists():
+                raise CreateError
+            return super().save(must_create=True)
+
+    @classmethod
+    def clear_expired(cls):
+        # Used by clearsessions: batches instead of one DELETE.
+        delete_expired(cls.get_model_class(), timezone.now())
+
+
+def session_model():
+    """The model behind SESSION_ENGINE; ValueError for engines that don't use the database."""
+    store = import_module(settings.SESSION_ENGINE).SessionStore
+    if not hasattr(store, "get_model_class"):
+        raise ValueError(f"{settings.SESSION_ENGINE} does not store sessions in the database")
+    return store.get_model_class()
+
+
+def delete_expired(model, before, batch_size=1000, pause=0.0):
+    """Delete sessions that expired before ``before``, ``batch_size`` at a time. Returns the rows deleted."""
+    deleted = 0
+    last = None
+    while True:
+        expired = model.objects.filter(expire_date__lt=before)
+        if last is not None:
+            # Keyset: resume after the last row seen rather than rescanning
+            # index entries of rows already deleted but not yet vacuumed.
+            expired = expired.filter(Q(expire_date__gt=last[0]) | Q(expire_date=last[0], session_key__gt=last[1]))
+        batch = list(expired.order_by("expire_date", "session_key").values_list("expire_date", "session_key")[:batch_size])
+        if not batch:
+            return deleted
+        # expire_date is checked again: a session refreshed since the read is kept.
+        count, _ = model.objects.filter(session_key__in=[key for _, key in batch], expire_date__lt=before).delete()
+        deleted += count
+        sessions_deleted.inc("delete", amount=count)
+        if len(batch) < batch_size:
+            return deleted
+        last = batch[-1]
+        if pause:
+            time.sleep(pause)
+
+
+def delete_user_sessions(model, user_ids, batch_size=1000):
+    """
+    Delete the live sessions logged in as any of ``user_ids``. Returns the
+    rows deleted.
+
+    Sessions are not indexed by user, so this reads and decodes every live
+    session, ``batch_size`` at a time, however few users are given: the
+    cost grows with the number of logged-in users, not with ``user_ids``.
+    The short SESSION_COOKIE_AGE keeps that table small; the scan is logged
+    with its size and duration so a growing one shows up.
+    """
+    user_ids = {str(pk) for pk in user_ids}
+    store = model.get_session_store_class()()
+    live = model.objects.filter(expire_date__gte=timezone.now())
+    start = time.monotonic()
+    scanned = deleted = 0
+    last_key = ""
+    while True:
+        batch = list(live.filter(session_key__gt=last_key).order_by("session_key")
+                     .values_list("session_key", "session_data")[:batch_size])
+        scanned += len(batch)
+        doomed = [key for key, data in batch if store.decode(data).get(SESSION_KEY) in user_ids]
+        if doomed:
+            count, _ = model.objects.filter(session_key__in=doomed).delete()
+            deleted += count
+        if len(batch) < batch_size:
+            break
+        last_key = batch[-1][0]
+    logger.info("Scanned live sessions to end those of deactivated users", extra={
+        "users": len(user_ids), "scanned": scanned, "deleted": deleted,
+        "duration_ms": round((time.monotonic() - start) * 1000, 1),
+    })
+    return deleted
+
+
+def maintain_partitions(model, days_ahead=2):
+    """
+    Create the daily partitions of the next ``days_ahead`` days and drop
+    those that ended before today. Returns ``(created, dropped, cutoff)``,
+    where every session expiring before ``cutoff`` is gone with its
+    partition unless it sits in the default partition.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    table = model._meta.db_table
+    today = period_start(timezone.now(), DAY)
+    created = create_partitions(connection, table, today, days_ahead, DAY)
+    dropped = drop_partitions(connection, table, today, DAY)
+    sessions_deleted.inc("drop_partition", amount=len(dropped))
+    return created, dropped, datetime(today.year, today.month, today.day, tzinfo=dt_timezone.utc)
+
+
+def table_stats(model):
+    """
+    ``{"live_rows", "dead_rows", "size_bytes", "last_autovacuum"}`` of the
+    session table and its partitions, from PostgreSQL's statistics; only
+    ``live_rows`` (an exact count) on other databases.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.vendor != "postgresql":
+        return {"live_rows": model.objects.count()}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(SUM(n_live_tup), 0), COALESCE(SUM(n_dead_tup), 0), "
+            "COALESCE(SUM(pg_total_relation_size(relid)), 0), MAX(last_autovacuum) "
+            "FROM pg_stat_user_tables WHERE relid IN (SELECT relid FROM pg_partition_tree(%s::regclass))",
+            [model._meta.db_table],
+        )
+        live, dead, size, last_autovacuum = cursor.fetchone()
+    return {"live_rows": live, "dead_rows": dead, "size_bytes": size, "last_autovacuum": last_autovacuum}
+
+
+def is_partitioned_model(model):
+    return is_partitioned(connections[DEFAULT_DB_ALIAS], model._meta.db_table)
@@ -0,0 +1,168 @@
+"""
+Per-customer membership counts (CustomerMembershipStats).
+
+Views apply ``Changes`` inside the transaction that registers, approves
+or invites, so the counters move with the change they count:
+
+    stats.Changes().members_approved([user]).apply()
+
+A customer's row is created on first use by counting from scratch, and
+``recompute()`` (run nightly) corrects drift from changes that have no
+hook: invitations expiring, users deleted from the admin.
+
+Counts:
+    approved_members   CUSTOMER_USERs under the customer that are approved
+    pending_members    CUSTOMER_USERs under the customer awaiting approval
+    open_invitations   invitations neither used nor expired
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import CustomerInvitation, CustomerMembershipStats, CustomUser
+
+COUNTERS = ("approved_members", "pending_members", "open_invitations")
+
+
+def _customer_pk(value):
+    # parent_customer_id is a CharField holding the customer's primary key.
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def adjust(customer_id, **deltas):
+    """
+    Add ``deltas`` (e.g. ``pending_members=-1, approved_members=1``) to a
+    customer's counters with a single UPDATE. Call it inside the
+    transaction making the change, once per customer: on first use the
+    row is counted from scratch, which already includes the change.
+    """
+    customer_id = _customer_pk(customer_id)
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if customer_id is None or not deltas:
+        return
+    updated = CustomerMembershipStats.objects.filter(customer_id=customer_id).update(
+        updated_at=timezone.now(), **{name: F(name) + delta for name, delta in deltas.items()},
+    )
+    if not updated:
+        recompute([customer_id])
+
+
+class Changes:
+    """Counter deltas for several customers, applied with one ``adjust()`` each."""
+
+    def __init__(self):
+        self.deltas = {}
+
+    def add(self, customer_id, **deltas):
+        customer_id = _customer_pk(customer_id)
+        if customer_id is not None:
+            counters = self.deltas.setdefault(customer_id, Counter())
+            counters.update(deltas)
+        return self
+
+    def members_added(self, users):
+        for user in users:
+            if user.user_type == "CUSTOMER_USER":
+                self.add(user.parent_customer_id, **{
+                    "approved_members" if user.is_approved else "pending_members": 1})
+        return self
+
+    def members_approved(self, users):
+        """``users`` were pending and are now approved."""
+        for user in users:
+            if user.user_type == "CUSTOMER_USER":
+                self.add(user.parent_customer_id, pending_members=-1, approved_members=1)
+        return self
+
+    def invitations(self, customer_ids, delta):
+        """Open (``delta=1``) or close (``delta=-1``) one invitation per entry of ``customer_ids``."""
+        for customer_id in customer_ids:
+            self.add(customer_id, open_invitations=delta)
+        return self
+
+    def apply(self):
+        for customer_id, deltas in self.deltas.items():
+            adjust(customer_id, **deltas)
+
+
+def _counts(customer_ids, now):
+    members = (
+        CustomUser.objects
+        .filter(user_type="CUSTOMER_USER", parent_customer_id__in=[str(pk) for pk in customer_ids])
+        .values("parent_customer_id")
+        .annotate(
+            approved=Count("pk", filter=Q(is_approved=True)),
+            pending=Count("pk", filter=Q(is_approved=False)),
+        )
+    )
+    invitations = (
+        CustomerInvitation.objects
+        .filter(customer_id__in=customer_ids, is_used=False, expires_at__gt=now)
+        .values("customer_id")
+        .annotate(open=Count("pk"))
+    )
+    counts = {pk: dict.fromkeys(COUNTERS, 0) for pk in customer_ids}
+    for row in members:
+        pk = _customer_pk(row["parent_customer_id"])
+        if pk in counts:
+            counts[pk]["approved_members"] = row["approved"]
+            counts[pk]["pending_members"] = row["pending"]
+    for row in invitations:
+        counts[row["customer_id"]]["open_invitations"] = row["open"]
+    return counts
+
+
+def recompute(customer_ids):
+    """
+    Count and store the stats of ``customer_ids`` (existing CUSTOMERs only).
+    Returns the number of rows whose counters were wrong or missing.
+    """
+    customer_ids = list(
+        CustomUser.objects.filter(pk__in=customer_ids, user_type="CUSTOMER").values_list("pk", flat=True)
+    )
+    if not customer_ids:
+        return 0
+    try:
+        with transaction.atomic():
+            # Lock the rows before counting: an adjust() racing with us then
+            # lands after our write instead of being overwritten by it.
+            current = {
+                row.pop("customer_id"): row
+                for row in CustomerMembershipStats.objects.select_for_update()
+                .filter(customer_id__in=customer_ids).values("customer_id", *COUNTERS)
+            }
+            now = timezone.now()
+            counts = _counts(customer_ids, now)
+            CustomerMembershipStats.objects.bulk_create(
+                [
+                    CustomerMembershipStats(customer_id=pk, updated_at=now, recomputed_at=now, **values)
+                    for pk, values in counts.items()
+                ],
+                update_conflicts=True, unique_fields=["customer"],
+                update_fields=[*COUNTERS, "updated_at", "recomputed_at"],
+            )
+    except IntegrityError:
+        # A customer was deleted meanwhile; the next run settles the rest.
+        return 0
+    return sum(1 for pk, values in counts.items() if current.get(pk) != values)
+
+
+def recompute_all(batch_size=1000):
+    """Recompute every customer, in primary key batches. Returns ``(customers, corrected)``."""
+    customers = corrected = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            CustomUser.objects.filter(user_type="CUSTOMER", pk__gt=last_pk)
+            .order_by("pk").values_list("pk", flat=True)[:batch_size]
+        )
+        if not batch:
+            return customers, corrected
+        corrected += recompute(batch)
+        customers += len(batch)
+        last_pk = batch[-1]
@@ -1,3 +1,1651 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import smtplib
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import addModuleCleanup, mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import cache
+from django.contrib.auth.tokens import default_token_generator
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from django.http import HttpResponse
+from django.utils import timezone
+from django.db import OperationalError, connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from backend import metrics
+from backend.cache import TwoTierCache
+from backend.health import HealthMonitor
+from backend.log import JsonFormatter, QueueingHandler, SamplingFilter, log_records_dropped, request_id
+from backend.db_router import PIN_COOKIE, PrimaryReplicaRouter, ReplicaPinningMiddleware
+from backend.middleware import MetricsMiddleware, RequestLogMiddleware
+from backend.startup import profile_boot
+from backend.testing import TIME_BUDGETS, EndpointBudgetMixin
+from backend.views import _db_pool_samples
+from services.fake_thingsboard import FakeThingsBoard
+from services.resilience import (
+    CLOSED, HALF_OPEN, OPEN, Bulkhead, BulkheadFullError, CircuitBreaker, CircuitOpenError, Dependency, get_dependency,
+    is_smtp_failure,
+)
+from services.singleflight import SingleFlight
+from services.thingboard_client import AsyncThingsBoardClient
+from services.thingboard_services import run_sync
+from . import audit, warmup as warmup_module
+from .consumers import AccountStatusConsumer, make_ticket
+from .events import (
+    USER_APPROVED, USER_DEACTIVATED, USER_REGISTERED, USER_TB_PROVISIONING_REQUESTED, USER_VERIFICATION_REQUESTED,
+    ChannelLayerSink, EmailSink, EventSink, ThingsBoardSink, claim_batch, dispatch_batch, record_event,
+)
+from .management.commands.import_users import Command as ImportCommand
+from .models import AuthAuditEvent, CustomerInvitation, CustomerMembershipStats, CustomUser, PartitionedSession, UserEvent
+from .sessions import delete_expired
+from .stats import recompute_all
+from .warmup import STEPS, Warmup
+
+# Maximum queries and latency (ms) per endpoint. Raising a number here should
+# be a deliberate, reviewed change. Latency is only enforced with
+# TEST_TIME_BUDGETS=1 (see backend.testing); query counts always are.
+ENDPOINT_BUDGETS = {
+    "register": {"queries": 6, "ms": 250},
+    "verify_otp": {"queries": 4, "ms": 250},
+    # Includes the outbox INSERT and the SAVEPOINT pair its atomic block
+    # issues inside the test transaction.
+    "complete_registration": {"queries": 10, "ms": 500},
+    "login": {"queries": 9, "ms": 250},
+    "phone_login": {"queries": 5, "ms": 250},
+    "check_auth": {"queries": 5, "ms": 150},
+    "profile": {"queries": 5, "ms": 150},
+    "check_account_exists": {"queries": 6, "ms": 150},
+    "resolve_invitation": {"queries": 5, "ms": 150},
+    "membership_stats": {"queries": 6, "ms": 150},
+}
+
+# Milliseconds from process start until a fresh worker has loaded settings,
+# apps, middleware and the URLconf (best of two boots); TEST_TIME_BUDGETS=1 only.
+BOOT_BUDGET_MS = 1500
+# Imported on first use only; they must not creep back onto the boot path.
+LAZY_MODULES = ("httpx", "rest_framework.authtoken", "services.thingboard_services", "services.email_services")
+
+FAST_TEST_SETTINGS = {
+    # Budgets measure our code, not PBKDF2 iterations.
+    "PASSWORD_HASHERS": ["django.contrib.auth.hashers.MD5PasswordHasher"],
+    "EMAIL_BACKEND": "django.core.mail.backends.locmem.EmailBackend",
+    # No audit flush thread: its own connection would write outside the test transaction.
+    "AUDIT_FLUSH_INTERVAL": 0,
+}
+
+
+def setUpModule():
+    # Audit batches that fail to insert are spooled to a scratch directory, not the checkout.
+    spool_dir = tempfile.TemporaryDirectory()
+    addModuleCleanup(spool_dir.cleanup)
+    spool_override = override_settings(AUDIT_SPOOL_DIR=spool_dir.name)
+    spool_override.enable()
+    addModuleCleanup(spool_override.disable)
+    # Cleanups run last-in first-out: drop what is still buffered before the
+    # override goes, so the flush at exit has nothing left to spool.
+    addModuleCleanup(audit.get_buffer().clear)
+
+
+class AsyncThingsBoardClientTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()  # the client's circuit breaker state
+
+    def make_client(self, handler, **kwargs):
+        import httpx
+
+        return AsyncThingsBoardClient(
+            base_url="http://tb.test", username="admin", password="pw", transport=httpx.MockTransport(handler), **kwargs)
+
+    def json_response(self, body, status=200):
+        import httpx
+
+        return httpx.Response(status, json=body)
+
+    def test_concurrency_is_bounded_by_the_semaphore(self):
+        in_flight = peak = 0
+
+        async def handler(request):
+            nonlocal in_flight, peak
+            if request.url.path == "/api/auth/login":
+                return self.json_response({"token": "t"})
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return self.json_response({"temperature": [{"ts": 1, "value": "20"}]})
+
+        async def scenario():
+            async with self.make_client(handler, max_concurrency=3) as client:
+                return await client.get_latest_telemetry_many([f"d{i}" for i in range(12)])
+
+        results = asyncio.run(scenario())
+        self.assertEqual(len(results), 12)
+        self.assertEqual(peak, 3)
+
+    def test_concurrent_401s_share_one_token_refresh(self):
+        logins = []
+
+        async def handler(request):
+            if request.url.path == "/api/auth/login":
+                logins.append(1)
+                await asyncio.sleep(0.01)
+                return self.json_response({"token": f"token-{len(logins)}"})
+            if request.headers["X-Authorization"] != "Bearer token-2":
+                return self.json_response({"message": "Token has expired"}, status=401)
+            return self.json_response({"ok": True})
+
+        async def scenario():
+            async with self.make_client(handler) as client:
+                await client.login()  # token-1, which ThingsBoard no longer accepts
+                return await asyncio.gather(*(client.request("GET", "/api/x") for _ in range(5)))
+
+        self.assertEqual(asyncio.run(scenario()), [{"ok": True}] * 5)
+        self.assertEqual(len(logins), 2)
+
+    def test_paginate_stops_after_the_last_page(self):
+        pages = []
+
+        def handler(request):
+            if request.url.path == "/api/auth/login":
+                return self.json_response({"token": "t"})
+            page = int(request.url.params["page"])
+            pages.append(page)
+            return self.json_response({"data": [{"n": page * 2}, {"n": page * 2 + 1}][:2 if page < 2 else 1],
+                                       "hasNext": page < 2})
+
+        async def scenario():
+            async with self.make_client(handler) as client:
+                return [item["n"] async for item in client.paginate("/api/customers", page_size=2)]
+
+        self.assertEqual(asyncio.run(scenario()), [0, 1, 2, 3, 4])
+        self.assertEqual(pages, [0, 1, 2])
+
+    def test_run_sync_runs_on_the_shared_loop_and_raises_its_errors(self):
+        async def where(client):
+            return threading.current_thread().name, isinstance(client, AsyncThingsBoardClient)
+
+        async def boom(client):
+            raise ValueError("bad request")
+
+        self.assertEqual(run_sync(where), ("thingsboard-client", True))
+        with self.assertRaisesMessage(ValueError, "bad request"):
+            run_sync(boom)
+        self.assertEqual(get_dependency("thingsboard").bulkhead.snapshot()["in_use"], 0)
+
+
+class ReconcileThingsBoardTests(TestCase):
+    def setUp(self):
+        self.fake = FakeThingsBoard()
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+        def user(email, phone, **extra):
+            return CustomUser.objects.create_user(username=email, email=email, phone_number=phone, **extra)
+
+        present = user("Present@example.com", "+201001234561")
+        missing = user("missing@example.com", "+201001234562")
+        user("member@example.com", "+201001234563", user_type="CUSTOMER_USER", parent_customer_id=str(present.pk))
+        user("new-member@example.com", "+201001234564", user_type="CUSTOMER_USER", parent_customer_id=str(present.pk))
+        user("missing-member@example.com", "+201001234565", user_type="CUSTOMER_USER",
+             parent_customer_id=str(missing.pk))
+        user("orphan@example.com", "+201001234566", user_type="CUSTOMER_USER", parent_customer_id="999")
+
+        tb_customer = self.fake.add_customer("present@example.com")["id"]["id"]
+        self.fake.add_user("member@example.com", tb_customer)
+        tb_only = self.fake.add_customer("tb-only@example.com")["id"]["id"]
+        self.fake.add_user("tb-only-user@example.com", tb_only)
+
+    def reconcile(self, *args):
+        path = os.path.join(self.tmp.name, "report.json")
+        call_command("reconcile_thingsboard", "--base-url", self.fake.base_url, "--report", path,
+                     "--page-size", "1", "--chunk-size", "1", *args, stdout=io.StringIO())
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def statuses(self, entries):
+        return {e["email"]: e["status"] for e in entries}
+
+    def test_creates_what_is_missing_and_leaves_the_rest(self):
+        report = self.reconcile()
+
+        self.assertEqual(self.statuses(report["missing_customers"]), {"missing@example.com": "created"})
+        self.assertEqual(self.statuses(report["missing_customer_users"]),
+                         {"new-member@example.com": "created", "missing-member@example.com": "created"})
+        self.assertEqual([e["email"] for e in report["unresolved_parents"]], ["orphan@example.com"])
+        self.assertEqual(report["only_in_thingsboard"],
+                         {"customers": ["tb-only@example.com"], "users": ["tb-only-user@example.com"]})
+
+        tb_customers = {c["email"]: c["id"]["id"] for c in self.fake.customers.values()}
+        tb_users = {u["email"]: u["customerId"]["id"] for u in self.fake.users.values()}
+        self.assertEqual(len(tb_customers), 3)
+        self.assertEqual(tb_users["new-member@example.com"], tb_customers["present@example.com"])
+        self.assertEqual(tb_users["missing-member@example.com"], tb_customers["missing@example.com"])
+        self.assertEqual(len(tb_users), 4)
+
+        # Everything is now present: a second run has nothing to create.
+        again = self.reconcile()
+        self.assertEqual(again["summary"]["missing_customers"], 0)
+        self.assertEqual(again["summary"]["missing_customer_users"], 0)
+        self.assertEqual(again["summary"]["unresolved_parents"], 1)
+
+    def test_dry_run_reports_without_creating(self):
+        report = self.reconcile("--dry-run")
+
+        self.assertEqual(self.statuses(report["missing_customers"]), {"missing@example.com": "skipped"})
+        self.assertEqual(self.statuses(report["missing_customer_users"]),
+                         {"new-member@example.com": "skipped", "missing-member@example.com": "skipped"})
+        self.assertEqual(report["summary"]["created"], 0)
+        self.assertEqual((len(self.fake.customers), len(self.fake.users)), (2, 2))
+
+
+class ResilienceTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        clock = mock.patch("services.resilience.time.time", side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.dependency = Dependency(
+            "test", CircuitBreaker("test", failure_threshold=2, recovery_timeout=30),
+            Bulkhead("test", max_concurrent=1), is_failure=is_smtp_failure,
+        )
+
+    def call_failing(self, exc=None):
+        with self.assertRaises(type(exc or OSError())):
+            with self.dependency.guard():
+                raise exc or OSError("connection refused")
+
+    def call_ok(self):
+        with self.dependency.guard():
+            pass
+
+    def state(self):
+        return self.dependency.breaker.snapshot()["state"]
+
+    def test_opens_after_threshold_then_half_opens_for_one_probe(self):
+        self.call_failing()
+        self.assertEqual(self.state(), CLOSED)
+        self.call_failing()
+        self.assertEqual(self.state(), OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.call_ok()
+
+        self.now += 30
+        self.assertEqual(self.state(), HALF_OPEN)
+        breaker = self.dependency.breaker
+        probe = breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()  # only one probe at a time
+        breaker.record_success(probe)
+        self.assertEqual(self.state(), CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self.call_failing()
+        self.call_failing()
+        self.now += 30
+        self.call_failing()
+        self.assertEqual(self.state(), OPEN)
+        self.now += 29
+        self.assertEqual(self.state(), OPEN)
+
+    def test_calls_from_before_the_circuit_opened_are_ignored(self):
+        breaker = self.dependency.breaker
+        slow = breaker.before_call()
+        self.call_failing()
+        self.call_failing()
+        breaker.record_success(slow)  # finished after the circuit opened: no probe, no close
+        self.assertEqual(self.state(), OPEN)
+        opened_at = breaker.snapshot()["opened_at"]
+        self.now += 10
+        breaker.record_failure(slow)
+        self.assertEqual(breaker.snapshot()["opened_at"], opened_at)
+
+    def test_rejected_recipients_do_not_count(self):
+        for _ in range(3):
+            self.call_failing(smtplib.SMTPRecipientsRefused({"bad@example": (550, b"no such user")}))
+            self.call_failing(smtplib.SMTPDataError(554, b"message rejected"))
+        self.assertEqual(self.state(), CLOSED)
+        self.call_failing(smtplib.SMTPServerDisconnected("gone"))
+        self.call_failing(smtplib.SMTPResponseException(421, b"try later"))
+        self.assertEqual(self.state(), OPEN)
+
+    def test_bulkhead_rejects_calls_over_its_limit(self):
+        with self.dependency.guard():
+            with self.assertRaises(BulkheadFullError):
+                self.call_ok()
+        self.assertEqual(self.dependency.bulkhead.snapshot()["rejected"], 1)
+        self.call_ok()  # the slot was released
+
+
+class SingleFlightTests(SimpleTestCase):
+    callers = 6
+
+    def setUp(self):
+        cache.clear()
+        self.flight = SingleFlight("test")
+
+    def run_concurrently(self, fn):
+        """Call ``fn`` through the flight from every caller while the first call is still running."""
+        started, release = threading.Event(), threading.Event()
+        upstream = []
+
+        def leader_fn():
+            upstream.append(1)
+            started.set()
+            release.wait(5)
+            return fn()
+
+        outcomes = []
+
+        def caller():
+            try:
+                outcomes.append(self.flight.do("key", leader_fn))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=caller) for _ in range(self.callers)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while self.flight.stats()["coalesced"] < self.callers - 1 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return upstream, outcomes
+
+    def test_concurrent_callers_share_one_upstream_call(self):
+        upstream, outcomes = self.run_concurrently(lambda: {"token": "abc"})
+        self.assertEqual(len(upstream), 1)
+        self.assertEqual(outcomes, [{"token": "abc"}] * self.callers)
+        self.assertEqual(self.flight.stats(), {
+            "calls": self.callers, "executed": 1, "coalesced": self.callers - 1, "shared_hits": 0, "in_flight": 0,
+        })
+
+    def test_error_reaches_every_waiter(self):
+        error = RuntimeError("thingsboard down")
+
+        def boom():
+            raise error
+
+        upstream, outcomes = self.run_concurrently(boom)
+        self.assertEqual(len(upstream), 1)
+        self.assertEqual(outcomes, [error] * self.callers)
+        # Nothing is left in flight: the next call runs again.
+        self.assertEqual(self.flight.do("key", lambda: "ok"), "ok")
+        self.assertEqual(self.flight.stats()["executed"], 2)
+
+    def test_shared_result_is_reused_until_forgotten(self):
+        fn = mock.Mock(return_value="token-1")
+        self.assertEqual(self.flight.do("token", fn, shared=True, result_ttl=60), "token-1")
+        self.assertEqual(self.flight.do("token", fn, shared=True, result_ttl=60), "token-1")
+        self.assertEqual((fn.call_count, self.flight.stats()["shared_hits"]), (1, 1))
+
+        self.flight.forget("token", "stale")  # another value: kept
+        self.flight.do("token", fn, shared=True)
+        self.assertEqual(fn.call_count, 1)
+        self.flight.forget("token", "token-1")
+        self.flight.do("token", fn, shared=True)
+        self.assertEqual(fn.call_count, 2)
+
+
+class MetricsEndpointTests(TestCase):
+    @override_settings(METRICS_TOKEN=None, METRICS_ALLOWED_IPS=["127.0.0.1"])
+    def test_without_token_only_allowed_ips_scrape(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 200)
+        self.assertEqual(self.client.get("/metrics/", REMOTE_ADDR="203.0.113.7").status_code, 403)
+
+    @override_settings(METRICS_TOKEN="scrape-me", METRICS_ALLOWED_IPS=["127.0.0.1"])
+    def test_token_is_required_when_set(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 401)
+        response = self.client.get("/metrics/", REMOTE_ADDR="203.0.113.7", HTTP_AUTHORIZATION="Bearer scrape-me")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("http_requests_total", response.content.decode())
+
+    def test_middleware_does_not_touch_the_session(self):
+        request = RequestFactory().get("/api/profile/")
+        request.session = mock.Mock()
+        MetricsMiddleware(lambda r: HttpResponse())(request)
+        self.assertEqual(request.session.mock_calls, [])
+        self.assertFalse(hasattr(MetricsMiddleware, "process_view"))
+
+    def test_session_lookups_are_counted_for_the_configured_engine(self):
+        user = CustomUser.objects.create_user(
+            username="sess@example.com", email="sess@example.com", phone_number="+201001234599")
+        hits, misses = (metrics.cache_lookups.get("session", result) for result in ("hit", "miss"))
+
+        self.client.force_login(user)
+        self.client.get("/api/auth/membership-stats/")
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = "no-such-session"
+        self.client.get("/api/auth/membership-stats/")
+
+        self.assertEqual(metrics.cache_lookups.get("session", "hit"), hits + 1)
+        self.assertEqual(metrics.cache_lookups.get("session", "miss"), misses + 1)
+
+    def test_pool_samples_skip_aliases_without_a_pool(self):
+        class FakeWrapper:
+            settings_dict = {"OPTIONS": {"pool": {"max_size": 4}}}
+            _connection_pools = {"default": mock.Mock(get_stats=lambda: {"pool_size": 2, "pool_available": 1,
+                                                                        "pool_max": 4})}
+
+            @property
+            def pool(self):
+                raise AssertionError("would create a pool")
+
+        handler = {"default": FakeWrapper(), "replica": FakeWrapper()}
+        with mock.patch("backend.views.connections", handler):
+            samples = dict(_db_pool_samples())
+        self.assertEqual(samples[("default", "utilization")], 0.25)
+        self.assertFalse([key for key in samples if key[0] == "replica"])
+
+
+@override_settings(**FAST_TEST_SETTINGS)
+class EndpointBudgetTests(EndpointBudgetMixin, TestCase):
+    password = "Sup3r-secret-pass"
+
+    def setUp(self):
+        cache.clear()
+        tb_patcher = mock.patch("services.thingboard_services.create_tb_user", return_value={})
+        self.create_tb_user = tb_patcher.start()
+        self.addCleanup(tb_patcher.stop)
+
+    def budget(self, name):
+        return self.assertWithinBudget(name, **ENDPOINT_BUDGETS[name])
+
+    def test_latency_is_only_enforced_on_request(self):
+        def slow_but_cheap():
+            with self.assertWithinBudget("slow", queries=0, ms=1):
+                time.sleep(0.01)
+
+        with mock.patch("backend.testing.TIME_BUDGETS", False):
+            slow_but_cheap()
+        with mock.patch("backend.testing.TIME_BUDGETS", True), self.assertRaises(AssertionError):
+            slow_but_cheap()
+        with self.assertRaisesMessage(AssertionError, "1 queries (budget 0)"):
+            with self.assertWithinBudget("chatty", queries=0, ms=10_000):
+                CustomUser.objects.exists()
+
+    def make_user(self, **extra):
+        fields = {
+            "username": "owner@example.com",
+            "email": "owner@example.com",
+            "phone_number": "+201001234567",
+            "password": self.password,
+            "email_verified": True,
+            "is_approved": True,
+        }
+        fields.update(extra)
+        return CustomUser.objects.create_user(**fields)
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type="application/json")
+
+    def test_register(self):
+        with self.budget("register"):
+            response = self.post("/api/auth/register/", {
+                "email": "new@example.com", "phone_number": "+201001234568",
+            })
+        self.assertEqual(response.status_code, 200)
+
+    def test_verify_otp(self):
+        cache.set("otp_new@example.com", {"otp": "1234", "purpose": "registration"})
+        with self.budget("verify_otp"):
+            response = self.post("/api/auth/verify-otp/", {"email": "new@example.com", "otp": "1234"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_complete_registration(self):
+        cache.set("verified_new@example.com", True)
+        with self.budget("complete_registration"):
+            response = self.post("/api/auth/complete-registeration/", {
+                "email": "new@example.com",
+                "phone_number": "+201001234568",
+                "password": self.password,
+                "confirm_password": self.password,
+                "user_type": "CUSTOMER",
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(CustomUser.objects.filter(email="new@example.com", is_approved=True).exists())
+
+    def test_login(self):
+        self.make_user()
+        with self.budget("login"):
+            response = self.post("/api/auth/login/", {"email": "owner@example.com", "password": self.password})
+        self.assertEqual(response.status_code, 200)
+
+    def test_phone_login(self):
+        self.make_user()
+        with self.budget("phone_login"):
+            response = self.post("/api/auth/phone-login/", {"phone_number": "+201001234567"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_check_auth(self):
+        self.client.force_login(self.make_user())
+        with self.budget("check_auth"):
+            response = self.client.get("/api/auth/check-auth/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_membership_stats(self):
+        customer = self.make_user()
+        CustomerMembershipStats.objects.create(customer=customer, approved_members=3)
+        self.client.force_login(customer)
+        with self.budget("membership_stats"):
+            response = self.client.get("/api/auth/membership-stats/")
+        self.assertEqual(response.json()["approved_members"], 3)
+
+    def test_profile(self):
+        self.client.force_login(self.make_user())
+        with self.budget("profile"):
+            response = self.client.get("/api/auth/profile/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_check_account_exists(self):
+        self.make_user()
+        with self.budget("check_account_exists"):
+            response = self.post("/api/auth/check-account-exists/", {
+                "email": "owner@example.com", "phone_number": "+201001234567",
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["exists"], {"email": True, "phone_number": True})
+
+    def test_resolve_invitation(self):
+        owner = self.make_user()
+        CustomerInvitation.objects.create(
+            email="Invited@example.com", customer=owner, token="tok-1",
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        with self.budget("resolve_invitation"):
+            response = self.client.get("/api/auth/invitations/tok-1/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["email"], "invited@example.com")
+        self.assertEqual(response.json()["customer"]["id"], owner.id)
+
+        # Served from the cache: only the session lookups remain.
+        with self.assertNumQueries(ENDPOINT_BUDGETS["resolve_invitation"]["queries"] - 1):
+            self.client.get("/api/auth/invitations/tok-1/")
+
+
+@override_settings(**FAST_TEST_SETTINGS)
+class InvitationTokenTests(TestCase):
+    password = "Sup3r-secret-pass"
+
+    def setUp(self):
+        cache.clear()
+        tb_patcher = mock.patch("services.thingboard_services.create_tb_user", return_value={})
+        self.create_tb_user = tb_patcher.start()
+        self.addCleanup(tb_patcher.stop)
+        lookup_patcher = mock.patch("services.thingboard_services.get_customer_id_by_email", return_value="tb-customer-uuid")
+        self.get_customer_id_by_email = lookup_patcher.start()
+        self.addCleanup(lookup_patcher.stop)
+        self.owner = CustomUser.objects.create_user(
+            username="owner@example.com", email="owner@example.com", phone_number="+201001234567",
+            password=self.password, is_approved=True,
+        )
+        CustomerInvitation.objects.create(
+            email="invited@example.com", customer=self.owner, token="tok-1",
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        cache.set("verified_invited@example.com", True)
+
+    def complete(self, **extra):
+        return self.client.post("/api/auth/complete-registeration/", {
+            "email": "invited@example.com",
+            "phone_number": "+201001234568",
+            "password": self.password,
+            "confirm_password": self.password,
+            "invitation_token": "tok-1",
+            **extra,
+        }, content_type="application/json")
+
+    def test_completion_with_token_joins_inviting_customer(self):
+        self.client.get("/api/auth/invitations/tok-1/")  # cached, as after following the link
+        response = self.complete()
+        self.assertEqual(response.status_code, 200)
+
+        user = CustomUser.objects.get(email="invited@example.com")
+        self.assertEqual((user.user_type, user.parent_customer_id, user.is_approved), ("CUSTOMER_USER", str(self.owner.id), False))
+        self.assertTrue(CustomerInvitation.objects.get(token="tok-1").is_used)
+        self.assertEqual(self.client.get("/api/auth/invitations/tok-1/").status_code, 404)
+
+        # ThingsBoard gets the inviting customer's TB id, not its Django pk.
+        self.get_customer_id_by_email.assert_called_with("owner@example.com")
+        self.assertEqual(self.create_tb_user.call_args.kwargs["parent_customer_id"], "tb-customer-uuid")
+
+    def test_failed_registration_keeps_invitation(self):
+        CustomUser.objects.create_user(
+            username="taken@example.com", email="taken@example.com", phone_number="+201001234568", password=self.password,
+        )
+        response = self.complete()
+        self.assertEqual(response.json().get("phone_already_exists"), True)
+        self.assertFalse(CustomerInvitation.objects.get(token="tok-1").is_used)
+
+        with mock.patch("users.views.CustomUser.objects.create_user", side_effect=RuntimeError("insert failed")):
+            with self.assertRaises(RuntimeError):
+                self.complete(phone_number="+201001234569")
+        self.assertFalse(CustomerInvitation.objects.get(token="tok-1").is_used)
+
+    def test_token_for_another_email_is_rejected(self):
+        cache.set("verified_other@example.com", True)
+        response = self.complete(email="other@example.com")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CustomerInvitation.objects.get(token="tok-1").is_used)
+
+
+@override_settings(**FAST_TEST_SETTINGS)
+class IdempotencyTests(TestCase):
+    password = "Sup3r-secret-pass"
+
+    def setUp(self):
+        cache.clear()
+        cache.set("verified_new@example.com", True)
+        tb_patcher = mock.patch("services.thingboard_services.create_tb_user", return_value={})
+        self.create_tb_user = tb_patcher.start()
+        self.addCleanup(tb_patcher.stop)
+        self.payload = {
+            "email": "new@example.com",
+            "phone_number": "+201001234568",
+            "password": self.password,
+            "confirm_password": self.password,
+            "user_type": "CUSTOMER",
+        }
+
+    def complete(self, payload, key="retry-1"):
+        return self.client.post(
+            "/api/auth/complete-registeration/", payload,
+            content_type="application/json", HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_multipart_request_is_fingerprinted_on_its_raw_body(self):
+        first, retry = (
+            self.client.post("/api/auth/complete-registeration/", self.payload, HTTP_IDEMPOTENCY_KEY="form-1")
+            for _ in range(2)
+        )
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+
+    def test_retry_replays_first_response(self):
+        first = self.complete(self.payload)
+        retry = self.complete(self.payload)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(CustomUser.objects.filter(email="new@example.com").count(), 1)
+        self.assertEqual(self.create_tb_user.call_count, 1)
+
+    def test_key_reused_with_different_body_is_rejected(self):
+        self.complete(self.payload)
+        response = self.complete({**self.payload, "phone_number": "+201001234569"})
+        self.assertEqual(response.status_code, 422)
+
+    def test_anonymous_keys_are_scoped_to_the_identifier(self):
+        cache.set("verified_other@example.com", True)
+        self.complete(self.payload)
+        other = self.complete({**self.payload, "email": "other@example.com", "phone_number": "+201001234569"})
+        self.assertNotIn("Idempotent-Replayed", other)
+        self.assertTrue(CustomUser.objects.filter(email="other@example.com").exists())
+
+    def test_client_errors_are_not_replayed(self):
+        cache.delete("verified_new@example.com")
+        self.assertEqual(self.complete(self.payload).status_code, 400)  # OTP not verified yet
+
+        cache.set("verified_new@example.com", True)
+        retry = self.complete(self.payload)
+        self.assertEqual(retry.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", retry)
+
+    def test_repeated_approval_link_approves_once(self):
+        customer = CustomUser.objects.create_user(
+            username="owner@example.com", email="owner@example.com", phone_number="+201001234567", is_approved=True)
+        member = CustomUser.objects.create_user(
+            username="m@example.com", email="m@example.com", phone_number="+201001234569",
+            user_type="CUSTOMER_USER", parent_customer_id=str(customer.pk))
+        self.client.force_login(customer)
+        for _ in range(2):
+            self.assertEqual(self.client.get(f"/api/auth/approve-user/{member.pk}/").status_code, 200)
+        self.assertEqual(UserEvent.objects.filter(event_type=USER_APPROVED, user_id=member.pk).count(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(DATABASE_REPLICA_ALIASES=["replica_1"])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        lag_patcher = mock.patch("backend.db_router.replica_lag", return_value=0)
+        self.replica_lag = lag_patcher.start()
+        self.addCleanup(lag_patcher.stop)
+
+    def route(self, request, write=False):
+        """Run a fake view under the pinning middleware; return (read alias, response)."""
+        seen = {}
+
+        def view(request):
+            if write:
+                self.router.db_for_write(CustomUser)
+            seen["read"] = self.router.db_for_read(CustomUser)
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(view)(request)
+        return seen["read"], response
+
+    def test_safe_read_uses_replica(self):
+        read, response = self.route(RequestFactory().get("/api/auth/profile/"))
+        self.assertEqual(read, "replica_1")
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        self.replica_lag.return_value = 30
+        read, _ = self.route(RequestFactory().get("/api/auth/profile/"))
+        self.assertEqual(read, "default")
+
+    def test_write_pins_reads_and_following_requests(self):
+        read, response = self.route(RequestFactory().get("/api/auth/profile/"), write=True)
+        self.assertEqual(read, "default")
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        request = RequestFactory().get("/api/auth/profile/")
+        request.COOKIES[PIN_COOKIE] = "1"
+        self.assertEqual(self.route(request)[0], "default")
+
+    def test_unsafe_methods_read_from_primary(self):
+        read, _ = self.route(RequestFactory().post("/api/auth/complete-registeration/"))
+        self.assertEqual(read, "default")
+
+
+@override_settings(DATABASE_REPLICA_ALIASES=["replica_1"], **FAST_TEST_SETTINGS)
+class ReplicaWriteViewTests(TestCase):
+    """GET views that write must read the row they write back from the primary."""
+
+    def setUp(self):
+        lag_patcher = mock.patch("backend.db_router.replica_lag", return_value=0)
+        lag_patcher.start()
+        self.addCleanup(lag_patcher.stop)
+        self.user_reads = []
+        route = PrimaryReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            if model is CustomUser:
+                self.user_reads.append(route(router, model, **hints))
+            return "default"  # the test database has no replica
+
+        router_patcher = mock.patch.object(PrimaryReplicaRouter, "db_for_read", spy)
+        router_patcher.start()
+        self.addCleanup(router_patcher.stop)
+        self.customer = CustomUser.objects.create_user(
+            username="owner@example.com", email="owner@example.com", phone_number="+201001234567", is_approved=True)
+        self.member = CustomUser.objects.create_user(
+            username="m@example.com", email="m@example.com", phone_number="+201001234568",
+            user_type="CUSTOMER_USER", parent_customer_id=str(self.customer.pk), is_active=False)
+
+    def test_email_verification_reads_primary_and_writes_only_its_fields(self):
+        uidb64 = urlsafe_base64_encode(force_bytes(self.member.pk))
+        token = default_token_generator.make_token(self.member)
+        self.user_reads.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/auth/verify-email/{uidb64}/{token}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(self.user_reads), {"default"})
+        update = next(q["sql"] for q in queries.captured_queries if q["sql"].startswith("UPDATE \"users_customuser\""))
+        self.assertNotIn("phone_number", update)
+
+    def test_approval_link_reads_primary(self):
+        self.client.force_login(self.customer)
+        self.user_reads.clear()
+        self.assertEqual(self.client.get(f"/api/auth/approve-user/{self.member.pk}/").status_code, 200)
+        self.assertEqual(set(self.user_reads), {"default"})
+
+
+@override_settings(CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "default"},
+    "shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "shared"},
+})
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = TwoTierCache(self.id(), {"OPTIONS": {
+            "SHARED_ALIAS": "shared", "LOCAL_PREFIXES": ["tb:"], "LOCAL_MAX_ENTRIES": 2, "LOCAL_TIMEOUT": 5,
+        }})
+        self.shared = self.cache.shared
+        self.shared.clear()
+
+    def test_prefixed_keys_are_served_locally(self):
+        self.shared.set("tb:devices:1", ["a"])
+        self.assertEqual(self.cache.get("tb:devices:1"), ["a"])
+        self.shared.set("tb:devices:1", ["b"])  # written by another process
+        self.assertEqual(self.cache.get("tb:devices:1"), ["a"])
+        self.assertEqual(self.cache.stats()["local_hits"], 1)
+        self.assertEqual(self.cache.stats()["shared_hits"], 1)
+
+    def test_other_keys_stay_shared_only(self):
+        self.cache.set("otp_new@example.com", {"otp": "1234"})
+        self.shared.set("otp_new@example.com", {"otp": "5678"})
+        self.assertEqual(self.cache.get("otp_new@example.com"), {"otp": "5678"})
+        self.assertEqual(self.cache.stats()["local_entries"], 0)
+
+    def test_local_copies_expire_and_evict(self):
+        with mock.patch("backend.cache.time.monotonic", return_value=100):
+            self.cache.set("tb:a", 1)
+            self.cache.set("tb:b", 2)
+            self.cache.get("tb:a")
+            self.cache.set("tb:c", 3)  # evicts tb:b, the least recently used
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.shared.delete("tb:a")
+        with mock.patch("backend.cache.time.monotonic", return_value=106):
+            self.assertIsNone(self.cache.get("tb:a"))
+
+    def test_local_copy_expires_with_the_shared_entry(self):
+        # LocMemCache and the TTL lookup both read time.time().
+        with mock.patch("time.time", return_value=1000), mock.patch("time.monotonic", return_value=100):
+            self.shared.set("tb:devices:1", ["a"], timeout=2)
+            self.shared.set("tb:devices:2", ["b"], timeout=60)
+            self.cache.get("tb:devices:1")
+            self.cache.get_many(["tb:devices:2"])
+        expiries = {key: expires_at for key, (expires_at, _) in self.cache.local._data.items()}
+        self.assertEqual(expiries[self.cache.local_key("tb:devices:1", None)], 102)
+        self.assertEqual(expiries[self.cache.local_key("tb:devices:2", None)], 105)
+
+    def test_invalidation_from_another_process_drops_local_copy(self):
+        self.cache.set("tb:customer-id:owner@example.com", "old")
+        self.shared.set("tb:customer-id:owner@example.com", "new")
+        local_key = self.cache.local_key("tb:customer-id:owner@example.com", None)
+        self.cache.on_invalidation(json.dumps({"origin": "other", "keys": [local_key]}))
+        self.assertEqual(self.cache.get("tb:customer-id:owner@example.com"), "new")
+
+
+@override_settings(**FAST_TEST_SETTINGS)
+class IdentifierNormalizationTests(TestCase):
+    password = "Sup3r-secret-pass"
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username="Owner@Example.com", email="Owner@Example.com", phone_number="+201001234567",
+            password=self.password, email_verified=True, is_approved=True,
+        )
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type="application/json")
+
+    def test_phone_formats_share_otp_and_user(self):
+        response = self.post("/api/auth/phone-login/", {"phone_number": "010 0123 4567"})
+        self.assertEqual(response.status_code, 200)
+        otp = cache.get("otp_+201001234567")["otp"]
+
+        response = self.post("/api/auth/verify-otp/", {"phone_number": "+201001234567", "otp": otp})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["user"]["id"], self.user.id)
+
+    def test_email_lookups_ignore_case(self):
+        response = self.post("/api/auth/check-account-exists/", {
+            "email": " owner@EXAMPLE.com", "phone_number": "01001234567",
+        })
+        self.assertEqual(response.json()["exists"], {"email": True, "phone_number": True})
+
+        response = self.post("/api/auth/login/", {"email": "OWNER@example.com", "password": self.password})
+        self.assertEqual(response.status_code, 200)
+
+
+class RecordingSink(EventSink):
+    name = "recording"
+
+    def __init__(self, fail=False, name=None, event_types=None):
+        self.fail = fail
+        self.batches = []
+        if name:
+            self.name = name
+        if event_types:
+            self.event_types = event_types
+
+    def send(self, events):
+        if self.fail:
+            raise RuntimeError("sink down")
+        self.batches.append(events)
+
+
+@override_settings(**FAST_TEST_SETTINGS)
+class UserEventTests(TestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create_user(
+            username="alice@example.com", email="alice@example.com", phone_number="+201001234567")
+        self.bob = CustomUser.objects.create_user(
+            username="bob@example.com", email="bob@example.com", phone_number="+201001234568")
+
+    def test_registration_writes_outbox_event(self):
+        cache.set("verified_new@example.com", True)
+        with mock.patch("services.thingboard_services.create_tb_user", return_value={}):
+            self.client.post("/api/auth/complete-registeration/", {
+                "email": "new@example.com", "phone_number": "+201001234569",
+                "password": "Sup3r-secret-pass", "confirm_password": "Sup3r-secret-pass",
+                "user_type": "CUSTOMER",
+            }, content_type="application/json")
+        event = UserEvent.objects.get()
+        self.assertEqual(event.event_type, USER_REGISTERED)
+        self.assertEqual(event.payload["email"], "new@example.com")
+        self.assertTrue(event.payload["is_approved"])
+
+    def test_batch_is_delivered_in_order(self):
+        first = record_event(USER_REGISTERED, self.alice)
+        second = record_event(USER_APPROVED, self.alice)
+        sink = RecordingSink()
+
+        self.assertEqual(dispatch_batch([sink]), (2, 0))
+        self.assertEqual([e["id"] for e in sink.batches[0]], [first.id, second.id])
+        self.assertEqual(UserEvent.objects.filter(status=UserEvent.DELIVERED).count(), 2)
+        self.assertEqual(dispatch_batch([sink]), (0, 0))
+
+    def test_failed_event_holds_back_later_events_of_same_user(self):
+        record_event(USER_REGISTERED, self.alice)
+        self.assertEqual(dispatch_batch([RecordingSink(fail=True)]), (0, 1))
+        failed = UserEvent.objects.get()
+        self.assertEqual(failed.attempts, 1)
+        self.assertIsNotNone(failed.next_attempt_at)
+
+        record_event(USER_APPROVED, self.alice)
+        bob_event = record_event(USER_REGISTERED, self.bob)
+        sink = RecordingSink()
+        self.assertEqual(dispatch_batch([sink]), (1, 0))
+        self.assertEqual([e["id"] for e in sink.batches[0]], [bob_event.id])
+
+    def test_event_being_claimed_elsewhere_holds_back_later_events_of_same_user(self):
+        first = record_event(USER_REGISTERED, self.alice)
+        record_event(USER_APPROVED, self.alice)
+        bob_event = record_event(USER_REGISTERED, self.bob)
+        # Another dispatcher has locked the first event but not committed its lease yet,
+        # so skip_locked hides it from this one.
+        locked = UserEvent.objects.exclude(id=first.id)
+        with mock.patch.object(UserEvent.objects, "select_for_update", return_value=locked):
+            claimed = claim_batch(10, timezone.now())
+        self.assertEqual([event.id for event in claimed], [bob_event.id])
+
+    def test_rejecting_sink_fails_only_its_events_and_retry_skips_accepting_sinks(self):
+        alice_event = record_event(USER_REGISTERED, self.alice)
+        bob_event = record_event(USER_VERIFICATION_REQUESTED, self.bob)
+        ok, down = RecordingSink(name="ok"), RecordingSink(fail=True, name="down")
+        work = RecordingSink(name="work", event_types={USER_VERIFICATION_REQUESTED})
+
+        self.assertEqual(dispatch_batch([ok, down, work]), (1, 1))
+        self.assertEqual([e["id"] for e in work.batches[0]], [bob_event.id])
+        self.assertEqual(UserEvent.objects.get(id=bob_event.id).status, UserEvent.DELIVERED)
+        alice_event.refresh_from_db()
+        self.assertEqual((alice_event.status, alice_event.attempts), (UserEvent.PENDING, 1))
+        self.assertEqual(alice_event.delivered_to, ["ok"])
+        self.assertTrue(alice_event.last_error.startswith("down: "))
+
+        UserEvent.objects.filter(id=alice_event.id).update(next_attempt_at=timezone.now())
+        down.fail = False
+        self.assertEqual(dispatch_batch([ok, down, work]), (1, 0))
+        self.assertEqual(len(ok.batches), 1)
+        self.assertEqual([e["id"] for e in down.batches[0]], [alice_event.id])
+
+    @override_settings(USER_EVENT_MAX_ATTEMPTS=1)
+    def test_event_fails_after_max_attempts(self):
+        record_event(USER_REGISTERED, self.alice)
+        dispatch_batch([RecordingSink(fail=True)])
+        self.assertEqual(UserEvent.objects.get().status, UserEvent.FAILED)
+
+        # Ordering for the user ends at a failed event.
+        later = record_event(USER_APPROVED, self.alice)
+        sink = RecordingSink()
+        self.assertEqual(dispatch_batch([sink]), (1, 0))
+        self.assertEqual([e["id"] for e in sink.batches[0]], [later.id])
+
+    def test_batch_is_leased_while_sinks_run(self):
+        record_event(USER_REGISTERED, self.alice)
+        seen = []
+
+        class ConcurrentDispatchSink(EventSink):
+            name = "concurrent"
+
+            def send(self, events):
+                # Another dispatcher running now finds nothing to claim.
+                seen.append(dispatch_batch([RecordingSink()]))
+
+        self.assertEqual(dispatch_batch([ConcurrentDispatchSink()]), (1, 0))
+        self.assertEqual(seen, [(0, 0)])
+        event = UserEvent.objects.get()
+        self.assertEqual((event.status, event.next_attempt_at), (UserEvent.DELIVERED, None))
+
+    def test_expired_lease_is_claimed_again(self):
+        record_event(USER_REGISTERED, self.alice)
+        # A dispatcher claimed it an hour ago and died before recording an outcome.
+        self.assertEqual(len(claim_batch(10, timezone.now() - timedelta(hours=1))), 1)
+        sink = RecordingSink()
+        self.assertEqual(dispatch_batch([sink]), (1, 0))
+
+
+@override_settings(**FAST_TEST_SETTINGS)
+class ImportUsersTests(TestCase):
+    header = "email,phone_number,password,first_name,last_name,user_type,parent_customer_id\n"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.rejects = os.path.join(self.tmp.name, "rejects.csv")
+        CustomUser.objects.create_user(
+            username="taken@example.com", email="taken@example.com", phone_number="+201001234500")
+
+    def run_import(self, rows, *args):
+        path = os.path.join(self.tmp.name, "users.csv")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.header + "".join(row + "\n" for row in rows))
+        out = io.StringIO()
+        call_command("import_users", path, "--rejects", self.rejects, "--workers", "1", *args, stdout=out)
+        with open(self.rejects, encoding="utf-8") as f:
+            return out.getvalue(), {row["email"]: row["error"] for row in csv.DictReader(f)}
+
+    def test_valid_rows_are_inserted_in_batches_and_the_rest_rejected(self):
+        output, rejects = self.run_import([
+            "A@Example.com,01001234501,pw-1,Ann,,CUSTOMER,",
+            "b@example.com,+201001234502,,,,customer_user,1",
+            "c@example.com,01001234503,,,,,",
+            "not-an-email,01001234504,,,,,",
+            "d@example.com,12,,,,,",
+            "e@example.com,01001234505,,,,CUSTOMER_USER,",
+            "a@example.com,01001234506,,,,,",
+            "TAKEN@example.com,01001234507,,,,,",
+        ], "--batch-size", "2")
+
+        self.assertEqual(
+            set(CustomUser.objects.exclude(email="taken@example.com").values_list("email", flat=True)),
+            {"a@example.com", "b@example.com", "c@example.com"})
+        user = CustomUser.objects.get(email="a@example.com")
+        self.assertEqual((str(user.phone_number), user.first_name, user.is_approved), ("+201001234501", "Ann", True))
+        self.assertTrue(user.check_password("pw-1"))
+        self.assertFalse(CustomUser.objects.get(email="b@example.com").is_approved)
+        self.assertIn("3 imported, 5 rejected", output)
+        self.assertEqual(output.count("Inserted "), 2)  # four clean rows, two per batch
+
+        self.assertIn("invalid email", rejects["not-an-email"])
+        self.assertIn("invalid phone number", rejects["d@example.com"])
+        self.assertIn("parent_customer_id is required", rejects["e@example.com"])
+        self.assertIn("duplicate email in file", rejects["a@example.com"])
+        self.assertEqual(rejects["TAKEN@example.com"], "account already exists")
+        self.assertEqual(UserEvent.objects.filter(event_type=USER_REGISTERED).count(), 3)
+
+    def test_rejects_file_leaves_out_passwords(self):
+        self.run_import(["not-an-email,01001234504,pw-secret,,,,", "taken@example.com,01001234507,pw-secret,,,,"])
+        with open(self.rejects, encoding="utf-8") as f:
+            content = f.read()
+        self.assertNotIn("password", content.splitlines()[0])
+        self.assertNotIn("pw-secret", content)
+
+    def test_provisioning_and_emails_are_queued(self):
+        self.run_import(["a@example.com,01001234501,,,,,"], "--provision-tb", "--send-verification")
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            sorted(UserEvent.objects.values_list("event_type", flat=True)),
+            sorted([USER_REGISTERED, USER_TB_PROVISIONING_REQUESTED, USER_VERIFICATION_REQUESTED]))
+
+        with mock.patch("users.provisioning.provision_users", return_value=(1, 0)) as provision:
+            self.assertEqual(dispatch_batch([ThingsBoardSink(), EmailSink()]), (3, 0))
+        provision.assert_called_once_with({CustomUser.objects.get(email="a@example.com").pk})
+        self.assertEqual([m.to for m in mail.outbox], [["a@example.com"]])
+
+    def test_rows_that_raced_in_are_rejected_not_double_counted(self):
+        command = ImportCommand()
+        racer = {"source": {"email": "taken@example.com"}}
+        fresh = {"source": {"email": "new@example.com"}}
+        pairs = [
+            (racer, CustomUser(username="taken@example.com", email="taken@example.com", phone_number="+201001234598")),
+            (fresh, CustomUser(username="new@example.com", email="new@example.com", phone_number="+201001234599")),
+        ]
+        rejects = mock.Mock()
+        inserted = command.insert(pairs, rejects, batch_size=10)
+        self.assertEqual([u.email for u in inserted], ["new@example.com"])
+        self.assertIsNotNone(inserted[0].pk)
+        rejects.writerow.assert_called_once_with({"email": "taken@example.com", "error": "account already exists"})
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class AccountStatusSocketTests(TransactionTestCase):
+    # The consumer reads the database from a worker thread, outside the
+    # TestCase transaction.
+
+    def setUp(self):
+        self.customer = CustomUser.objects.create_user(
+            username="owner@example.com", email="owner@example.com", phone_number="+201001234570",
+            user_type="CUSTOMER", is_approved=True)
+        self.member = CustomUser.objects.create_user(
+            username="member@example.com", email="member@example.com", phone_number="+201001234571",
+            user_type="CUSTOMER_USER", parent_customer_id=str(self.customer.pk))
+
+    def communicator(self, user=None, query=""):
+        if user is not None:
+            query = f"ticket={make_ticket(user)}"
+        scope = {"type": "websocket", "path": "/ws/account/", "query_string": query.encode(), "headers": []}
+        return ApplicationCommunicator(AccountStatusConsumer.as_asgi(), scope)
+
+    async def connect(self, socket):
+        await socket.send_input({"type": "websocket.connect"})
+        return await socket.receive_output(timeout=5)
+
+    async def receive_json(self, socket):
+        return json.loads((await socket.receive_output(timeout=5))["text"])
+
+    def test_ticket_connect_receives_status(self):
+        async def run():
+            socket = self.communicator(self.member)
+            self.assertEqual((await self.connect(socket))["type"], "websocket.accept")
+            status = await self.receive_json(socket)
+            await socket.send_input({"type": "websocket.disconnect", "code": 1000})
+            await socket.wait(timeout=5)
+            return status
+
+        status = async_to_sync(run)()
+        self.assertEqual(status["type"], "account.status")
+        self.assertFalse(status["is_approved"])
+
+    def test_bad_ticket_is_rejected(self):
+        async def run():
+            return await self.connect(self.communicator(query="ticket=forged"))
+
+        self.assertEqual(async_to_sync(run)(), {"type": "websocket.close", "code": 4401})
+
+    def test_sink_pushes_to_user_and_customer(self):
+        event = record_event(USER_REGISTERED, self.member)
+
+        async def run():
+            member, owner = self.communicator(self.member), self.communicator(self.customer)
+            for socket in (member, owner):
+                await self.connect(socket)
+                await self.receive_json(socket)
+            sink = ChannelLayerSink()
+            sink.layer = get_channel_layer()
+            await sink._send([{"id": event.id, "type": event.event_type, "user_id": event.user_id,
+                               "created_at": event.created_at, "data": event.payload}])
+            received = [await self.receive_json(member), await self.receive_json(owner)]
+            for socket in (member, owner):
+                await socket.send_input({"type": "websocket.disconnect", "code": 1000})
+                await socket.wait(timeout=5)
+            return received
+
+        for message in async_to_sync(run)():
+            self.assertEqual(message["id"], event.id)
+            self.assertEqual(message["data"]["parent_customer_id"], str(self.customer.pk))
+
+
+@override_settings(**FAST_TEST_SETTINGS)
+class AdminBulkActionTests(TestCase):
+    def setUp(self):
+        self.staff = CustomUser.objects.create_superuser(
+            username="staff@example.com", email="staff@example.com", password="pw", phone_number="+201001234580")
+        self.users = [
+            CustomUser.objects.create_user(
+                username=f"user{i}@example.com", email=f"user{i}@example.com",
+                phone_number=f"+20100123459{i}", user_type="CUSTOMER_USER")
+            for i in range(3)
+        ]
+        self.client.force_login(self.staff)
+
+    def act(self, action, model="customuser", pks=None):
+        pks = pks if pks is not None else [u.pk for u in self.users]
+        return self.client.post(f"/admin/users/{model}/", {
+            "action": action, "_selected_action": pks,
+        }, follow=True)
+
+    def test_approve_works_in_chunks(self):
+        CustomUser.objects.filter(pk=self.users[0].pk).update(is_approved=True)
+
+        with mock.patch("users.admin.ACTION_CHUNK_SIZE", 1):
+            response = self.act("approve_users")
+        self.assertContains(response, "Approved 2 of 3 selected users in 2 batch(es); 2 email(s) queued")
+        self.assertEqual(CustomUser.objects.filter(is_approved=True, approved_by=self.staff).count(), 2)
+        self.assertEqual(UserEvent.objects.filter(event_type=USER_APPROVED).count(), 2)
+        self.assertEqual(len(mail.outbox), 0)
+
+        dispatch_batch([EmailSink()])
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ["user1@example.com", "user2@example.com"])
+        self.assertTrue(all(m.subject == "Your account has been approved" for m in mail.outbox))
+
+    def test_approve_skips_users_another_admin_approved_meanwhile(self):
+        from users import admin as users_admin
+
+        chunks = users_admin._chunks
+
+        def racing_chunks(queryset, fields):
+            for users in chunks(queryset, fields):
+                # Another admin approves the first user after this chunk was read.
+                CustomUser.objects.filter(pk=users[0].pk).update(is_approved=True)
+                yield users
+
+        with mock.patch("users.admin._chunks", racing_chunks):
+            response = self.act("approve_users")
+        self.assertContains(response, "Approved 2 of 3 selected users in 1 batch(es); 2 email(s) queued")
+        self.assertEqual(UserEvent.objects.filter(event_type=USER_APPROVED).count(), 2)
+        self.assertFalse(UserEvent.objects.filter(user_id=self.users[0].pk).exists())
+
+    def test_deactivate_skips_acting_user_and_ends_sessions(self):
+        for user in self.users[:2]:
+            self.client_class().force_login(user)
+        response = self.act("deactivate_users", pks=[u.pk for u in self.users] + [self.staff.pk])
+        self.assertContains(response, "Deactivated 3 of 4 selected users in 1 batch(es); 2 session(s) ended")
+        self.assertFalse(CustomUser.objects.filter(pk__in=[u.pk for u in self.users], is_active=True).exists())
+        self.assertEqual(UserEvent.objects.filter(event_type=USER_DEACTIVATED).count(), 3)
+        self.assertEqual([s.get_decoded()["_auth_user_id"] for s in Session.objects.all()], [str(self.staff.pk)])
+
+    def test_resend_verification_is_queued_and_needs_change_permission(self):
+        viewer = CustomUser.objects.create_user(
+            username="viewer@example.com", email="viewer@example.com", password="pw",
+            phone_number="+201001234581", is_staff=True)
+        viewer.user_permissions.add(Permission.objects.get(codename="view_customuser"))
+        self.client.force_login(viewer)
+        self.act("resend_verification")
+        self.assertFalse(UserEvent.objects.filter(event_type=USER_VERIFICATION_REQUESTED).exists())
+
+        self.client.force_login(self.staff)
+        response = self.act("resend_verification")
+        self.assertContains(response, "Resent verification to 3 of 3 selected users in 1 batch(es); 3 email(s) queued")
+        self.assertEqual(len(mail.outbox), 0)
+        dispatch_batch([EmailSink()])
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_expire_invitations_drops_cached_tokens(self):
+        invitation = CustomerInvitation.objects.create(
+            email="guest@example.com", customer=self.staff, token="tok-1",
+            expires_at=timezone.now() + timedelta(days=7))
+        cache.set("invitation:tok-1", {"email": "guest@example.com"})
+        self.act("expire_invitations", model="customerinvitation", pks=[invitation.pk])
+        invitation.refresh_from_db()
+        self.assertLessEqual(invitation.expires_at, timezone.now())
+        self.assertIsNone(cache.get("invitation:tok-1"))
+
+    def test_resend_invitations_extends_and_emails(self):
+        invitation = CustomerInvitation.objects.create(
+            email="guest@example.com", customer=self.staff, token="tok-2",
+            expires_at=timezone.now() + timedelta(hours=1))
+        response = self.act("resend_invitations", model="customerinvitation", pks=[invitation.pk])
+        self.assertContains(response, "Resent 1 of 1 selected invitations in 1 batch(es); 1 email(s) queued")
+        invitation.refresh_from_db()
+        self.assertGreater(invitation.expires_at, timezone.now() + timedelta(days=6))
+
+        dispatch_batch([EmailSink()])
+        self.assertEqual(mail.outbox[0].to, ["guest@example.com"])
+        self.assertIn("invitation=tok-2", mail.outbox[0].body)
+
+
+class BlockingStream(io.StringIO):
+    """A stdout whose reader has stalled until ``release`` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.release.wait(5)
+        return super().write(text)
+
+
+class StructuredLoggingTests(SimpleTestCase):
+    def record(self, msg="hello %s", args=("world",), level=logging.INFO, **extra):
+        record = logging.LogRecord("users.test", level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_record_carries_request_id_and_extra(self):
+        data = json.loads(JsonFormatter().format(self.record(request_id="abc", user_id=7)))
+        self.assertEqual(data["message"], "hello world")
+        self.assertEqual(data["request_id"], "abc")
+        self.assertEqual(data["user_id"], 7)
+
+    def test_sampling_by_level(self):
+        sampling = SamplingFilter("DEBUG=0,INFO=1")
+        self.assertFalse(sampling.filter(self.record(level=logging.DEBUG)))
+        self.assertTrue(sampling.filter(self.record(level=logging.INFO)))
+        self.assertTrue(sampling.filter(self.record(level=logging.ERROR)))
+
+    def test_stalled_writer_drops_instead_of_blocking(self):
+        stream = BlockingStream()
+        handler = QueueingHandler(maxsize=2, stream=stream)
+        dropped = log_records_dropped.get()
+        start = time.perf_counter()
+        for i in range(10):
+            handler.handle(self.record(args=(i,)))
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertGreater(log_records_dropped.get(), dropped)
+
+        stream.release.set()
+        handler.flush_and_stop()
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(json.loads(lines[0])["message"], "hello 0")
+
+    def test_request_id_header_round_trip(self):
+        seen = []
+
+        def view(request):
+            seen.append(request_id.get())
+            return HttpResponse()
+
+        response = RequestLogMiddleware(view)(RequestFactory().get("/", HTTP_X_REQUEST_ID="req-123"))
+        self.assertEqual(seen, ["req-123"])
+        self.assertEqual(response["X-Request-ID"], "req-123")
+        self.assertIsNone(request_id.get())
+
+
+class HealthCheckTests(SimpleTestCase):
+    # SimpleTestCase fails any database query: probes must not touch it.
+
+    def monitor(self, **probes):
+        calls = []
+
+        def probe(name, ok):
+            def run():
+                calls.append(name)
+                if not ok:
+                    raise ConnectionError(f"{name} down")
+            return run
+
+        monitor = HealthMonitor(
+            {name: probe(name, ok) for name, ok in probes.items()},
+            interval=5, critical=["database", "cache"], stale_after=30)
+        monitor.thread_pid = os.getpid()  # no background thread in tests
+        monitor.calls = calls
+        return monitor
+
+    def test_liveness_skips_the_stack(self):
+        response = self.client.get("/healthz")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("sessionid", response.cookies)
+
+    def test_readiness_serves_cached_results(self):
+        monitor = self.monitor(database=True, cache=True, thingsboard=False)
+        with mock.patch("backend.health._monitor", monitor):
+            self.assertEqual(self.client.get("/readyz").json()["status"], "starting")
+            monitor.run_once()
+            for _ in range(5):
+                response = self.client.get("/readyz/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "degraded")
+        self.assertEqual(len(monitor.calls), 3)
+
+    def test_readiness_fails_when_critical_dependency_down(self):
+        monitor = self.monitor(database=False, cache=True)
+        with self.assertLogs("backend.health", "WARNING") as logs:
+            monitor.run_once()
+        self.assertEqual(logs.records[0].error, "database down")
+        with mock.patch("backend.health._monitor", monitor):
+            response = self.client.get("/readyz")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["dependencies"]["database"], {"ok": False, "latency_ms": mock.ANY})
+        self.assertNotIn("database down", response.content.decode())
+
+    def test_stale_results_fail_readiness(self):
+        monitor = self.monitor(database=True, cache=True)
+        monitor.run_once()
+        monitor.checked_at -= 60
+        self.assertEqual(monitor.status()[0], False)
+
+
+class StartupBudgetTests(SimpleTestCase):
+    @skipUnless(TIME_BUDGETS, "wall-clock budgets need TEST_TIME_BUDGETS=1")
+    def test_worker_boot_within_budget(self):
+        boots = [profile_boot() for _ in range(2)]
+        best = min(boots, key=lambda boot: boot["total_ms"])
+        self.assertLessEqual(
+            best["total_ms"], BOOT_BUDGET_MS,
+            f"Worker boot took {best['total_ms']} ms (phases: {best['phases']}); "
+            "run `manage.py startup_profile` to find the slow imports.")
+
+    def test_heavy_modules_load_lazily(self):
+        imported = {name for name, *_ in profile_boot(importtime=True)["imports"]}
+        self.assertEqual(sorted(m for m in LAZY_MODULES if m in imported), [])
+
+
+@override_settings(**FAST_TEST_SETTINGS)
+class MembershipStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = CustomUser.objects.create_user(
+            username="owner@example.com", email="owner@example.com", phone_number="+201001234600",
+            password="pw", is_approved=True)
+        self.client.force_login(self.customer)
+
+    def counters(self):
+        return self.client.get("/api/auth/membership-stats/").json()
+
+    def test_counters_follow_invitation_registration_and_approval(self):
+        self.client.post("/api/auth/send-invitation/", {"email": "member@example.com"})
+        self.assertEqual(self.counters()["open_invitations"], 1)
+
+        token = CustomerInvitation.objects.get().token
+        cache.set("verified_member@example.com", True)
+        with mock.patch("services.thingboard_services.create_tb_user", return_value={}), \
+                mock.patch("services.thingboard_services.get_customer_id_by_email", return_value="tb-customer-uuid"):
+            self.client.post("/api/auth/complete-registeration/", {
+                "email": "member@example.com", "phone_number": "+201001234601",
+                "password": "Sup3r-secret-pass", "confirm_password": "Sup3r-secret-pass",
+                "invitation_token": token,
+            }, content_type="application/json")
+        stats = self.counters()
+        self.assertEqual((stats["pending_members"], stats["open_invitations"]), (1, 0))
+
+        self.client.force_login(self.customer)
+        member = CustomUser.objects.get(email="member@example.com")
+        self.client.get(f"/api/auth/approve-user/{member.pk}/")
+        stats = self.counters()
+        self.assertEqual((stats["approved_members"], stats["pending_members"]), (1, 0))
+
+        # The increments agree with a full recount.
+        self.assertEqual(recompute_all(), (1, 0))
+
+    def test_nightly_recompute_corrects_drift(self):
+        self.counters()
+        CustomerInvitation.objects.create(
+            email="late@example.com", customer=self.customer, token="tok-x",
+            expires_at=timezone.now() + timedelta(days=1))  # no hook: drift
+        self.assertEqual(recompute_all(), (1, 1))
+        self.assertEqual(self.counters()["open_invitations"], 1)
+
+    def test_only_customers_have_stats(self):
+        member = CustomUser.objects.create_user(
+            username="m@example.com", email="m@example.com", phone_number="+201001234602",
+            user_type="CUSTOMER_USER", parent_customer_id=str(self.customer.pk))
+        self.client.force_login(member)
+        self.assertEqual(self.client.get("/api/auth/membership-stats/").status_code, 403)
+
+
+@override_settings(**FAST_TEST_SETTINGS)
+class AuthAuditTests(TestCase):
+    def setUp(self):
+        self.buffer = audit.get_buffer()
+        self.buffer.clear()
+        self.addCleanup(self.buffer.clear)
+        self.user = CustomUser.objects.create_user(
+            username="owner@example.com", email="owner@example.com", phone_number="+201001234610",
+            password="pw", email_verified=True, is_approved=True)
+
+    def login(self, password):
+        return self.client.post("/api/auth/login/", {"email": "Owner@Example.com", "password": password},
+                                content_type="application/json")
+
+    def test_logins_are_buffered_then_written_together(self):
+        self.login("wrong")
+        self.login("pw")
+        self.assertFalse(AuthAuditEvent.objects.exists())
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(sum("INSERT" in q["sql"] for q in context.captured_queries), 1)
+
+        failed, succeeded = AuthAuditEvent.objects.order_by("id")
+        self.assertEqual((failed.success, failed.user_id, failed.detail), (False, None, {"reason": "invalid_credentials"}))
+        self.assertEqual((succeeded.success, succeeded.user_id), (True, self.user.pk))
+        self.assertEqual(succeeded.identifier, "owner@example.com")
+        self.assertEqual(succeeded.ip_address, "127.0.0.1")
+        self.assertTrue(succeeded.request_id)
+
+    @override_settings(AUDIT_BATCH_SIZE=2)
+    def test_full_buffer_is_written(self):
+        audit.record(AuthAuditEvent.OTP_GENERATED, identifier="+201001234610", purpose="login")
+        self.assertEqual(AuthAuditEvent.objects.count(), 0)
+        audit.record(AuthAuditEvent.OTP_VERIFIED, identifier="+201001234610", purpose="login")
+        self.assertEqual(AuthAuditEvent.objects.count(), 2)
+
+    def test_failed_insert_is_spooled_and_replayed(self):
+        with tempfile.TemporaryDirectory() as spool_dir, override_settings(AUDIT_SPOOL_DIR=spool_dir):
+            audit.record(AuthAuditEvent.LOGIN, user=self.user, identifier="owner@example.com")
+            with mock.patch("users.audit.write_events", side_effect=OperationalError("primary is down")):
+                self.buffer.flush()
+            self.assertEqual(len(audit.spool_files()), 1)
+            self.assertFalse(AuthAuditEvent.objects.exists())
+
+            # The next successful insert writes the spool back.
+            audit.record(AuthAuditEvent.LOGIN, user=self.user, identifier="owner@example.com")
+            self.buffer.flush()
+            self.assertEqual(AuthAuditEvent.objects.count(), 2)
+            self.assertEqual(audit.spool_files(), [])
+
+            # Files left by a dead worker are replayed by the command.
+            self.buffer.spool([AuthAuditEvent(action=AuthAuditEvent.APPROVAL, user_id=self.user.pk)])
+            self.buffer.spooled = False
+            call_command("replay_audit_spool", "--min-age=0", stdout=io.StringIO())
+            self.assertEqual(AuthAuditEvent.objects.filter(action=AuthAuditEvent.APPROVAL).count(), 1)
+            self.assertEqual(audit.spool_files(), [])
+
+    def test_admin_searches_exact_identifier(self):
+        AuthAuditEvent.objects.bulk_create([
+            AuthAuditEvent(action=AuthAuditEvent.LOGIN, identifier="owner@example.com"),
+            AuthAuditEvent(action=AuthAuditEvent.LOGIN, identifier="+201001234610"),
+        ])
+        staff = CustomUser.objects.create_superuser(
+            username="staff@example.com", email="staff@example.com", password="pw", phone_number="+201001234611")
+        self.client.force_login(staff)
+        response = self.client.get("/admin/users/authauditevent/", {"q": "010 0123 4610", "action__exact": "login"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["cl"].result_list.values_list("identifier", flat=True)), ["+201001234610"])
+
+
+@override_settings(**FAST_TEST_SETTINGS)
+class SessionCleanupTests(TestCase):
+    def make_sessions(self, model, expired, live):
+        now = timezone.now()
+        model.objects.bulk_create(
+            [model(session_key=f"expired{i}", session_data="", expire_date=now - timedelta(minutes=i + 1))
+             for i in range(expired)]
+            + [model(session_key=f"live{i}", session_data="", expire_date=now + timedelta(minutes=2))
+               for i in range(live)]
+        )
+
+    def test_expired_sessions_are_deleted_in_batches(self):
+        self.make_sessions(Session, expired=5, live=2)
+        with CaptureQueriesContext(connection) as context:
+            deleted = delete_expired(Session, timezone.now(), batch_size=2)
+        self.assertEqual(deleted, 5)
+        self.assertEqual(sum(q["sql"].startswith("DELETE") for q in context.captured_queries), 3)
+        self.assertEqual(sorted(Session.objects.values_list("session_key", flat=True)), ["live0", "live1"])
+
+    def test_command_reports_throughput(self):
+        self.make_sessions(Session, expired=3, live=1)
+        out = io.StringIO()
+        call_command("cleanup_sessions", "--batch-size=2", "--pause=0", stdout=out)
+        self.assertIn("Deleted 3 expired sessions", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+        self.assertIn("1 live rows", out.getvalue())
+
+    @override_settings(SESSION_ENGINE="users.sessions")
+    def test_partitioned_engine_stores_sessions_on_the_primary(self):
+        user = CustomUser.objects.create_user(
+            username="owner@example.com", email="owner@example.com", phone_number="+201001234620",
+            password="pw", email_verified=True, is_approved=True)
+        self.client.post("/api/auth/login/", {"email": "owner@example.com", "password": "pw"},
+                         content_type="application/json")
+        self.assertEqual(PartitionedSession.objects.get().get_decoded()["_auth_user_id"], str(user.pk))
+        self.assertFalse(Session.objects.exists())
+
+        with override_settings(DATABASE_REPLICA_ALIASES=["replica_1"]), \
+                mock.patch("backend.db_router.replica_lag", return_value=0):
+            self.assertEqual(PrimaryReplicaRouter().db_for_read(PartitionedSession), "default")
+
+        self.make_sessions(PartitionedSession, expired=2, live=0)
+        call_command("cleanup_sessions", stdout=io.StringIO())
+        self.assertEqual(PartitionedSession.objects.count(), 1)
+
+    @override_settings(SESSION_ENGINE="users.sessions")
+    def test_partitioned_engine_refuses_a_key_taken_in_any_partition(self):
+        PartitionedSession.objects.create(
+            session_key="taken-session-key", session_data="", expire_date=timezone.now() + timedelta(days=3))
+        store = PartitionedSession.get_session_store_class()(session_key="taken-session-key")
+        with CaptureQueriesContext(connection) as context, self.assertRaises(CreateError):
+            store.save(must_create=True)
+        self.assertFalse(any(q["sql"].startswith("INSERT") for q in context.captured_queries))
+
+
+@override_settings(**FAST_TEST_SETTINGS, TB_BASE_URL="")
+class WarmupTests(TestCase):
+    def test_steps_warm_recent_users(self):
+        CustomUser.objects.create_user(
+            username="owner@example.com", email="owner@example.com", phone_number="+201001234630",
+            last_login=timezone.now())
+        cache.set("tb:customer-id:owner@example.com", "tb-1")
+        cache.set("tb:devices:tb-1", [{"id": "dev-1"}])
+
+        warmup = Warmup(STEPS, budget=10)
+        results = warmup.run()
+        self.assertEqual(warmup.state, Warmup.DONE)
+        self.assertTrue(all(result["ok"] for result in results.values()), results)
+        self.assertEqual(results["thingsboard"]["skipped"], "TB_BASE_URL not set")
+        self.assertEqual(
+            {k: results["recent_users"][k] for k in ("users", "customer_ids", "device_lists")},
+            {"users": 1, "customer_ids": 1, "device_lists": 1})
+
+    def test_budget_skips_remaining_steps_without_holding_readiness(self):
+        warmup = Warmup({"slow": lambda deadline: time.sleep(0.05), "next": lambda deadline: None}, budget=0.01)
+        warmup.run()
+        self.assertEqual(warmup.state, Warmup.TIMED_OUT)
+        self.assertEqual(warmup.results["next"]["skipped"], "budget spent")
+        self.assertTrue(warmup.status()[0])
+
+    def test_readiness_waits_for_warmup(self):
+        monitor = HealthMonitor({}, interval=5, critical=[], stale_after=30)
+        monitor.thread_pid = os.getpid()  # no background threads in tests
+        monitor.run_once()
+        warmup = Warmup({"step": lambda deadline: None}, budget=10)
+        warmup.thread_pid = os.getpid()
+        with mock.patch("backend.health._monitor", monitor), mock.patch("users.warmup._warmup", warmup):
+            response = self.client.get("/readyz")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()["warmup"]["status"], "pending")
+            warmup.run()
+            response = self.client.get("/readyz")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["warmup"]["status"], "done")
+
+    def test_command_reports_steps(self):
+        out = io.StringIO()
+        call_command("warmup", stdout=out)
+        self.assertIn("phonenumbers", out.getvalue())
+        self.assertIn("Warmup done", out.getvalue())
+
+    def test_only_marked_server_processes_warm_up(self):
+        with mock.patch("users.warmup._server", False), mock.patch("users.warmup._warmup", None):
+            self.assertEqual(warmup_module.get_warmup().state, Warmup.DISABLED)
+
+            with mock.patch.object(Warmup, "ensure_started") as ensure_started:
+                warmup_module.on_server_start()
+            self.assertEqual(warmup_module.get_warmup().state, Warmup.PENDING)
+            ensure_started.assert_not_called()  # WARMUP_ON_START is off by default
+
+            with override_settings(WARMUP_ON_START=True), mock.patch.object(Warmup, "ensure_started") as ensure_started:
+                warmup_module.on_server_start()
+            ensure_started.assert_called_once_with()
@@ -3,15 +3,21 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
-from django.core.mail import send_mail
 from django.shortcuts import redirect
 from django.http import HttpResponse
 from django.conf import settings
 from django.utils import timezone
+from django.db import transaction
+import logging
 import uuid
-from .models import CustomUser, CustomerInvitation
+from .models import AuthAuditEvent, CustomUser, CustomerInvitation, CustomerMembershipStats
+from .emails import VERIFICATION_SUBJECT, verification_body
+from .identifiers import normalize_email, normalize_identifier, normalize_phone, user_lookup
+from . import audit, stats
+from .consumers import TICKET_MAX_AGE, make_ticket
+from .provisioning import get_parent_tb_customer_id
+from .events import USER_APPROVED, USER_EMAIL_VERIFIED, USER_PASSWORD_RESET, USER_REGISTERED, record_event
 from .serializers import  CustomerInvitationSerializer, RegisterInitSerializer, CompleteRegistrationSerializer
-from services.thingboard_services import create_tb_user
 import random
 from rest_framework import status
 from django.core.cache import cache
@@ -20,21 +26,26 @@ from rest_framework.response import Response
 from .serializers import OTPVerifySerializer
 from .serializers import ResetPasswordSerializer
 from rest_framework.views import APIView
+from backend.db_router import pin_to_primary
+from backend.metrics import record_cache_lookup
 
 # Login and Authentication Views
 from django.contrib.auth import authenticate, login, logout
-from rest_framework.authtoken.models import Token
+
+logger = logging.getLogger(__name__)
 
 
 # OTP functions
 
-def generate_otp(identifier: str, purpose: str):
+def generate_otp(identifier: str, purpose: str, request=None, user=None):
     """Generate and cache OTP for a specific identifier (phone/email) and purpose"""
     otp = str(random.randint(1000, 9999))  # 4-digit OTP
-    cache_key = f"otp_{identifier}"
+    cache_key = f"otp_{normalize_identifier(identifier)}"
     cache.set(cache_key, {"otp": otp, "purpose": purpose}, timeout=300)  # 5 minutes
+    audit.record(AuthAuditEvent.OTP_GENERATED, request, user=user,
+                 identifier=normalize_identifier(identifier), purpose=purpose)
     if settings.DEBUG:
-        print(f"[DEBUG OTP] Identifier={identifier}, Purpose={purpose}, OTP={otp}")
+        logger.debug("OTP generated", extra={"identifier": identifier, "purpose": purpose, "otp": otp})
 
     return otp
 
@@ -43,9 +54,9 @@ def verify_otp(identifier: str, otp: str) -> str | None:
     Verify OTP for identifier.
     Returns the purpose (registration/login/reset_password) if valid, else None.
     """
-    cache_key = f"otp_{identifier}"
+    cache_key = f"otp_{normalize_identifier(identifier)}"
     cached_data = cache.get(cache_key)
-    
+    record_cache_lookup("otp", cached_data is not None)
 
     if cached_data and cached_data["otp"] == otp:
         cache.delete(cache_key)  # 🔑 Prevent reuse
@@ -60,15 +71,15 @@ class RegisterInitView(APIView):
     serializer_class = RegisterInitSerializer
    
     def post(self, request):
-        phone = request.data.get("phone_number")
-        email = request.data.get("email")
+        phone = normalize_phone(request.data.get("phone_number"))
+        email = normalize_email(request.data.get("email"))
 
         if not phone or not email:
             return Response({"error": "Phone and Email are required"}, status=400)
 
         # 🔒 Check if email or phone already exists
         try:
-            existing_user = CustomUser.objects.get(email=email)
+            existing_user = CustomUser.objects.get(email__lower=email)
             return Response({
                 "error": "An account with this email already exists. Please use a different email or try logging in.",
                 "email_already_exists": True
@@ -86,11 +97,13 @@ class RegisterInitView(APIView):
             pass
 
         # ✅ No duplicates found, generate OTP
-        otp = generate_otp(email, "registration")
+        otp = generate_otp(email, "registration", request)
         return Response({"message": "OTP sent. Verify to continue."})
         
 
     def send_approval_request_email(self, user):
+        from services.email_services import send_email
+
         # Send email to customer asking for approval
         try:
             customer = CustomUser.objects.get(id=user.parent_customer_id)
@@ -98,17 +111,15 @@ class RegisterInitView(APIView):
             approval_link = f"{settings.FRONTEND_URL}/approve-user/{user.id}/"
             
             try:
-                send_mail(
+                send_email(
                     "New User Approval Request",
                     f"A new user {user.first_name} {user.last_name} ({user.email}) has requested to join your customer account. Click here to approve: {approval_link}",
-                    settings.DEFAULT_FROM_EMAIL,
                     [customer.email],
-                    fail_silently=False,
                 )
-            except Exception as e:
-                print(f"Approval email sending failed: {e}")
+            except Exception:
+                logger.exception("Approval request email failed", extra={"user_id": user.pk})
         except CustomUser.DoesNotExist:
-            print(f"Customer with ID {user.parent_customer_id} not found")
+            logger.warning("Parent customer not found", extra={"user_id": user.pk, "customer_id": user.parent_customer_id})
 
 
 class SendInvitationView(generics.CreateAPIView):
@@ -116,28 +127,85 @@ class SendInvitationView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
     
     def perform_create(self, serializer):
-        invitation = serializer.save(customer=self.request.user)
-        
-        # Generate unique token
-        invitation.token = str(uuid.uuid4())
-        invitation.expires_at = timezone.now() + timezone.timedelta(days=7)
-        invitation.save()
+        from services.email_services import send_email
+
+        with transaction.atomic():
+            # Token and expiry are set on insert: both columns are required.
+            invitation = serializer.save(
+                customer=self.request.user,
+                token=str(uuid.uuid4()),  # Generate unique token
+                expires_at=timezone.now() + timezone.timedelta(days=7),
+            )
+            stats.Changes().invitations([invitation.customer_id], 1).apply()
         
         # Send invitation email
         invitation_link = f"{settings.FRONTEND_URL}/register?invitation={invitation.token}"
         
         try:
-            send_mail(
+            send_email(
                 "You're invited to join our platform",
                 f"You've been invited by {self.request.user.first_name} {self.request.user.last_name} to join their customer account. Click here to register: {invitation_link}",
-                settings.DEFAULT_FROM_EMAIL,
                 [invitation.email],
-                fail_silently=False,
             )
-        except Exception as e:
-            print(f"Invitation email sending failed: {e}")
+        except Exception:
+            logger.exception("Invitation email failed", extra={"invitation_id": invitation.pk})
+
+
+def resolve_invitation(token):
+    """
+    The pending invitation for ``token`` as a dict, or None if it is unknown,
+    used or expired. One indexed lookup joined to the inviting customer,
+    cached for INVITATION_CACHE_TTL seconds.
+    """
+    if not token or len(token) > 100:
+        return None
+    cache_key = f"invitation:{token}"
+    invitation = cache.get(cache_key)
+    record_cache_lookup("invitation", invitation is not None)
+    if invitation is None:
+        row = CustomerInvitation.objects.filter(token=token, is_used=False).values(
+            "email", "expires_at", "customer_id", "customer__first_name", "customer__last_name",
+        ).first()
+        if row is None:
+            return None
+        invitation = {
+            "email": normalize_email(row["email"]),
+            "expires_at": row["expires_at"],
+            "customer_id": row["customer_id"],
+            "customer_name": " ".join(filter(None, (row["customer__first_name"], row["customer__last_name"]))),
+        }
+        cache.set(cache_key, invitation, timeout=settings.INVITATION_CACHE_TTL)
+    if invitation["expires_at"] <= timezone.now():
+        return None
+    return invitation
+
+
+def claim_invitation(token):
+    """Mark the invitation used; False if another request already did."""
+    claimed = CustomerInvitation.objects.filter(token=token, is_used=False).update(is_used=True)
+    cache.delete(f"invitation:{token}")
+    return bool(claimed)
+
+
+class InvitationDetailView(APIView):
+    """Resolves the token from an invitation link to the invited email and customer."""
+    permission_classes = [AllowAny]
+
+    def get(self, request, token):
+        invitation = resolve_invitation(token)
+        if invitation is None:
+            return Response({
+                "error": "Invalid or expired invitation. Please contact your customer administrator.",
+                "invalid_invitation": True
+            }, status=404)
+        return Response({
+            "email": invitation["email"],
+            "customer": {"id": invitation["customer_id"], "name": invitation["customer_name"]},
+            "expires_at": invitation["expires_at"],
+        })
 
 
+@pin_to_primary()
 def verify_email(request, uidb64, token):
     try:
         uid = urlsafe_base64_decode(uidb64).decode()
@@ -148,14 +216,19 @@ def verify_email(request, uidb64, token):
     if user is not None and default_token_generator.check_token(user, token):
         user.is_active = True
         user.email_verified = True  # ✅ Mark email as verified
-        user.save()
-        print(f"✅ Email verified for user: {user.email}")
+        with transaction.atomic():
+            user.save(update_fields=["is_active", "email_verified"])
+            record_event(USER_EMAIL_VERIFIED, user)
+        logger.info("Email verified", extra={"user_id": user.pk})
         return HttpResponse("<h1>Email verified successfully! You can now log in.</h1>")
     else:
         return HttpResponse("<h1>Invalid verification link or token expired.</h1>", status=400)
 
 
+@pin_to_primary()
 def approve_user(request, user_id):
+    from services.email_services import send_email
+
     try:
         user = CustomUser.objects.get(pk=user_id)
         customer = CustomUser.objects.get(id=user.parent_customer_id)
@@ -164,11 +237,20 @@ def approve_user(request, user_id):
         if request.user != customer:
             return HttpResponse("<h1>Unauthorized</h1>", status=403)
         
-        # Approve the user
-        user.is_approved = True
-        user.approved_by = customer
-        user.approved_at = timezone.now()
-        user.save()
+        # Approve the user. The conditional UPDATE makes the link safe to
+        # follow twice: only the first request approves, records and emails.
+        now = timezone.now()
+        with transaction.atomic():
+            approved = CustomUser.objects.filter(pk=user.pk, is_approved=False).update(
+                is_approved=True, approved_by=customer, approved_at=now,
+            )
+            if approved:
+                user.is_approved, user.approved_by, user.approved_at = True, customer, now
+                record_event(USER_APPROVED, user, approved_by=customer.pk)
+                stats.Changes().members_approved([user]).apply()
+        if not approved:
+            return HttpResponse("<h1>User already approved.</h1>")
+        audit.record(AuthAuditEvent.APPROVAL, request, user=user, identifier=user.email, approved_by=customer.pk)
         
         # Send activation email to approved user (using your existing email system)
         uidb64 = urlsafe_base64_encode(force_bytes(user.pk))
@@ -176,15 +258,13 @@ def approve_user(request, user_id):
         verification_link = f"{settings.FRONTEND_URL}/verify-email/{uidb64}/{token}/"
         
         try:
-            send_mail(
+            send_email(
                 "Your account has been approved",
                 f"Your account has been approved by {customer.first_name} {customer.last_name}. Click here to activate: {verification_link}",
-                settings.DEFAULT_FROM_EMAIL,
                 [user.email],
-                fail_silently=False,
             )
-        except Exception as e:
-            print(f"Approval email sending failed: {e}")
+        except Exception:
+            logger.exception("Approval email failed", extra={"user_id": user.pk})
         
         return HttpResponse("<h1>User approved successfully!</h1>")
     except CustomUser.DoesNotExist:
@@ -196,7 +276,7 @@ def verify_otp_view(request):
     serializer = OTPVerifySerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
 
-    identifier = request.data.get("email") or request.data.get("phone_number")
+    identifier = normalize_identifier(request.data.get("email") or request.data.get("phone_number"))
     otp_input = request.data.get("otp")
 
     if not identifier or not otp_input:
@@ -204,6 +284,7 @@ def verify_otp_view(request):
 
     # ✅ Verify OTP against cache
     purpose = verify_otp(identifier, otp_input)
+    audit.record(AuthAuditEvent.OTP_VERIFIED, request, identifier=identifier, success=bool(purpose), purpose=purpose)
 
     if not purpose:
         return Response({"error": "Invalid or expired OTP"}, status=400)
@@ -216,13 +297,11 @@ def verify_otp_view(request):
     elif purpose == "login":
         # Get user by phone number or email
         try:
-            if "@" in identifier:
-                user = CustomUser.objects.get(email=identifier)
-            else:
-                user = CustomUser.objects.get(phone_number=identifier)
+            user = CustomUser.objects.get(**user_lookup(identifier))
             
             # Login the user
             login(request, user)
+            audit.record(AuthAuditEvent.LOGIN, request, user=user, identifier=identifier, method="otp")
             
             return Response({
                 "message": "Login successful",
@@ -239,6 +318,8 @@ def verify_otp_view(request):
             })
             
         except CustomUser.DoesNotExist:
+            audit.record(AuthAuditEvent.LOGIN, request, identifier=identifier, success=False,
+                         method="otp", reason="unknown_user")
             return Response({"error": "User not found"}, status=400)
 
     elif purpose == "reset_password":
@@ -253,18 +334,17 @@ def verify_otp_view(request):
 @permission_classes([AllowAny])
 class RequestResetPasswordView(APIView):
     def post(self, request):
-        identifier = request.data.get("phone_number") or request.data.get("email")
+        identifier = normalize_identifier(request.data.get("phone_number") or request.data.get("email"))
         if not identifier:
             return Response({"error": "Phone or Email is required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
+            user = CustomUser.objects.get(**user_lookup(identifier))
             if "@" in identifier:
-                user = CustomUser.objects.get(email=identifier)
                 if not user.email_verified:
                     return Response({"error": "Email not verified. Please verify your email first."}, status=status.HTTP_400_BAD_REQUEST)
                 method = "email"
             else:
-                user = CustomUser.objects.get(phone_number=identifier)
                 method = "phone_number"
         except CustomUser.DoesNotExist:
             return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
@@ -272,7 +352,9 @@ class RequestResetPasswordView(APIView):
         # Generate OTP with purpose = password_reset
         generate_otp(
             identifier=identifier,
-            purpose="reset_password"
+            purpose="reset_password",
+            request=request,
+            user=user,
         )
 
         return Response(
@@ -283,25 +365,27 @@ class RequestResetPasswordView(APIView):
 @permission_classes([AllowAny])
 class ResetPasswordView(APIView):
     def post(self, request):
-        identifier = request.data.get("phone_number") or request.data.get("email")
+        identifier = normalize_identifier(request.data.get("phone_number") or request.data.get("email"))
         if not identifier:
             return Response({"error": "Phone or Email is required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            if "@" in identifier:
-                user = CustomUser.objects.get(email=identifier)
-                if not user.email_verified:
-                    return Response({"error": "Email not verified. Please verify your email first."}, status=status.HTTP_400_BAD_REQUEST)
-            else:
-                user = CustomUser.objects.get(phone_number=identifier)
+            user = CustomUser.objects.get(**user_lookup(identifier))
+            if "@" in identifier and not user.email_verified:
+                return Response({"error": "Email not verified. Please verify your email first."}, status=status.HTTP_400_BAD_REQUEST)
         except CustomUser.DoesNotExist:
             return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
 
         # serializer with password + confirm
         serializer = ResetPasswordSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(user)
+            with transaction.atomic():
+                serializer.save(user)
+                record_event(USER_PASSWORD_RESET, user)
+            audit.record(AuthAuditEvent.PASSWORD_RESET, request, user=user, identifier=identifier)
             return Response({"message": "Password reset successful."}, status=status.HTTP_200_OK)
+        audit.record(AuthAuditEvent.PASSWORD_RESET, request, user=user, identifier=identifier,
+                     success=False, reason="invalid_password")
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -310,12 +394,15 @@ class CompleteRegistrationView(APIView):
     serializer_class = CompleteRegistrationSerializer
 
     def post(self, request):
+        from services.email_services import send_email
+        from services.thingboard_services import create_tb_user
+
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         validated = serializer.validated_data
     
-        phone = validated.get("phone_number")
-        email = validated.get("email")
+        phone = normalize_phone(validated.get("phone_number"))
+        email = normalize_email(validated.get("email"))
         password = validated.get("password")
         confirm = validated.get("confirm_password")
 
@@ -326,13 +413,27 @@ class CompleteRegistrationView(APIView):
             return Response({"error": "Passwords do not match"}, status=400)
 
         # ✅ ensure OTP was verified
-        if not cache.get(f"verified_{email}") and not cache.get(f"verified_{phone}"):
+        otp_verified = cache.get(f"verified_{email}") or cache.get(f"verified_{phone}")
+        record_cache_lookup("otp_verified", bool(otp_verified))
+        if not otp_verified:
             return Response({"error": "OTP not verified"}, status=400)
 
         # 🔒 CUSTOMER_USER can only register with invitation
         user_type = validated.get("user_type")
-        if user_type == 'CUSTOMER_USER':
-            invitation_customer_id = request.data.get("invitation_customer_id")
+        parent_customer_id = validated.get("parent_customer_id")
+        invitation_token = validated.get("invitation_token")
+        invitation_customer_id = request.data.get("invitation_customer_id")
+        if invitation_token:
+            # The token from the invitation link identifies email and customer in one lookup.
+            invitation = resolve_invitation(invitation_token)
+            if invitation is None or invitation["email"] != email:
+                return Response({
+                    "error": "Invalid or expired invitation. Please contact your customer administrator.",
+                    "invalid_invitation": True
+                }, status=400)
+            user_type = "CUSTOMER_USER"
+            invitation_customer_id = parent_customer_id = str(invitation["customer_id"])
+        elif user_type == 'CUSTOMER_USER':
             if not invitation_customer_id:
                 return Response({
                     "error": "CUSTOMER_USER registration requires an invitation. Please contact your customer administrator.",
@@ -342,17 +443,12 @@ class CompleteRegistrationView(APIView):
             # Verify the invitation exists and is valid
             try:
                 invitation = CustomerInvitation.objects.get(
-                    email=email,
+                    email__lower=email,
                     customer_id=invitation_customer_id,
                     is_used=False,
                     expires_at__gt=timezone.now()
                 )
-                print(f"✅ Valid invitation found for {email}")
-                
-                # Mark invitation as used
-                invitation.is_used = True
-                invitation.save()
-                print(f"✅ Invitation marked as used for {email}")
+                logger.info("Valid invitation found", extra={"invitation_id": invitation.pk})
                 
             except CustomerInvitation.DoesNotExist:
                 return Response({
@@ -362,7 +458,7 @@ class CompleteRegistrationView(APIView):
 
         # 🔒 Double-check for duplicates (in case user was created between OTP and completion)
         try:
-            existing_user = CustomUser.objects.get(email=email)
+            existing_user = CustomUser.objects.get(email__lower=email)
             return Response({
                 "error": "An account with this email already exists. Please use a different email or try logging in.",
                 "email_already_exists": True
@@ -379,48 +475,69 @@ class CompleteRegistrationView(APIView):
         except CustomUser.DoesNotExist:
             pass
 
-        # ✅ create user only now (single call!)
-        user = CustomUser.objects.create_user(
-            username=email,   # or phone if you prefer
-            email=email,
-            phone_number=phone,
-            password=password,
-            user_type=validated.get("user_type"),
-            parent_customer_id=validated.get("parent_customer_id"),
-            is_active=True
-        )
-        
+        # ✅ create user only now (single call!), together with its outbox event
         # ✅ Auto-approve CUSTOMER users, CUSTOMER_USER needs approval
-        if user.user_type == 'CUSTOMER':
-            user.is_approved = True
-            user.save()
-            print(f"✅ Auto-approved CUSTOMER user: {user.email}")
+        with transaction.atomic():
+            # The invitation is spent in the same transaction as the user insert,
+            # so a registration that fails leaves it usable.
+            if invitation_token:
+                claimed = claim_invitation(invitation_token)
+            elif invitation_customer_id:
+                claimed = CustomerInvitation.objects.filter(pk=invitation.pk, is_used=False).update(is_used=True)
+            else:
+                claimed = True
+            if not claimed:
+                return Response({
+                    "error": "Invalid or expired invitation. Please contact your customer administrator.",
+                    "invalid_invitation": True
+                }, status=400)
+            user = CustomUser.objects.create_user(
+                username=email,   # or phone if you prefer
+                email=email,
+                phone_number=phone,
+                password=password,
+                user_type=user_type,
+                parent_customer_id=parent_customer_id,
+                is_active=True,
+                is_approved=user_type == 'CUSTOMER',
+            )
+            record_event(USER_REGISTERED, user, invited=bool(invitation_customer_id))
+            changes = stats.Changes().members_added([user])
+            if invitation_customer_id:
+                changes.invitations([invitation_customer_id], -1)
+            changes.apply()
+        
+        if user.is_approved:
+            logger.info("Customer auto-approved", extra={"user_id": user.pk})
         else:
             # CUSTOMER_USER needs approval from parent customer
-            user.is_approved = False
-            user.save()
-            print(f"⏳ CUSTOMER_USER pending approval: {user.email}")
+            logger.info("Customer user pending approval", extra={"user_id": user.pk})
             
             # Send approval request email to parent customer
             try:
                 self.send_approval_request_email(user)
-                print(f"✅ Approval request sent to parent customer")
-            except Exception as e:
-                print(f"❌ Approval request failed: {e}")
+                logger.info("Approval request sent to parent customer", extra={"user_id": user.pk})
+            except Exception:
+                logger.exception("Approval request failed", extra={"user_id": user.pk})
 
         # ✅ create ThingsBoard user
         try:
-            # If the request has an invitation token (means user invited by an existing customer)
-            invitation_customer_id = request.data.get("invitation_customer_id")
+            # If the request has an invitation (means user invited by an existing customer)
             if invitation_customer_id:
-                # User was invited -> create CUSTOMER_USER under that customer
-                create_tb_user(
-                    email=user.email,
-                    first_name=user.first_name or "",
-                    last_name=user.last_name or "",
-                    user_type="CUSTOMER_USER",
-                    parent_customer_id=invitation_customer_id
-                )
+                # User was invited -> create CUSTOMER_USER under that customer's ThingsBoard customer
+                tb_customer_id = get_parent_tb_customer_id(invitation_customer_id)
+                if tb_customer_id:
+                    create_tb_user(
+                        email=user.email,
+                        first_name=user.first_name or "",
+                        last_name=user.last_name or "",
+                        user_type="CUSTOMER_USER",
+                        parent_customer_id=tb_customer_id
+                    )
+                else:
+                    # reconcile_thingsboard provisions the user once the customer exists there.
+                    logger.warning("Inviting customer not found in ThingsBoard",
+                                   extra={"user_id": user.pk, "parent_customer_id": invitation_customer_id})
             else:
                 create_tb_user(
                     email=user.email,
@@ -428,25 +545,15 @@ class CompleteRegistrationView(APIView):
                     last_name=user.last_name or "",
                     user_type="CUSTOMER"
                 )
-        except Exception as e:
-            print(f"ThingsBoard user creation failed: {e}")
+        except Exception:
+            logger.exception("ThingsBoard user creation failed", extra={"user_id": user.pk})
 
         # ✅ Send verification email after user creation
         try:
-            uidb64 = urlsafe_base64_encode(force_bytes(user.pk))
-            token = default_token_generator.make_token(user)
-            verification_link = f"{settings.FRONTEND_URL}/verify-email/{uidb64}/{token}/"
-            
-            send_mail(
-                "Verify your email - BeySmart App",
-                f"Welcome to BeySmart! Please click the following link to verify your email address:\n\n{verification_link}\n\nThis link will expire in 24 hours.\n\nIf you didn't create this account, please ignore this email.",
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-                fail_silently=False,
-            )
-            print(f"✅ Verification email sent to {user.email}")
-        except Exception as e:
-            print(f"❌ Verification email sending failed: {e}")
+            send_email(VERIFICATION_SUBJECT, verification_body(user), [user.email])
+            logger.info("Verification email sent", extra={"user_id": user.pk})
+        except Exception:
+            logger.exception("Verification email failed", extra={"user_id": user.pk})
 
         return Response({"message": "Registration complete. Please check your email to verify your account."})
 
@@ -456,7 +563,7 @@ class LoginView(APIView):
     permission_classes = [AllowAny]
     
     def post(self, request):
-        email = request.data.get('email')
+        email = normalize_email(request.data.get('email'))
         password = request.data.get('password')
         
         if not email or not password:
@@ -466,13 +573,17 @@ class LoginView(APIView):
         user = authenticate(username=email, password=password)
         
         if user is None:
+            audit.record(AuthAuditEvent.LOGIN, request, identifier=email, success=False, reason="invalid_credentials")
             return Response({"error": "Invalid credentials"}, status=400)
         
         if not user.is_active:
+            audit.record(AuthAuditEvent.LOGIN, request, user=user, identifier=email, success=False, reason="inactive")
             return Response({"error": "Account is deactivated"}, status=400)
         
         # ✅ Check if email is verified (REQUIRED for email login)
         if not user.email_verified:
+            audit.record(AuthAuditEvent.LOGIN, request, user=user, identifier=email, success=False,
+                         reason="email_not_verified")
             return Response({
                 "error": "Email not verified. Please verify your email first, or use phone + OTP login.",
                 "email_verification_required": True,
@@ -480,10 +591,13 @@ class LoginView(APIView):
             }, status=400)
         
         if not user.is_approved and user.user_type == 'CUSTOMER_USER':
+            audit.record(AuthAuditEvent.LOGIN, request, user=user, identifier=email, success=False,
+                         reason="pending_approval")
             return Response({"error": "Account pending approval"}, status=400)
         
         # Login the user
         login(request, user)
+        audit.record(AuthAuditEvent.LOGIN, request, user=user, identifier=email, method="password")
         
         return Response({
             "message": "Login successful",
@@ -503,7 +617,7 @@ class PhoneOTPLoginView(APIView):
     permission_classes = [AllowAny]
     
     def post(self, request):
-        phone_number = request.data.get('phone_number')
+        phone_number = normalize_phone(request.data.get('phone_number'))
         
         if not phone_number:
             return Response({"error": "Phone number is required"}, status=400)
@@ -520,7 +634,7 @@ class PhoneOTPLoginView(APIView):
                 return Response({"error": "Account pending approval"}, status=400)
             
             # Generate OTP for phone login
-            otp = generate_otp(phone_number, "login")
+            otp = generate_otp(phone_number, "login", request, user)
             
             return Response({
                 "message": "OTP sent to your phone number. Please verify to continue."
@@ -592,12 +706,37 @@ class CheckAuthView(APIView):
             }
         })
 
+class MembershipStatsView(APIView):
+    """Member and invitation counts for the signed-in customer, read from one row by primary key."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if request.user.user_type != "CUSTOMER":
+            return Response({"error": "Only customer accounts have members"}, status=403)
+        row = self.read(request.user.pk)
+        if row is None:
+            # First look at a customer nothing has been counted for yet; count on the primary.
+            with pin_to_primary():
+                stats.recompute([request.user.pk])
+                row = self.read(request.user.pk)
+        return Response(row)
+
+    def read(self, customer_id):
+        return CustomerMembershipStats.objects.filter(pk=customer_id).values(*stats.COUNTERS, "updated_at").first()
+
+class WebSocketTicketView(APIView):
+    """Short-lived ticket for opening ws/account/ without a session cookie."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({"ticket": make_ticket(request.user), "expires_in": TICKET_MAX_AGE})
+
 class CheckAccountExistsView(APIView):
     permission_classes = [AllowAny]
     
     def post(self, request):
-        email = request.data.get('email')
-        phone_number = request.data.get('phone_number')
+        email = normalize_email(request.data.get('email'))
+        phone_number = normalize_phone(request.data.get('phone_number'))
         
         if not email and not phone_number:
             return Response({"error": "Email or phone number is required"}, status=400)
@@ -606,7 +745,7 @@ class CheckAccountExistsView(APIView):
         
         if email:
             try:
-                CustomUser.objects.get(email=email)
+                CustomUser.objects.get(email__lower=email)
                 exists['email'] = True
             except CustomUser.DoesNotExist:
                 exists['email'] = False
@@ -622,3 +761,86 @@ class CheckAccountExistsView(APIView):
             "exists": exists,
             "message": "Account existence checked successfully"
         })
+
+
+# ThingsBoard device proxy
+
+MAX_TELEMETRY_KEYS = 20
+
+
+def get_tb_customer_id(user):
+    """ThingsBoard customer whose devices ``user`` may see: their own, or their parent customer's."""
+    from services.thingboard_services import get_customer_id_by_email
+
+    if user.user_type == 'CUSTOMER_USER':
+        if not user.is_approved:
+            return None
+        return get_parent_tb_customer_id(user.parent_customer_id)
+    return get_customer_id_by_email(user.email)
+
+
+def parse_telemetry_keys(request):
+    keys = [k.strip() for k in request.query_params.get("keys", "").split(",") if k.strip()]
+    return keys[:MAX_TELEMETRY_KEYS]
+
+
+def format_telemetry(values):
+    """Collapse ThingsBoard's {key: [{ts, value}]} into {key: {ts, value}}."""
+    return {key: points[0] for key, points in (values or {}).items() if points}
+
+
+class DeviceListView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        from services.thingboard_services import get_customer_devices
+
+        try:
+            customer_id = get_tb_customer_id(request.user)
+            if not customer_id:
+                return Response({"error": "No ThingsBoard customer linked to this account"}, status=404)
+            devices = get_customer_devices(customer_id)
+        except Exception:
+            logger.exception("ThingsBoard device list failed", extra={"user_id": request.user.pk})
+            return Response({"error": "Device service unavailable"}, status=503)
+
+        return Response({
+            "devices": [
+                {
+                    "id": d["id"]["id"],
+                    "name": d.get("name"),
+                    "label": d.get("label"),
+                    "type": d.get("type"),
+                }
+                for d in devices
+            ]
+        })
+
+
+class DeviceTelemetryView(APIView):
+    """Latest telemetry for one device, or for all of the customer's devices when no id is given."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, device_id=None):
+        from services.thingboard_services import get_customer_devices, get_devices_telemetry
+
+        keys = parse_telemetry_keys(request)
+        try:
+            customer_id = get_tb_customer_id(request.user)
+            if not customer_id:
+                return Response({"error": "No ThingsBoard customer linked to this account"}, status=404)
+
+            device_ids = [d["id"]["id"] for d in get_customer_devices(customer_id)]
+            if device_id is not None:
+                if device_id not in device_ids:
+                    return Response({"error": "Device not found"}, status=404)
+                device_ids = [device_id]
+
+            telemetry = get_devices_telemetry(device_ids, keys)
+        except Exception:
+            logger.exception("ThingsBoard telemetry fetch failed", extra={"user_id": request.user.pk})
+            return Response({"error": "Device service unavailable"}, status=503)
+
+        return Response({
+            "telemetry": {d: format_telemetry(values) for d, values in telemetry.items()}
+        })
@@ -0,0 +1,230 @@
+"""
+Per-worker warmup after a deploy.
+
+A fresh worker would otherwise pay on its first requests for an empty
+connection pool, an unloaded URLconf, phone number metadata, a ThingsBoard
+client without a token and a cold cache connection. The steps below run
+once per process in a background thread, in order, within WARMUP_BUDGET
+seconds; steps the budget no longer covers are skipped:
+
+    database      open a connection (and the psycopg pool)
+    urls          load the URLconf
+    phonenumbers  load the metadata parse_phone() needs
+    thingsboard   start the shared client and get its admin token
+    recent_users  read the ThingsBoard customer ids and device lists of
+                  users active in the last WARMUP_RECENT_HOURS through the
+                  cache (filling this worker's local tier), and memoize
+                  their phone numbers
+
+Only server processes warm up: backend.wsgi and backend.asgi (and so
+runserver) mark themselves with ``on_server_start()``; tests, management
+commands, workers and scripts never do. A server starts the warmup with its
+first readiness probe, in each worker after the fork. WARMUP_ON_START starts
+it as soon as the application is loaded instead; leave it off with
+``gunicorn --preload``, where that happens in the master before the fork
+and would open its database connection there. /readyz reports progress
+and, with WARMUP_BLOCKS_READINESS, stays "starting" until it has finished
+or used its budget. ``manage.py warmup`` runs the same steps in the foreground;
+with --fill-shared it also fetches missing ThingsBoard data into the
+shared cache, once per deploy instead of once per worker.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+import phonenumbers
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.urls import get_resolver
+from django.utils import timezone
+
+from backend import health
+
+from .identifiers import DEFAULT_REGION, parse_phone
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+
+# Steps take the monotonic deadline of the whole warmup and return a detail dict (or None).
+
+def warm_database(deadline):
+    connections["default"].ensure_connection()
+
+
+def warm_urls(deadline):
+    return {"patterns": len(get_resolver().url_patterns)}
+
+
+def warm_phonenumbers(deadline):
+    example = phonenumbers.example_number(DEFAULT_REGION)
+    parse_phone(phonenumbers.format_number(example, phonenumbers.PhoneNumberFormat.E164))
+
+
+def warm_thingsboard(deadline):
+    if not settings.TB_BASE_URL:
+        return {"skipped": "TB_BASE_URL not set"}
+    from services.thingboard_services import run_sync
+
+    run_sync(lambda client: client.login())
+
+
+def recent_users(limit=None):
+    since = timezone.now() - timedelta(hours=settings.WARMUP_RECENT_HOURS)
+    return list(
+        CustomUser.objects.filter(last_login__gte=since, is_active=True)
+        .order_by("-last_login")
+        .values("email", "phone_number", "user_type", "parent_customer_id")[:limit or settings.WARMUP_RECENT_USERS]
+    )
+
+
+def owner_emails(users):
+    """Emails of the ThingsBoard customers whose devices ``users`` see (see views.get_tb_customer_id)."""
+    emails = {u["email"] for u in users if u["user_type"] != "CUSTOMER_USER"}
+    parent_ids = {u["parent_customer_id"] for u in users
+                  if u["user_type"] == "CUSTOMER_USER" and (u["parent_customer_id"] or "").isdigit()}
+    if parent_ids:
+        emails.update(CustomUser.objects.filter(pk__in=parent_ids).values_list("email", flat=True))
+    return sorted(emails)
+
+
+def warm_recent_users(deadline):
+    users = recent_users()
+    for user in users:
+        if user["phone_number"]:
+            parse_phone(str(user["phone_number"]))
+    customer_ids = cache.get_many([f"tb:customer-id:{email}" for email in owner_emails(users)])
+    devices = cache.get_many([f"tb:devices:{customer_id}" for customer_id in customer_ids.values()])
+    return {"users": len(users), "customer_ids": len(customer_ids), "device_lists": len(devices)}
+
+
+def fill_shared_cache(deadline):
+    """Fetch missing customer ids and device lists from ThingsBoard (manage.py warmup --fill-shared)."""
+    if not settings.TB_BASE_URL:
+        return {"skipped": "TB_BASE_URL not set"}
+    from services.thingboard_services import get_customer_devices, get_customer_id_by_email
+
+    filled = 0
+    for email in owner_emails(recent_users()):
+        if time.monotonic() >= deadline:
+            break
+        # Both read through the shared cache and store what they fetch.
+        customer_id = get_customer_id_by_email(email)
+        if customer_id:
+            get_customer_devices(customer_id)
+        filled += 1
+    return {"customers": filled}
+
+
+STEPS = {
+    "database": warm_database,
+    "urls": warm_urls,
+    "phonenumbers": warm_phonenumbers,
+    "thingsboard": warm_thingsboard,
+    "recent_users": warm_recent_users,
+}
+
+
+class Warmup:
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    TIMED_OUT = "timed_out"  # finished or abandoned after the budget; the worker serves anyway
+    DISABLED = "disabled"
+
+    def __init__(self, steps, budget, enabled=True):
+        self.steps = steps
+        self.budget = budget
+        self.state = self.PENDING if enabled else self.DISABLED
+        self.results = {}
+        self.started_at = None
+        self.elapsed_ms = None
+        self.thread_pid = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        self.started_at = time.monotonic()
+        self.state, self.results = self.RUNNING, {}
+        deadline = self.started_at + self.budget
+        timed_out = False
+        for name, step in self.steps.items():
+            if time.monotonic() >= deadline:
+                self.results[name] = {"ok": False, "skipped": "budget spent"}
+                timed_out = True
+                continue
+            start = time.perf_counter()
+            try:
+                result = {"ok": True, **(step(deadline) or {})}
+            except Exception as e:
+                logger.warning("Warmup step failed", extra={"step": name, "error": str(e)})
+                result = {"ok": False, "error": str(e) or type(e).__name__}
+            result["ms"] = round((time.perf_counter() - start) * 1000, 1)
+            self.results[name] = result
+        self.elapsed_ms = round((time.monotonic() - self.started_at) * 1000, 1)
+        self.state = self.TIMED_OUT if timed_out else self.DONE
+        logger.info("Warmup finished", extra={"state": self.state, "elapsed_ms": self.elapsed_ms})
+        return self.results
+
+    def ensure_started(self):
+        # Checked per process: a forked worker does not inherit the parent's thread or its warm state.
+        if self.state == self.DISABLED or self.thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self.thread_pid == os.getpid():
+                return
+            self.thread_pid = os.getpid()
+            self.state, self.results, self.started_at = self.PENDING, {}, None
+            threading.Thread(target=self._run_in_thread, name="warmup", daemon=True).start()
+
+    def _run_in_thread(self):
+        try:
+            self.run()
+        finally:
+            # Hand the connection back to the pool for the request threads.
+            connections["default"].close()
+
+    def status(self):
+        """``(finished, detail)`` for /readyz."""
+        state = self.state
+        if state == self.RUNNING and time.monotonic() - self.started_at > self.budget:
+            state = self.TIMED_OUT  # a step is hanging: stop holding readiness back
+        # Step errors are logged by run(); /readyz is public.
+        steps = {name: {"ok": result["ok"], "ms": result.get("ms")} for name, result in self.results.items()}
+        detail = {"status": state, "steps": steps}
+        if self.elapsed_ms is not None:
+            detail["elapsed_ms"] = self.elapsed_ms
+        finished = state in (self.DONE, self.TIMED_OUT, self.DISABLED) or not settings.WARMUP_BLOCKS_READINESS
+        return finished, detail
+
+
+_server = False  # set by on_server_start()
+_warmup = None
+
+
+def get_warmup():
+    global _warmup
+    if _warmup is None:
+        _warmup = Warmup(STEPS, settings.WARMUP_BUDGET, enabled=settings.WARMUP_ENABLED and _server)
+    return _warmup
+
+
+def _readiness():
+    warmup = get_warmup()
+    warmup.ensure_started()
+    return warmup.status()
+
+
+def on_app_ready():
+    """Called from UsersConfig.ready()."""
+    health.add_startup_gate("warmup", _readiness)
+
+
+def on_server_start():
+    """Called by backend.wsgi and backend.asgi once the application is loaded."""
+    global _server, _warmup
+    _server, _warmup = True, None
+    if settings.WARMUP_ON_START:
+        get_warmup().ensure_started()